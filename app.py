@@ -1,17 +1,40 @@
 import os
+import asyncio
 import requests
 import time
 import base64
 import json
 import logging
 import random
+import threading
+import queue
+import hashlib
+import math
+import re
+import mimetypes
+from collections import OrderedDict
 from datetime import datetime, timedelta
-from flask import Flask, jsonify, request, render_template, flash, send_file
+from urllib.parse import urlparse, urljoin, parse_qsl, urlencode, quote
+from flask import Flask, jsonify, request, render_template, flash, send_file, Response, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 from dotenv import load_dotenv
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from TikTokApi import TikTokApi
+from TikTokApi.api.video import Video
 from functools import wraps
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from shared_state import backend_from_url, MemoryBackend, SQLiteBackend
+from client_pool import ClientPool
+from tiktok_links import ShortLinkResolver
+from tiktok_jobs import DownloadJobs, stream_zip
+from metrics import MetricsRegistry
+from watchlist import RefreshScheduler
+from archive import PostArchive
+import records
+from records import MediaRecord, PostRecord, parse_fields, parse_quality, renditions
 
 # Configure logging
 logging.basicConfig(
@@ -22,8 +45,56 @@ logger = logging.getLogger(__name__)
 
 load_dotenv()
 
+# Per-stage latency, exposed on /metrics
+metrics = MetricsRegistry()
+upstream_latency = metrics.histogram(
+    "instagram_upstream_request_seconds", "Instagram API call latency per attempt",
+    ("endpoint", "cookie", "status", "attempt")
+)
+pacing_sleep = metrics.histogram(
+    "instagram_pacing_sleep_seconds", "Time spent sleeping for a cookie's send slot (pacing and backoff)",
+    ("cookie",), buckets=(0.01, 0.1, 0.5, 1, 2, 5, 10, 30, 60)
+)
+backoff_imposed = metrics.counter(
+    "instagram_backoff_imposed_seconds_total", "Backoff added to a cookie's send queue after failures", ("cookie",)
+)
+lookup_stage_latency = metrics.histogram(
+    "instagram_lookup_stage_seconds", "Wall time of each lookup stage (profile, stories, posts, total)", ("stage",)
+)
+parse_latency = metrics.histogram(
+    "instagram_parse_seconds", "Time turning upstream JSON into records", ("stage",),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)
+)
+serialize_latency = metrics.histogram(
+    "response_serialize_seconds", "Time serializing JSON response bodies",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)
+)
+tiktok_download_rate = metrics.histogram(
+    "tiktok_download_bytes_per_second", "Throughput of completed TikTok downloads",
+    buckets=(64e3, 256e3, 1e6, 4e6, 16e6, 64e6)
+)
+tiktok_download_bytes = metrics.counter("tiktok_download_bytes_total", "Bytes downloaded from the TikTok CDN")
+
+# jsonify through records.dumps: orjson when installed, and post/media records serialize directly
+class RecordJSONProvider(DefaultJSONProvider):
+    def dumps(self, obj, **kwargs):
+        with serialize_latency.time():
+            if kwargs.get("indent"):
+                return json.dumps(obj, default=records.encode_default, **kwargs)
+            return records.dumps(obj)
+
 app = Flask(__name__)
+app.json = RecordJSONProvider(app)
 app.secret_key = os.getenv("FLASK_SECRET_KEY", "dev-secret-key")
+app.config["RATELIMIT_ENABLED"] = os.getenv("RATELIMIT_ENABLED", "true").lower() not in ("0", "false", "no")
+
+# Upstream API bases (overridable to point at a local stub when benchmarking)
+INSTAGRAM_WEB_API = os.getenv("INSTAGRAM_WEB_API", "https://www.instagram.com/api/v1")
+INSTAGRAM_MOBILE_API = os.getenv("INSTAGRAM_MOBILE_API", "https://i.instagram.com/api/v1")
+
+# State shared between worker processes (limiter counters, cookie health, response cache)
+SHARED_STATE_URL = os.getenv("SHARED_STATE_URL", "memory://")
+shared_state = backend_from_url(SHARED_STATE_URL)
 
 # Cache for uptime checks
 uptime_cache = {
@@ -32,12 +103,36 @@ uptime_cache = {
     'requests_served': 0
 }
 
+def record_uptime_check():
+    """Count a status check across all workers and mirror the totals into uptime_cache"""
+    uptime_cache['last_check'] = datetime.now().isoformat()
+    shared_state.set("uptime:last_check", uptime_cache['last_check'])
+    uptime_cache['requests_served'] = shared_state.incr("uptime:requests_served")
+
+# Raised by CookieManager.acquire while every cookie is quarantined
+class CookiesQuarantined(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"Cookies quarantined, retry in {retry_after}s")
+        self.retry_after = retry_after
+
 # Cookie management
 class CookieManager:
-    def __init__(self):
+    EWMA_ALPHA = 0.2
+    IN_FLIGHT_TTL = 3600
+
+    def __init__(self, state):
+        # Quarantine and request counts live in the shared state, keyed by cookie, so
+        # every worker sees the same cookie health; latency/success EWMAs stay local.
+        # The cookie list and the selected index are per worker: cookies added or
+        # removed on the cookies page only change this worker's list.
+        self.state = state
         self.cookies = []
         self.cookie_names = []
         self.current_index = 0
+        self.health = {}
+        self.cooldown_base = float(os.getenv("COOKIE_COOLDOWN_BASE", "60"))
+        self.cooldown_max = float(os.getenv("COOKIE_COOLDOWN_MAX", "3600"))
+        self.lock = threading.RLock()
         self.load_cookies()
         logger.info(f"CookieManager initialized with {len(self.cookies)} cookies")
 
@@ -85,13 +180,996 @@ class CookieManager:
         if 0 <= index < len(self.cookies):
             removed_name = self.cookie_names.pop(index)
             removed_cookie = self.cookies.pop(index)
+            self.health.pop(removed_cookie, None)
+            session_pool.discard(removed_cookie)
             if self.current_index >= index and self.current_index > 0:
                 self.current_index -= 1
             logger.info(f"Removed cookie '{removed_name}' at index {index}")
             return True
         return False
 
-cookie_manager = CookieManager()
+    def get_health(self, cookie):
+        health = self.health.get(cookie)
+        if health is None:
+            health = {
+                "successes": 0,
+                "failures": 0,
+                "success_ewma": 1.0,
+                "latency_ewma": None,
+                "in_flight": 0,
+                "strikes": 0,
+                "quarantined_until": 0,
+                "last_rate_limited": None,
+                "last_challenge": None
+            }
+            self.health[cookie] = health
+        return health
+
+    def state_key(self, cookie, field):
+        fingerprint = hashlib.sha1(cookie.encode()).hexdigest()[:16]
+        return f"cookie:{fingerprint}:{field}"
+
+    def sync_health(self, cookie):
+        """Refresh the shared fields of a cookie's health from the shared state"""
+        health = self.get_health(cookie)
+        record = self.state.get(self.state_key(cookie, "quarantine"))
+        if record:
+            health.update(json.loads(record))
+        for field in ("successes", "failures", "in_flight"):
+            health[field] = max(0, int(self.state.get(self.state_key(cookie, field)) or 0))
+        return health
+
+    def count_in_flight(self, cookie, amount):
+        # The TTL restarts on every change, so a busy cookie's count never expires
+        # mid-request; one leaked by a crashed worker clears once the cookie goes idle
+        key = self.state_key(cookie, "in_flight")
+        self.state.incr(key, amount, ttl=self.IN_FLIGHT_TTL)
+        self.state.touch(key, self.IN_FLIGHT_TTL)
+
+    def save_quarantine(self, cookie, health):
+        record = {field: health[field] for field in ("strikes", "quarantined_until", "last_rate_limited", "last_challenge")}
+        self.state.set(self.state_key(cookie, "quarantine"), json.dumps(record), ttl=self.cooldown_max * 4)
+
+    def health_score(self, health):
+        score = health["success_ewma"] - health["in_flight"] * 0.1
+        if health["latency_ewma"] is not None:
+            score -= min(health["latency_ewma"], 10) * 0.02
+        return score
+
+    def acquire(self, exclude=(), delay_for=None):
+        """
+        Pick the healthiest usable cookie and mark it in flight; returns (index, cookie).
+        Raises CookiesQuarantined when every cookie is quarantined.
+        """
+        with self.lock:
+            if not self.cookies:
+                self.count_in_flight("", 1)
+                return 0, ""
+            now = time.time()
+            current_index = self.current_index
+            candidates = [i for i, cookie in enumerate(self.cookies) if cookie not in exclude] or list(range(len(self.cookies)))
+            healths = {i: self.sync_health(self.cookies[i]) for i in candidates}
+            available = [i for i in candidates if healths[i]["quarantined_until"] <= now]
+            if not available:
+                # Sending on a quarantined cookie would only extend its quarantine
+                released_at = min(healths[i]["quarantined_until"] for i in candidates)
+                raise CookiesQuarantined(max(1, math.ceil(released_at - now)))
+            def rank(i):
+                score = self.health_score(healths[i])
+                if delay_for:
+                    score -= max(0.0, delay_for(self.cookies[i]) - time.monotonic()) * 0.1
+                # Prefer the manually selected cookie on ties
+                return (score, i == current_index)
+            index = max(available, key=rank)
+            cookie = self.cookies[index]
+            self.count_in_flight(cookie, 1)
+            return index, cookie
+
+    def quarantine_remaining(self):
+        """Seconds until the first cookie comes out of quarantine; 0 when one is usable now"""
+        with self.lock:
+            released_at = min(self.sync_health(cookie)["quarantined_until"] for cookie in self.cookies or [""])
+            return max(0, math.ceil(released_at - time.time()))
+
+    def spare_capacity(self, delay_for=None):
+        """How many cookies could take a background request now: not quarantined, idle and not paced"""
+        with self.lock:
+            cookies = self.cookies or [""]
+            now = time.time()
+            spare = 0
+            for cookie in cookies:
+                health = self.sync_health(cookie)
+                if health["quarantined_until"] > now or health["in_flight"] > 0:
+                    continue
+                if delay_for and delay_for(cookie) > time.monotonic():
+                    continue
+                spare += 1
+            return spare
+
+    def release(self, cookie, outcome, latency=None):
+        """Record a request outcome: success, rate_limited, challenge or error"""
+        with self.lock:
+            health = self.sync_health(cookie)
+            self.count_in_flight(cookie, -1)
+            succeeded = outcome == "success"
+            health["success_ewma"] += self.EWMA_ALPHA * ((1.0 if succeeded else 0.0) - health["success_ewma"])
+            if latency is not None:
+                if health["latency_ewma"] is None:
+                    health["latency_ewma"] = latency
+                else:
+                    health["latency_ewma"] += self.EWMA_ALPHA * (latency - health["latency_ewma"])
+            if succeeded:
+                self.state.incr(self.state_key(cookie, "successes"))
+                if health["strikes"]:
+                    health["strikes"] = 0
+                    self.save_quarantine(cookie, health)
+                return
+            self.state.incr(self.state_key(cookie, "failures"))
+            if outcome in ("rate_limited", "challenge"):
+                now = time.time()
+                health["last_rate_limited" if outcome == "rate_limited" else "last_challenge"] = now
+                cooldown = min(self.cooldown_base * (2 ** health["strikes"]), self.cooldown_max)
+                health["strikes"] += 1
+                health["quarantined_until"] = now + cooldown
+                self.save_quarantine(cookie, health)
+                logger.warning(f"Quarantined cookie after {outcome} for {cooldown:.0f}s")
+
+    def health_stats(self, cookie):
+        with self.lock:
+            health = dict(self.sync_health(cookie))
+        total = health["successes"] + health["failures"]
+        now = time.time()
+        return {
+            "requests": total,
+            "success_rate": round(health["successes"] / total, 3) if total else None,
+            "latency_ewma": round(health["latency_ewma"], 2) if health["latency_ewma"] is not None else None,
+            "in_flight": health["in_flight"],
+            "quarantined_for": max(0, round(health["quarantined_until"] - now)),
+            "last_rate_limited": datetime.fromtimestamp(health["last_rate_limited"]).isoformat() if health["last_rate_limited"] else None,
+            "last_challenge": datetime.fromtimestamp(health["last_challenge"]).isoformat() if health["last_challenge"] else None
+        }
+
+cookie_manager = CookieManager(shared_state)
+
+# Keep-alive HTTP sessions, one per cookie (plus one for TikTok downloads)
+class SessionPool:
+    def __init__(self, pool_size=10, retries=2):
+        self.pool_size = pool_size
+        self.retries = retries
+        self.sessions = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def create_session(self):
+        # Only failed connects are retried here, at once and on the same session; status
+        # and read failures go back to send_instagram_request, which owns the retry policy
+        # (next cookie, pacing, health scoring)
+        retry = Retry(
+            total=self.retries,
+            connect=self.retries,
+            read=0,
+            status=0,
+            other=0,
+            backoff_factor=0,
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(
+            pool_connections=self.pool_size,
+            pool_maxsize=self.pool_size,
+            max_retries=retry
+        )
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def get(self, key):
+        with self.lock:
+            session = self.sessions.get(key)
+            if session is not None:
+                self.hits += 1
+                return session
+            self.misses += 1
+            session = self.create_session()
+            self.sessions[key] = session
+            logger.info(f"Created pooled HTTP session (Total sessions: {len(self.sessions)})")
+            return session
+
+    def discard(self, key):
+        with self.lock:
+            session = self.sessions.pop(key, None)
+        if session is not None:
+            session.close()
+
+    def connection_stats(self, session):
+        connections = 0
+        requests_made = 0
+        for adapter in set(session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for pool_key in pools.keys():
+                pool = pools[pool_key]
+                connections += pool.num_connections
+                requests_made += pool.num_requests
+        return connections, requests_made
+
+    def stats(self):
+        with self.lock:
+            sessions = list(self.sessions.items())
+            hits, misses = self.hits, self.misses
+        connections = 0
+        requests_made = 0
+        for _, session in sessions:
+            session_connections, session_requests = self.connection_stats(session)
+            connections += session_connections
+            requests_made += session_requests
+        return {
+            "sessions": len(sessions),
+            "hits": hits,
+            "misses": misses,
+            "connections_opened": connections,
+            "requests_sent": requests_made,
+            "connections_reused": max(requests_made - connections, 0)
+        }
+
+session_pool = SessionPool(
+    pool_size=int(os.getenv("HTTP_POOL_SIZE", "10")),
+    retries=int(os.getenv("HTTP_POOL_RETRIES", "2"))
+)
+
+# Per-cookie token bucket that hands out send deadlines instead of fixed sleeps
+class RequestPacer:
+    WAIT_BUCKETS = (0.1, 0.5, 1, 2, 5, 10, 30)
+
+    def __init__(self, rate=0.5, burst=3, jitter=0.5, backoff=2, enabled=True):
+        self.enabled = enabled  # False skips every pacing sleep (offline benchmarks only)
+        self.rate = rate
+        self.burst = burst
+        self.jitter = jitter
+        self.backoff = backoff
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def get_bucket(self, key, now):
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = {
+                "tokens": float(self.burst),
+                "updated": now,
+                "waiting": 0,
+                "max_waiting": 0,
+                "wait_counts": [0] * (len(self.WAIT_BUCKETS) + 1),
+                "wait_sum": 0.0,
+                "wait_count": 0
+            }
+            self.buckets[key] = bucket
+        return bucket
+
+    def refill(self, bucket, now):
+        elapsed = now - bucket["updated"]
+        bucket["tokens"] = min(float(self.burst), bucket["tokens"] + elapsed * self.rate)
+        bucket["updated"] = now
+
+    def reserve(self, key):
+        """Take a token for key and return the monotonic deadline to send at"""
+        with self.lock:
+            now = time.monotonic()
+            bucket = self.get_bucket(key, now)
+            self.refill(bucket, now)
+            bucket["tokens"] -= 1
+            # A negative balance is the queue ahead of us, paid back at `rate`
+            delay = max(0.0, -bucket["tokens"] / self.rate)
+            if self.jitter:
+                delay += random.uniform(0, self.jitter)
+            return now + delay
+
+    def wait(self, key):
+        """Block until key's next deadline; returns the time spent waiting"""
+        if not self.enabled:
+            return 0.0
+        deadline = self.reserve(key)
+        with self.lock:
+            bucket = self.buckets[key]
+            bucket["waiting"] += 1
+            bucket["max_waiting"] = max(bucket["max_waiting"], bucket["waiting"])
+        waited = max(0.0, deadline - time.monotonic())
+        try:
+            if waited:
+                time.sleep(waited)
+        finally:
+            with self.lock:
+                bucket["waiting"] -= 1
+                self.record_wait(bucket, waited)
+        return waited
+
+    async def wait_async(self, key):
+        """Same as wait(), but yields to the event loop instead of blocking a thread"""
+        if not self.enabled:
+            return 0.0
+        deadline = self.reserve(key)
+        with self.lock:
+            bucket = self.buckets[key]
+            bucket["waiting"] += 1
+            bucket["max_waiting"] = max(bucket["max_waiting"], bucket["waiting"])
+        waited = max(0.0, deadline - time.monotonic())
+        try:
+            if waited:
+                await asyncio.sleep(waited)
+        finally:
+            with self.lock:
+                bucket["waiting"] -= 1
+                self.record_wait(bucket, waited)
+        return waited
+
+    def record_wait(self, bucket, waited):
+        for i, upper in enumerate(self.WAIT_BUCKETS):
+            if waited <= upper:
+                bucket["wait_counts"][i] += 1
+                break
+        else:
+            bucket["wait_counts"][-1] += 1
+        bucket["wait_sum"] += waited
+        bucket["wait_count"] += 1
+
+    def available_at(self, key):
+        """Monotonic time at which key will next have a whole token"""
+        with self.lock:
+            now = time.monotonic()
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                return now
+            self.refill(bucket, now)
+            return now + max(0.0, (1 - bucket["tokens"]) / self.rate)
+
+    def penalize(self, key, attempt):
+        """Push key's bucket back by an exponential backoff after a failure"""
+        delay = self.backoff * (2 ** attempt)
+        with self.lock:
+            now = time.monotonic()
+            bucket = self.get_bucket(key, now)
+            self.refill(bucket, now)
+            bucket["tokens"] = min(bucket["tokens"], 0.0) - delay * self.rate
+        return delay
+
+    def stats(self, key):
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                return None
+            self.refill(bucket, time.monotonic())
+            labels = [f"le_{upper}" for upper in self.WAIT_BUCKETS] + ["le_inf"]
+            return {
+                "tokens": round(bucket["tokens"], 2),
+                "queue_depth": bucket["waiting"],
+                "max_queue_depth": bucket["max_waiting"],
+                "wait_histogram": dict(zip(labels, bucket["wait_counts"])),
+                "wait_count": bucket["wait_count"],
+                "wait_seconds_total": round(bucket["wait_sum"], 3)
+            }
+
+request_pacer = RequestPacer(
+    rate=float(os.getenv("INSTAGRAM_RATE", "0.5")),
+    burst=int(os.getenv("INSTAGRAM_BURST", "3")),
+    jitter=float(os.getenv("INSTAGRAM_JITTER", "0.5")),
+    backoff=float(os.getenv("INSTAGRAM_BACKOFF", "2")),
+    enabled=os.getenv("INSTAGRAM_PACING", "true").lower() not in ("0", "false", "no", "off")
+)
+
+def get_pacing_stats():
+    """Pacer queue depth and wait histograms keyed by cookie name"""
+    stats = {}
+    for name, cookie in zip(cookie_manager.cookie_names, cookie_manager.cookies):
+        cookie_stats = request_pacer.stats(cookie)
+        if cookie_stats:
+            stats[name] = cookie_stats
+    return stats
+
+# Response cache for Instagram lookups: per-part TTLs, LRU eviction by size.
+# An optional shared store backs the in-memory LRU so restarts and other workers start warm.
+class ResponseCache:
+    def __init__(self, ttls, max_bytes=64 * 1024 * 1024, max_stale=86400, store=None, decoders=None):
+        self.ttls = ttls
+        self.max_bytes = max_bytes
+        self.max_stale = max_stale
+        self.store = store
+        self.decoders = decoders or {}  # part -> function rebuilding records from stored JSON
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        logger.info(f"ResponseCache initialized (shared store: {type(store).__name__ if store else 'none'})")
+
+    def get(self, part, key):
+        """Return (value, age, is_fresh) for a cached entry, or None"""
+        cache_key = f"{part}:{key}"
+        with self.lock:
+            entry = self.entries.get(cache_key)
+            if entry is not None:
+                self.entries.move_to_end(cache_key)
+        if entry is None:
+            entry = self.load_from_store(part, cache_key)
+            if entry is None:
+                return None
+        value, _, stored_at = entry
+        age = time.time() - stored_at
+        if age > self.ttls[part] + self.max_stale:
+            with self.lock:
+                if cache_key in self.entries:
+                    self.remove(cache_key)
+            return None
+        return value, age, age <= self.ttls[part]
+
+    def load_from_store(self, part, cache_key):
+        """Pull an entry written by another worker (or an earlier run) into the local LRU"""
+        if self.store is None:
+            return None
+        raw = self.store.get(f"response_cache:{cache_key}")
+        if raw is None:
+            return None
+        record = json.loads(raw)
+        value = record["value"]
+        if part in self.decoders:
+            value = self.decoders[part](value)
+        entry = (value, len(raw), record["stored_at"])
+        with self.lock:
+            self.insert(cache_key, entry)
+        return entry
+
+    def set(self, part, key, value):
+        cache_key = f"{part}:{key}"
+        stored_at = time.time()
+        raw = records.dumps({"value": value, "stored_at": stored_at}, default=records.encode_state)
+        with self.lock:
+            self.insert(cache_key, (value, len(raw), stored_at))
+        if self.store is not None:
+            self.store.set(f"response_cache:{cache_key}", raw, ttl=self.ttls[part] + self.max_stale)
+
+    def insert(self, cache_key, entry):
+        # Caller holds the lock
+        if cache_key in self.entries:
+            self.remove(cache_key)
+        self.entries[cache_key] = entry
+        self.total_bytes += entry[1]
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            self.remove(next(iter(self.entries)))
+
+    def remove(self, cache_key):
+        # Caller holds the lock; the shared store expires its copy on its own
+        _, size, _ = self.entries.pop(cache_key)
+        self.total_bytes -= size
+
+    def lookup(self, part, key, debug_info, refresh=False):
+        """
+        Return a fresh cached value or None, recording the cache status.
+        refresh is True to bypass the cache, or a collection of the parts to bypass it for.
+        """
+        if refresh is True or (refresh and part in refresh):
+            debug_info["cache"][part] = {"status": "refresh", "age": None}
+            return None
+        cached = self.get(part, key)
+        if cached is None or not cached[2]:
+            debug_info["cache"][part] = {"status": "miss", "age": None}
+            return None
+        value, age, _ = cached
+        debug_info["cache"][part] = {"status": "hit", "age": round(age, 1)}
+        return value
+
+    def fallback(self, part, key, debug_info):
+        """Return an expired value to serve stale when the upstream fetch failed"""
+        cached = self.get(part, key)
+        if cached is None:
+            return None
+        value, age, _ = cached
+        debug_info["cache"][part] = {"status": "stale", "age": round(age, 1)}
+        debug_info["warnings"].append(f"Serving stale cached {part} after upstream failure")
+        return value
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes
+            }
+
+def decode_post_records(value):
+    """Rebuild PostRecords in a posts/feed value loaded from the shared store"""
+    value["items"] = [PostRecord.from_dict(post) for post in value["items"]]
+    return value
+
+def decode_media_records(value):
+    """Rebuild the MediaRecords of a stories value loaded from the shared store"""
+    value["items"] = [MediaRecord.from_dict(media) for media in value["items"]]
+    return value
+
+response_cache = ResponseCache(
+    ttls={
+        "profile": int(os.getenv("INSTAGRAM_CACHE_TTL_PROFILE", "600")),
+        "stories": int(os.getenv("INSTAGRAM_CACHE_TTL_STORIES", "120")),
+        "posts": int(os.getenv("INSTAGRAM_CACHE_TTL_POSTS", "1800")),
+        "feed": int(os.getenv("INSTAGRAM_CACHE_TTL_FEED", str(7 * 86400)))
+    },
+    max_bytes=int(os.getenv("INSTAGRAM_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+    max_stale=int(os.getenv("INSTAGRAM_CACHE_MAX_STALE", "86400")),
+    store=(
+        SQLiteBackend(os.getenv("INSTAGRAM_CACHE_DB")) if os.getenv("INSTAGRAM_CACHE_DB")
+        else None if isinstance(shared_state, MemoryBackend) else shared_state
+    ),
+    decoders={"posts": decode_post_records, "feed": decode_post_records, "stories": decode_media_records}
+)
+
+# Local archive of every fetched profile, post and story; INSTAGRAM_ARCHIVE_DB="" turns it off
+INSTAGRAM_ARCHIVE_DB = os.getenv(
+    "INSTAGRAM_ARCHIVE_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "instagram_archive.db")
+)
+post_archive = PostArchive(INSTAGRAM_ARCHIVE_DB) if INSTAGRAM_ARCHIVE_DB else None
+
+# On-disk cache for proxied CDN media, keyed by URL with expiry/signature stripped
+class MediaCache:
+    VOLATILE_PARAMS = ("oe", "oh", "ccb", "edm")
+
+    def __init__(self, directory, max_bytes=1024 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.index = OrderedDict()  # key -> size, least recently used first
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.load_index()
+        logger.info(f"MediaCache initialized with {len(self.index)} files ({self.total_bytes} bytes)")
+
+    def load_index(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            key = name[:-5]
+            data_path = os.path.join(self.directory, key)
+            if os.path.exists(data_path):
+                meta_path = os.path.join(self.directory, name)
+                entries.append((os.path.getmtime(meta_path), key, os.path.getsize(data_path)))
+        for _, key, size in sorted(entries):
+            self.index[key] = size
+            self.total_bytes += size
+
+    def key_for(self, url):
+        parsed = urlparse(url)
+        params = sorted(
+            (name, value) for name, value in parse_qsl(parsed.query, keep_blank_values=True)
+            if name not in self.VOLATILE_PARAMS and not name.startswith("_nc_")
+        )
+        stable_url = f"{parsed.netloc}{parsed.path}?{urlencode(params)}"
+        return hashlib.sha256(stable_url.encode()).hexdigest()
+
+    def path_for(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, url):
+        """Return the cached file's metadata (with its path), or None"""
+        key = self.key_for(url)
+        with self.lock:
+            if key not in self.index:
+                return None
+            self.index.move_to_end(key)
+        path = self.path_for(key)
+        try:
+            with open(path + ".json") as f:
+                meta = json.load(f)
+            # Recency lives on the metadata file so the data file's mtime (and ETag) stays stable
+            os.utime(path + ".json")
+        except (OSError, ValueError):
+            self.discard(key)
+            return None
+        meta["path"] = path
+        return meta
+
+    def temp_path(self, url):
+        return f"{self.path_for(self.key_for(url))}.{threading.get_ident()}.tmp"
+
+    def commit(self, url, temp_path, content_type):
+        """Atomically move a completed download into the cache"""
+        key = self.key_for(url)
+        path = self.path_for(key)
+        size = os.path.getsize(temp_path)
+        if size > self.max_bytes:
+            os.remove(temp_path)
+            return
+        with open(path + ".json", "w") as f:
+            json.dump({"content_type": content_type, "size": size, "stored_at": time.time()}, f)
+        os.replace(temp_path, path)
+        with self.lock:
+            self.total_bytes += size - self.index.pop(key, 0)
+            self.index[key] = size
+            evicted = []
+            while self.total_bytes > self.max_bytes and len(self.index) > 1:
+                old_key, old_size = self.index.popitem(last=False)
+                self.total_bytes -= old_size
+                evicted.append(old_key)
+        for old_key in evicted:
+            self.remove_files(old_key)
+
+    def discard(self, key):
+        with self.lock:
+            size = self.index.pop(key, None)
+            if size is not None:
+                self.total_bytes -= size
+        self.remove_files(key)
+
+    def remove_files(self, key):
+        for path in (self.path_for(key), self.path_for(key) + ".json"):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self):
+        with self.lock:
+            return {"files": len(self.index), "bytes": self.total_bytes, "max_bytes": self.max_bytes}
+
+media_cache = MediaCache(
+    os.getenv("MEDIA_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "media_cache")),
+    max_bytes=int(os.getenv("MEDIA_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+)
+MEDIA_INLINE_MAX_BYTES = int(os.getenv("MEDIA_INLINE_MAX_BYTES", str(256 * 1024)))
+MEDIA_CHUNK_SIZE = int(os.getenv("MEDIA_CHUNK_SIZE", str(256 * 1024)))
+TIKTOK_CHUNK_SIZE = int(os.getenv("TIKTOK_CHUNK_SIZE", str(1024 * 1024)))
+# CDN suffixes only: instagram.com itself hosts an open redirector (l.instagram.com)
+MEDIA_ALLOWED_HOSTS = ("cdninstagram.com", "fbcdn.net", "tiktokcdn.com", "tiktokcdn-us.com")
+MEDIA_MAX_REDIRECTS = 5
+MEDIA_RATE_LIMIT = os.getenv("MEDIA_RATE_LIMIT", "600 per minute")
+
+# Content-addressed store for downloaded TikTok videos: ids/<video_id>.json points
+# at blobs/<sha256>, so re-uploads of the same video share one file on disk.
+# Workers share the directory; each keeps its own index and reads ids/ on a miss
+# to pick up videos the others stored.
+class VideoStore:
+    def __init__(self, directory, max_bytes=2 * 1024 * 1024 * 1024, max_age=7 * 24 * 3600, grace=3600):
+        self.directory = directory
+        self.blob_dir = os.path.join(directory, "blobs")
+        self.id_dir = os.path.join(directory, "ids")
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.grace = grace  # files younger than this may belong to another worker
+        self.index = OrderedDict()  # video_id -> metadata, least recently used first
+        self.blobs = {}  # digest -> [size, reference count]
+        self.verified = set()  # digests hashed since startup
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        os.makedirs(self.blob_dir, exist_ok=True)
+        os.makedirs(self.id_dir, exist_ok=True)
+        self.load_index()
+        logger.info(f"VideoStore initialized with {len(self.index)} videos ({self.total_bytes} bytes)")
+
+    def load_index(self):
+        entries = []
+        for name in os.listdir(self.id_dir):
+            if not name.endswith(".json"):
+                continue
+            meta_path = os.path.join(self.id_dir, name)
+            try:
+                with open(meta_path) as f:
+                    meta = json.load(f)
+                if os.path.getsize(self.blob_path(meta["digest"])) != meta["size"]:
+                    raise ValueError("size mismatch")
+            except (OSError, ValueError, KeyError):
+                os.remove(meta_path)
+                continue
+            entries.append((os.path.getmtime(meta_path), name[:-5], meta))
+        for _, video_id, meta in sorted(entries):
+            self.add_entry(video_id, meta)
+        # Drop unreferenced blobs and downloads abandoned by a crashed worker; recent
+        # files may be a download or a commit of another worker still in progress
+        for name in os.listdir(self.blob_dir):
+            path = os.path.join(self.blob_dir, name)
+            try:
+                if name not in self.blobs and time.time() - os.path.getmtime(path) > self.grace:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def blob_path(self, digest):
+        return os.path.join(self.blob_dir, digest)
+
+    def meta_path(self, video_id):
+        return os.path.join(self.id_dir, f"{video_id}.json")
+
+    def add_entry(self, video_id, meta):
+        # Caller holds the lock (or is still in __init__)
+        self.index[video_id] = meta
+        blob = self.blobs.setdefault(meta["digest"], [meta["size"], 0])
+        if blob[1] == 0:
+            self.total_bytes += meta["size"]
+        blob[1] += 1
+
+    def drop_entry(self, video_id):
+        """Forget an id; returns the digest of its blob if nothing references it anymore"""
+        # Caller holds the lock
+        meta = self.index.pop(video_id, None)
+        if meta is None:
+            return None
+        blob = self.blobs[meta["digest"]]
+        blob[1] -= 1
+        if blob[1] > 0:
+            return None
+        del self.blobs[meta["digest"]]
+        self.verified.discard(meta["digest"])
+        self.total_bytes -= blob[0]
+        return meta["digest"]
+
+    def load_entry(self, video_id):
+        """Index an id that another worker stored after this one loaded its index"""
+        try:
+            with open(self.meta_path(video_id)) as f:
+                meta = json.load(f)
+            if os.path.getsize(self.blob_path(meta["digest"])) != meta["size"]:
+                return
+        except (OSError, ValueError, KeyError):
+            return
+        with self.lock:
+            if video_id not in self.index:
+                self.add_entry(video_id, meta)
+
+    def get(self, video_id):
+        """Return the stored video's metadata (with its path), or None"""
+        with self.lock:
+            known = video_id in self.index
+        if not known:
+            self.load_entry(video_id)
+        with self.lock:
+            meta = self.index.get(video_id)
+            expired = meta is not None and time.time() - meta["stored_at"] > self.max_age
+            if meta is None or expired:
+                self.misses += 1
+            else:
+                self.index.move_to_end(video_id)
+                needs_check = meta["digest"] not in self.verified
+        if meta is None or expired:
+            if expired:
+                self.discard(video_id)
+            return None
+
+        path = self.blob_path(meta["digest"])
+        try:
+            # Hash each blob once per process; afterwards a size check catches truncation
+            if os.path.getsize(path) != meta["size"] or (needs_check and self.file_digest(path) != meta["digest"]):
+                raise ValueError("integrity check failed")
+            os.utime(self.meta_path(video_id))
+        except (OSError, ValueError) as e:
+            logger.warning(f"Dropping stored TikTok video {video_id}: {str(e)}")
+            self.discard(video_id)
+            with self.lock:
+                self.misses += 1
+            return None
+
+        with self.lock:
+            self.verified.add(meta["digest"])
+            self.hits += 1
+        return dict(meta, path=path)
+
+    def file_digest(self, path):
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(MEDIA_CHUNK_SIZE), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def temp_path(self, video_id):
+        return os.path.join(self.blob_dir, f"{video_id}.{os.getpid()}.{threading.get_ident()}.tmp")
+
+    def commit(self, video_id, temp_path, digest, content_type="video/mp4"):
+        """Atomically move a completed download into the store and evict as needed"""
+        size = os.path.getsize(temp_path)
+        path = self.blob_path(digest)
+        meta = {"digest": digest, "size": size, "content_type": content_type, "stored_at": time.time()}
+        meta_temp = f"{self.meta_path(video_id)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(meta_temp, "w") as f:
+            json.dump(meta, f)
+
+        # Blob placement and removal happen under the lock so eviction of one id
+        # cannot delete a blob another id is being pointed at
+        with self.lock:
+            if digest in self.blobs:
+                # Same bytes already stored under another id
+                os.remove(temp_path)
+            else:
+                os.replace(temp_path, path)
+            os.replace(meta_temp, self.meta_path(video_id))
+            previous = self.drop_entry(video_id)
+            self.add_entry(video_id, meta)
+            orphaned = [previous if previous != digest else None]
+            self.verified.add(digest)
+            now = time.time()
+            evicted = [vid for vid, m in self.index.items() if now - m["stored_at"] > self.max_age]
+            orphaned += [self.drop_entry(vid) for vid in evicted]
+            while self.total_bytes > self.max_bytes and len(self.index) > 1:
+                old_id = next(iter(self.index))
+                orphaned.append(self.drop_entry(old_id))
+                evicted.append(old_id)
+            self.remove_files(evicted, orphaned)
+        return dict(meta, path=path)
+
+    def discard(self, video_id):
+        with self.lock:
+            self.remove_files([video_id], [self.drop_entry(video_id)])
+
+    def remove_files(self, video_ids, digests):
+        # Caller holds the lock
+        paths = [self.meta_path(video_id) for video_id in video_ids]
+        paths += [self.blob_path(digest) for digest in digests if digest]
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self):
+        with self.lock:
+            return {
+                "videos": len(self.index),
+                "blobs": len(self.blobs),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "max_age": self.max_age,
+                "hits": self.hits,
+                "misses": self.misses
+            }
+
+video_store = VideoStore(
+    os.getenv("TIKTOK_STORE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "downloads")),
+    max_bytes=int(os.getenv("TIKTOK_STORE_MAX_BYTES", str(2 * 1024 * 1024 * 1024))),
+    max_age=int(os.getenv("TIKTOK_STORE_MAX_AGE", str(7 * 24 * 3600)))
+)
+
+# Coalesces identical concurrent calls onto a single in-flight execution
+class SingleFlight:
+    def __init__(self, timeout=60):
+        self.timeout = timeout
+        self.calls = {}
+        self.leaders = 0
+        self.coalesced = 0
+        self.timeouts = 0
+        self.lock = threading.Lock()
+
+    def do(self, key, func, *args, **kwargs):
+        """Run func once per key at a time; concurrent callers share its outcome"""
+        call, is_leader = self.begin(key)
+        if not is_leader:
+            return self.wait(call)
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            self.finish(key, call, error=e)
+            raise
+        self.finish(key, call, result)
+        return result
+
+    def begin(self, key):
+        """Join the call in flight for key, or start one; returns (call, is_leader)"""
+        with self.lock:
+            call = self.calls.get(key)
+            if call is not None:
+                self.coalesced += 1
+                return call, False
+            call = {"done": threading.Event(), "result": None, "error": None}
+            self.calls[key] = call
+            self.leaders += 1
+            return call, True
+
+    def finish(self, key, call, result=None, error=None):
+        """Publish the leader's outcome; must be called exactly once per begin() that led"""
+        call["result"] = result
+        call["error"] = error
+        with self.lock:
+            if self.calls.get(key) is call:
+                del self.calls[key]
+        call["done"].set()
+
+    def wait(self, call):
+        if not call["done"].wait(self.timeout):
+            with self.lock:
+                self.timeouts += 1
+            raise TimeoutError(f"Timed out after {self.timeout}s waiting for in-flight call")
+        if call["error"] is not None:
+            raise call["error"]
+        return call["result"]
+
+    def stats(self):
+        with self.lock:
+            return {
+                "in_flight": len(self.calls),
+                "leaders": self.leaders,
+                "coalesced_waiters": self.coalesced,
+                "timeouts": self.timeouts
+            }
+
+instagram_flights = SingleFlight(timeout=float(os.getenv("INSTAGRAM_SINGLE_FLIGHT_TIMEOUT", "60")))
+tiktok_flights = SingleFlight(timeout=float(os.getenv("TIKTOK_DOWNLOAD_TIMEOUT", "300")))
+
+# Short link (vt.tiktok.com, vm.tiktok.com) -> video id, so each link is followed once
+tiktok_links = ShortLinkResolver(
+    lambda url, timeout: session_pool.get("tiktok").head(url, allow_redirects=True, timeout=timeout).url,
+    store=(
+        SQLiteBackend(os.getenv("TIKTOK_LINK_DB")) if os.getenv("TIKTOK_LINK_DB")
+        else None if isinstance(shared_state, MemoryBackend) else shared_state
+    ),
+    max_entries=int(os.getenv("TIKTOK_LINK_CACHE_SIZE", "10000")),
+    ttl=int(os.getenv("TIKTOK_LINK_CACHE_TTL", str(24 * 3600))),
+    timeout=(3.05, float(os.getenv("TIKTOK_LINK_TIMEOUT", "5")))
+)
+
+# TikTokApi drives a playwright browser on the event loop of the thread that built it,
+# so each pooled client owns a thread and calls are run there
+class TikTokClient:
+    def __init__(self, call_timeout=60):
+        self.call_timeout = call_timeout
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tiktok-client")
+        try:
+            self.api = self.executor.submit(self.start).result()
+        except Exception:
+            self.executor.shutdown(wait=False)
+            raise
+
+    def start(self):
+        asyncio.set_event_loop(asyncio.new_event_loop())
+        return TikTokApi()
+
+    def call(self, func):
+        """Run func(api) on the client's own thread and return its result"""
+        return self.executor.submit(func, self.api).result(self.call_timeout)
+
+    def video_info(self, video_id):
+        """Fetch a video's details through this client's TikTokApi instance"""
+        def info(api):
+            # TikTokApi.__init__ points the class-level Video.parent at the newest
+            # instance, so bind the video to the checked-out one explicitly
+            video = Video(id=video_id)
+            video.parent = api
+            return video.info()
+        return self.call(info)
+
+    def healthy(self, timeout=5):
+        """Whether the client's thread still answers and its browser is still connected"""
+        def probe(api):
+            browser = getattr(getattr(api, "_browser", None), "browser", None)
+            return browser is None or browser.is_connected()
+        try:
+            return self.executor.submit(probe, self.api).result(timeout)
+        except Exception:
+            return False
+
+    def close(self):
+        shutdown = getattr(self.api, "shutdown", None)
+        if callable(shutdown):
+            self.executor.submit(shutdown)
+        self.executor.shutdown(wait=False)
+
+# Pre-initialized TikTokApi clients, checked out per request instead of built per request
+tiktok_clients = ClientPool(
+    "TikTokApi",
+    TikTokClient,
+    size=int(os.getenv("TIKTOK_CLIENT_POOL_SIZE", "2")),
+    checkout_timeout=float(os.getenv("TIKTOK_CLIENT_CHECKOUT_TIMEOUT", "30")),
+    max_uses=int(os.getenv("TIKTOK_CLIENT_MAX_USES", "500")),
+    max_age=int(os.getenv("TIKTOK_CLIENT_MAX_AGE", "3600")),
+    check=lambda client: client.healthy(float(os.getenv("TIKTOK_CLIENT_HEALTH_TIMEOUT", "5")))
+)
+if os.getenv("TIKTOK_CLIENT_POOL_WARM", "true").lower() not in ("0", "false", "no"):
+    # Warm in the background so a slow client setup does not hold up startup
+    threading.Thread(target=tiktok_clients.warm, name="tiktok-client-warmup", daemon=True).start()
+
+# Worker pool used to fan out the stories and posts fetches of a single lookup
+instagram_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("INSTAGRAM_WORKERS", "4")),
+    thread_name_prefix="instagram"
+)
+
+# Worker pool for batch lookups; each lookup fans out on instagram_executor
+BATCH_MAX_USERNAMES = int(os.getenv("BATCH_MAX_USERNAMES", "500"))
+batch_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("BATCH_CONCURRENCY", "4")),
+    thread_name_prefix="instagram-batch"
+)
 
 # Rate limiting configuration - modified to exclude uptime checks
 def limit_exempt_uptime():
@@ -108,15 +1186,14 @@ limiter = Limiter(
     app=app,
     key_func=get_remote_address,
     default_limits=["100 per day", "20 per hour"],
-    storage_uri="memory://",
+    storage_uri=SHARED_STATE_URL,
     strategy="fixed-window"  # More predictable for uptime checks
 )
 
 @app.route('/')
 def home():
     """Simple uptime page for monitoring"""
-    uptime_cache['last_check'] = datetime.now().isoformat()
-    uptime_cache['requests_served'] = uptime_cache.get('requests_served', 0) + 1
+    record_uptime_check()
 
     html_content = """
     <!DOCTYPE html>
@@ -174,8 +1251,9 @@ def home():
     return html_content
 
 
-def get_instagram_headers():
-    cookie = cookie_manager.get_current_cookie()
+def get_instagram_headers(cookie=None):
+    if cookie is None:
+        cookie = cookie_manager.get_current_cookie()
     return {
         "User-Agent": os.getenv("INSTAGRAM_USER_AGENT", "Mozilla/5.0 (iPhone; CPU iPhone OS 16_6 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/16.6 Mobile/15E148 Safari/604.1"),
         "Cookie": cookie,
@@ -194,98 +1272,199 @@ def get_instagram_headers():
         "X-Requested-With": "XMLHttpRequest"
     }
 
+# A successful Instagram response, with its JSON body parsed exactly once
+class InstagramResult:
+    __slots__ = ("status_code", "payload")
+
+    def __init__(self, status_code, payload):
+        self.status_code = status_code
+        self.payload = payload
+
+CHALLENGE_INDICATORS = (
+    "challenge_required",
+    "login_required",
+    "checkpoint_required",
+    "verify_phone_number",
+    "verify_email",
+    "suspicious_activity",
+    "temporarily_blocked"
+)
+CHALLENGE_PATTERN = re.compile("|".join(CHALLENGE_INDICATORS), re.IGNORECASE)
+
+# Client errors that another cookie or a retry would answer the same way
+TERMINAL_STATUSES = (400, 405, 410, 422)
+
+def find_challenge_indicators(payload):
+    """Challenge markers in a parsed body; Instagram reports them in top-level fields, never in media"""
+    if not isinstance(payload, dict):
+        return []
+    found = []
+    for field in ("message", "error_type", "step_name"):
+        value = payload.get(field)
+        if isinstance(value, str):
+            found.extend(match.lower() for match in CHALLENGE_PATTERN.findall(value))
+    if "challenge" in payload:
+        found.append("challenge_required")
+    if payload.get("checkpoint_url"):
+        found.append("checkpoint_required")
+    if payload.get("require_login"):
+        found.append("login_required")
+    return list(dict.fromkeys(found))
+
 def handle_instagram_response(response):
-    """Handle Instagram API responses and check for rate limiting/challenges"""
+    """
+    Parse and classify an Instagram response.
+
+    Returns (True, InstagramResult) or (False, error message). The body is decoded once
+    here; callers read InstagramResult.payload instead of calling response.json() again.
+    """
+    status = response.status_code
+    if status == 429:
+        logger.warning(f"Rate limit hit (Status: {status})")
+        return False, "Rate limit exceeded"
+    if status == 403:
+        logger.warning(f"Access forbidden (Status: {status})")
+        return False, "Access forbidden"
+    if status == 401:
+        logger.warning(f"Authentication required (Status: {status})")
+        return False, "Authentication required"
+    
     try:
-        # Check for JSON decode errors first
-        if response.status_code == 200:
-            try:
-                response.json()
-            except json.JSONDecodeError:
-                logger.warning(f"Invalid JSON response (Status: {response.status_code}), likely invalid cookie")
-                logger.debug(f"Response content: {response.text[:200]}...")  # Log first 200 chars of response
-                return False, "Invalid cookie or session expired"
-        
-        # Check for rate limiting
-        if response.status_code == 429:
-            logger.warning(f"Rate limit hit (Status: {response.status_code})")
-            return False, "Rate limit exceeded"
-        
-        # Check for access denied
-        if response.status_code == 403:
-            logger.warning(f"Access forbidden (Status: {response.status_code})")
-            return False, "Access forbidden"
-        
-        # Check for login required
-        if response.status_code == 401:
-            logger.warning(f"Authentication required (Status: {response.status_code})")
-            return False, "Authentication required"
-        
-        # Check response content for challenge indicators
-        try:
-            response_text = response.text.lower()
-            challenge_indicators = [
-                "challenge_required",
-                "login_required",
-                "checkpoint_required",
-                "verify_phone_number",
-                "verify_email",
-                "suspicious_activity",
-                "temporarily_blocked"
-            ]
-            found_indicators = [ind for ind in challenge_indicators if ind in response_text]
-            if found_indicators:
-                logger.warning(f"Challenge detected in response: {', '.join(found_indicators)}")
-                logger.debug(f"Response content: {response_text[:200]}...")  # Log first 200 chars
-                return False, f"Challenge required: {', '.join(found_indicators)}"
-        except Exception as e:
-            logger.error(f"Error checking response content: {str(e)}")
-        
-        return True, response
-        
-    except Exception as e:
-        logger.error(f"Error handling response: {str(e)}")
-        return False, str(e)
+        with parse_latency.time(stage="response_json"):
+            payload = records.loads(response.content)
+    except ValueError:
+        if status == 200:
+            logger.warning(f"Invalid JSON response (Status: {status}), likely invalid cookie")
+            logger.debug(f"Response content: {response.text[:200]}...")  # Log first 200 chars of response
+            return False, "Invalid cookie or session expired"
+        # HTML error pages (login walls, checkpoints) are only scanned when there is no JSON to inspect
+        payload = None
+        found_indicators = list(dict.fromkeys(match.lower() for match in CHALLENGE_PATTERN.findall(response.text)))
+    else:
+        found_indicators = find_challenge_indicators(payload)
+    
+    if found_indicators:
+        logger.warning(f"Challenge detected in response: {', '.join(found_indicators)}")
+        return False, f"Challenge required: {', '.join(found_indicators)}"
+    
+    if status == 404:
+        # Unknown user or media: a final answer with nothing in it to cache
+        logger.info("Instagram answered 404")
+        return True, InstagramResult(status, {})
+    
+    failed = isinstance(payload, dict) and payload.get("status") == "fail"
+    if not 200 <= status < 300 or failed or payload is None:
+        message = payload.get("message") if isinstance(payload, dict) else None
+        logger.warning(f"Instagram error response (Status: {status}): {message or 'no message'}")
+        return False, f"Instagram error (HTTP {status})" + (f": {message}" if message else "")
+    
+    return True, InstagramResult(status, payload)
+
+def instagram_error_status(error):
+    """HTTP status for a lookup that failed with error: 503 while every cookie is quarantined"""
+    return 503 if error.startswith("Cookies quarantined") else 500
+
+def retry_after_headers(status):
+    """Retry-After for a 503 lookup: when the first cookie comes out of quarantine"""
+    if status != 503:
+        return {}
+    return {"Retry-After": str(max(1, cookie_manager.quarantine_remaining()))}
+
+def instagram_error(res):
+    """The error of a make_instagram_request result, or None when it holds data"""
+    if isinstance(res, str):
+        return res
+    if res.status_code == 404:
+        return "Not found (HTTP 404)"
+    return None
 
 def make_instagram_request(url, method="GET", **kwargs):
+    """Make a request to Instagram, sharing one in-flight call between identical concurrent GETs"""
+    if method != "GET" or kwargs:
+        return send_instagram_request(url, method, **kwargs)
+    try:
+        return instagram_flights.do(url, send_instagram_request, url)
+    except TimeoutError as e:
+        logger.warning(f"Coalesced request to {url} failed: {str(e)}")
+        return str(e)
+
+def instagram_endpoint(url):
+    """Metric label for an API URL: its path below the API base with numeric ids collapsed"""
+    path = urlparse(url).path
+    if "/api/v1/" in path:
+        path = path.split("/api/v1/", 1)[1]
+    return re.sub(r"/\d+(?=/|$)", "/:id", "/" + path.strip("/"))
+
+def classify_instagram_failure(response, message):
+    """Map a failed response to a cookie health outcome"""
+    if response.status_code == 429:
+        return "rate_limited"
+    if response.status_code in (401, 403) or message.startswith(("Challenge required", "Invalid cookie")):
+        return "challenge"
+    return "error"
+
+def send_instagram_request(url, method="GET", **kwargs):
     """Make a request to Instagram with retry logic and rate limiting"""
     max_retries = len(cookie_manager.cookies) if cookie_manager.cookies else 1
-    base_delay = 2
+    tried = set()
     
     for attempt in range(max_retries):
+        # Each attempt goes to the healthiest cookie not tried yet
         try:
-            # Rotate cookie before each attempt
-            if attempt > 0:
-                cookie_manager.rotate_cookie()
-            
-            # Add random delay between requests
-            delay = base_delay + random.uniform(0, 2)
-            logger.debug(f"Request attempt {attempt + 1}/{max_retries} - Waiting {delay:.2f}s")
-            time.sleep(delay)
+            cookie_index, current_cookie = cookie_manager.acquire(tried, request_pacer.available_at)
+        except CookiesQuarantined as e:
+            logger.warning(f"No cookie available: {str(e)}")
+            return str(e)
+        tried.add(current_cookie)
+        outcome = "error"
+        latency = None
+        try:
+            # Wait for this cookie's next send slot
+            waited = request_pacer.wait(current_cookie)
+            pacing_sleep.observe(waited, cookie=cookie_index)
+            logger.debug(f"Request attempt {attempt + 1}/{max_retries} - Waited {waited:.2f}s")
             
-            current_cookie = cookie_manager.get_current_cookie()
-            headers = get_instagram_headers()
-            logger.debug(f"Making request to {url} with cookie index {cookie_manager.current_index}")
+            headers = get_instagram_headers(current_cookie)
+            logger.debug(f"Making request to {url} with cookie index {cookie_index}")
             
-            response = requests.request(
-                method,
-                url,
-                headers=headers,
-                timeout=15,
-                **kwargs
-            )
+            session = session_pool.get(current_cookie)
+            sent_at = time.time()
+            status = "error"
+            try:
+                response = session.request(
+                    method,
+                    url,
+                    headers=headers,
+                    timeout=15,
+                    **kwargs
+                )
+                status = response.status_code
+            finally:
+                upstream_latency.observe(
+                    time.time() - sent_at, endpoint=instagram_endpoint(url), cookie=cookie_index,
+                    status=status, attempt=attempt + 1
+                )
+            latency = time.time() - sent_at
             
             logger.debug(f"Response status: {response.status_code}")
             success, result = handle_instagram_response(response)
             
             if success:
+                outcome = "success"
                 logger.debug("Request successful")
                 return result
             
+            if response.status_code in TERMINAL_STATUSES:
+                # The request was rejected, not the cookie; no other cookie would do better
+                outcome = "success"
+                return result
+            
+            # Back off the failing cookie; the next attempt uses another one
+            outcome = classify_instagram_failure(response, result)
+            delay = request_pacer.penalize(current_cookie, attempt)
+            backoff_imposed.inc(delay, cookie=cookie_index)
             if attempt < max_retries - 1:
-                delay = base_delay * (2 ** attempt)
-                logger.warning(f"Request failed, retrying in {delay}s. Error: {result}")
-                time.sleep(delay)
+                logger.warning(f"Request failed, cookie backed off {delay}s. Error: {result}")
                 continue
             
             logger.error(f"All retry attempts failed. Last error: {result}")
@@ -293,204 +1472,322 @@ def make_instagram_request(url, method="GET", **kwargs):
             
         except requests.exceptions.RequestException as e:
             logger.error(f"Request failed: {str(e)}")
+            delay = request_pacer.penalize(current_cookie, attempt)
+            backoff_imposed.inc(delay, cookie=cookie_index)
             if attempt < max_retries - 1:
-                delay = base_delay * (2 ** attempt)
-                logger.warning(f"Retrying in {delay}s")
-                time.sleep(delay)
+                logger.warning(f"Retrying, cookie backed off {delay}s")
                 continue
             raise
+        finally:
+            cookie_manager.release(current_cookie, outcome, latency)
 
-def process_media_item(media, media_type, is_carousel=False, carousel_index=None):
-    """Process a single media item (image or video) and return its data"""
-    try:
-        if media_type == 1:  # Image
-            image_versions = media.get("image_versions2", {}) or {}
-            candidates = image_versions.get("candidates", []) or []
-            if candidates and isinstance(candidates, list) and len(candidates) > 0:
-                image_url = candidates[0].get("url")
-                if image_url:
-                    media_data = {
-                        "type": "image",
-                        "url": image_url
-                    }
-                    if is_carousel:
-                        media_data.update({
-                            "is_carousel_item": True,
-                            "carousel_index": carousel_index
-                        })
-                    return media_data
-                    
-        elif media_type == 2:  # Video
-            video_versions = media.get("video_versions", []) or []
-            if video_versions and isinstance(video_versions, list) and len(video_versions) > 0:
-                video_url = video_versions[0].get("url")
-                if video_url:
-                    # Get cover image if available
-                    cover_url = None
-                    image_versions = media.get("image_versions2", {}) or {}
-                    candidates = image_versions.get("candidates", []) or []
-                    if candidates and isinstance(candidates, list) and len(candidates) > 0:
-                        cover_url = candidates[0].get("url")
-                    
-                    media_data = {
-                        "type": "video",
-                        "url": video_url,
-                        "cover_url": cover_url
-                    }
-                    if is_carousel:
-                        media_data.update({
-                            "is_carousel_item": True,
-                            "carousel_index": carousel_index
-                        })
-                    return media_data
-    except Exception as e:
-        raise Exception(f"Failed to process media: {str(e)}")
+def process_media_item(media, media_type, carousel_index=None, media_id=None):
+    """Turn a raw image or video item into a MediaRecord, or None if it has no usable URL"""
+    images = renditions((media.get("image_versions2") or {}).get("candidates"))
+    if media_type == 1:  # Image
+        return MediaRecord("image", images, (), carousel_index, media_id) if images else None
+    if media_type == 2:  # Video, with its cover image
+        videos = renditions(media.get("video_versions"))
+        return MediaRecord("video", videos, images, carousel_index, media_id) if videos else None
     return None
 
 def process_carousel_media(carousel_media, debug_info):
-    """Process carousel media items and return a list of media data"""
+    """Process carousel media items and return a list of media records"""
     media_items = []
-    if not carousel_media or not isinstance(carousel_media, list):
-        return media_items
-        
-    for idx, media in enumerate(carousel_media):
+    for idx, media in enumerate(carousel_media or ()):
         try:
-            carousel_media_type = media.get("media_type")
-            media_data = process_media_item(media, carousel_media_type, True, idx)
-            if media_data:
-                media_items.append(media_data)
-        except Exception as e:
+            media_data = process_media_item(media, media.get("media_type"), idx)
+        except (AttributeError, IndexError, KeyError, TypeError) as e:
             debug_info["errors"].append(f"Failed to process carousel item {idx}: {str(e)}")
             continue
+        if media_data:
+            media_items.append(media_data)
     return media_items
 
 def create_post_info(post, debug_info):
-    """Create a post information dictionary with all necessary data"""
-    try:
-        # Safely get post data with defaults
-        caption = post.get("caption", {}) or {}
-        caption_text = caption.get("text", "") if isinstance(caption, dict) else ""
+    """Build the PostRecord for a raw feed item"""
+    media_type = post.get("media_type")
+    if media_type == 8:  # Carousel
+        media = process_carousel_media(post.get("carousel_media"), debug_info)
+    else:  # Single image or video
+        media_data = process_media_item(post, media_type)
+        media = [media_data] if media_data else []
+    
+    caption = post.get("caption")
+    return PostRecord(
+        post.get("id", ""),
+        caption.get("text", "") if isinstance(caption, dict) else "",
+        post.get("taken_at", 0),
+        post.get("like_count", 0),
+        post.get("comment_count", 0),
+        media_type,
+        media
+    )
+
+def posts_page_url(user_id, max_id=None):
+    url = f"{INSTAGRAM_WEB_API}/feed/user/{user_id}/?count=50"
+    if max_id:
+        url += f"&max_id={max_id}"
+    return url
+
+def process_posts_page(posts_data, debug_info):
+    """Turn one raw feed page into post records plus its pagination cursor"""
+    start = time.perf_counter()
+    post_items = []
+    pinned_ids = set()
+    for post in posts_data.get("items", []) or []:
+        try:
+            debug_info["stats"]["posts_processed"] += 1
+            post_info = create_post_info(post, debug_info)
+            
+            if post_info.media:
+                post_items.append(post_info)
+                if post.get("timeline_pinned_user_ids"):
+                    pinned_ids.add(post_info.id)
+            else:
+                debug_info["warnings"].append(f"Post {post.get('id', 'unknown')} has no valid media")
+                
+        except Exception as e:
+            debug_info["stats"]["posts_failed"] += 1
+            debug_info["errors"].append(f"Failed to process post {post.get('id', 'unknown')}: {str(e)}")
+            continue
+    
+    # Check if there are more posts to fetch
+    next_max_id = posts_data.get("next_max_id")
+    has_more_posts = bool(posts_data.get("items") and posts_data.get("more_available") and next_max_id)
+    parse_latency.observe(time.perf_counter() - start, stage="posts_page")
+    return {
+        "items": post_items,
+        "pinned_ids": pinned_ids,
+        "next_max_id": next_max_id,
+        "more_available": has_more_posts
+    }
+
+def fetch_posts_page(user_id, max_id, debug_info):
+    """Fetch and process one page of a user's feed, or return None if the request failed"""
+    debug_info["stats"]["api_calls"] += 1
+    posts_res = make_instagram_request(posts_page_url(user_id, max_id))
+    error = instagram_error(posts_res)
+    if error:
+        debug_info["errors"].append(f"Failed to fetch posts: {error}")
+        return None
+    
+    page = process_posts_page(posts_res.payload, debug_info)
+    if post_archive:
+        post_archive.save_posts(user_id, page["items"])
+    return page
+
+# Incremental merge of feed pages into a user's saved feed state
+class FeedSync:
+    def __init__(self, user_id, incremental=True, max_posts=100):
+        self.user_id = user_id
+        self.max_posts = max_posts
+        cached = response_cache.get("feed", user_id) if incremental else None
+        self.feed_state = cached[0] if cached else None
+        self.known_ids = {post.id for post in self.feed_state["items"]} if self.feed_state else set()
+        self.new_items = []
+        self.has_more_posts = True
+        self.max_id = None
+        self.reached_known = False
+        self.failed = False
+        self.pages = 0
+
+    def wants_more(self):
+        return (
+            self.has_more_posts and not self.reached_known and not self.failed
+            and len(self.new_items) < self.max_posts
+        )
+
+    def add_page(self, page):
+        """Merge one processed page and return the posts in it that are new"""
+        self.pages += 1
+        page_items = []
+        for post_info in page["items"]:
+            if post_info.id in self.known_ids:
+                # Pinned posts sit above newer ones, so only a known unpinned post ends the sync
+                if post_info.id not in page["pinned_ids"]:
+                    self.reached_known = True
+                    break
+                continue
+            page_items.append(post_info)
+        self.new_items.extend(page_items)
+        self.has_more_posts = page["more_available"]
+        self.max_id = page["next_max_id"]
+        return page_items
+
+    def finish(self, debug_info, on_page=None):
+        """Save the merged feed state and return the posts payload"""
+        feed_state = self.feed_state
+        if self.reached_known:
+            # Keep the deeper cursor from the earlier sync; only the head of the feed changed
+            feed_state = {
+                "items": self.new_items + feed_state["items"],
+                "next_max_id": feed_state["next_max_id"],
+                "more_available": feed_state["more_available"]
+            }
+        elif not self.failed:
+            feed_state = {"items": self.new_items, "next_max_id": self.max_id, "more_available": self.has_more_posts}
         
-        post_info = {
-            "id": post.get("id", ""),
-            "caption": caption_text,
-            "timestamp": post.get("taken_at", 0),
-            "like_count": post.get("like_count", 0),
-            "comment_count": post.get("comment_count", 0),
-            "is_video": post.get("media_type") == 2,
-            "is_carousel": post.get("media_type") == 8,
-            "media": []
+        debug_info["posts_sync"] = {
+            "mode": "incremental" if self.known_ids else "full",
+            "pages": self.pages,
+            "new_posts": len(self.new_items),
+            "stored_posts": len(feed_state["items"]) if feed_state else len(self.new_items)
         }
         
-        # Process media based on type
-        media_type = post.get("media_type")
+        if self.failed:
+            if not self.new_items:
+                stale = response_cache.fallback("posts", self.user_id, debug_info)
+                if stale is not None:
+                    if on_page and stale["items"]:
+                        on_page(stale["items"])
+                    return stale
+            return {"count": len(self.new_items), "items": self.new_items}
         
-        if media_type == 1 or media_type == 2:  # Single image or video
-            media_data = process_media_item(post, media_type)
-            if media_data:
-                post_info["media"].append(media_data)
-                
-        elif media_type == 8:  # Carousel
-            carousel_media = post.get("carousel_media", []) or []
-            post_info["media"].extend(process_carousel_media(carousel_media, debug_info))
-            
-        return post_info
-    except Exception as e:
-        raise Exception(f"Failed to create post info: {str(e)}")
+        response_cache.set("feed", self.user_id, feed_state)
+        post_items = feed_state["items"][:self.max_posts]
+        if on_page and self.reached_known and len(post_items) > len(self.new_items):
+            on_page(post_items[len(self.new_items):])
+        posts_data = {"count": len(post_items), "items": post_items}
+        response_cache.set("posts", self.user_id, posts_data)
+        return posts_data
 
-def fetch_user_posts(user_id, debug_info):
-    """Fetch and process all posts for a user"""
-    posts_url = f"https://www.instagram.com/api/v1/feed/user/{user_id}/?count=50"
-    post_items = []
-    has_more_posts = True
-    max_id = None
-    max_posts = 100  # Set a reasonable limit to avoid too many requests
-    
-    while has_more_posts and len(post_items) < max_posts:
+def fetch_user_posts(user_id, debug_info, incremental=True, on_page=None):
+    """Fetch and process posts for a user, stopping at posts already synced earlier
+
+    on_page, if given, is called with each batch of posts as soon as it is available.
+    """
+    feed_sync = FeedSync(user_id, incremental)
+    while feed_sync.wants_more():
         try:
-            current_url = posts_url
-            if max_id:
-                current_url += f"&max_id={max_id}"
-            
-            debug_info["stats"]["api_calls"] += 1
-            posts_res = make_instagram_request(current_url)
-            if isinstance(posts_res, str):
-                debug_info["errors"].append(f"Failed to fetch posts: {posts_res}")
-                break
-                
-            posts_data = posts_res.json()
-            
-            if not posts_data.get("items"):
+            page = fetch_posts_page(user_id, feed_sync.max_id, debug_info)
+            if page is None:
+                feed_sync.failed = True
                 break
-                
-            for post in posts_data.get("items", []):
-                try:
-                    debug_info["stats"]["posts_processed"] += 1
-                    post_info = create_post_info(post, debug_info)
-                    
-                    if post_info["media"]:
-                        post_items.append(post_info)
-                    else:
-                        debug_info["warnings"].append(f"Post {post.get('id', 'unknown')} has no valid media")
-                        
-                except Exception as e:
-                    debug_info["stats"]["posts_failed"] += 1
-                    debug_info["errors"].append(f"Failed to process post {post.get('id', 'unknown')}: {str(e)}")
-                    continue
-            
-            # Check if there are more posts to fetch
-            has_more_posts = posts_data.get("more_available", False)
-            max_id = posts_data.get("next_max_id")
-            
-            # Add a small delay between pagination requests to avoid rate limiting
-            if has_more_posts and max_id:
-                time.sleep(1)
-                
+            page_items = feed_sync.add_page(page)
+            if on_page and page_items:
+                on_page(page_items)
         except Exception as e:
             debug_info["errors"].append(f"Failed to fetch posts page: {str(e)}")
+            feed_sync.failed = True
             break
-            
-    return {"count": len(post_items), "items": post_items}
+    return feed_sync.finish(debug_info, on_page)
 
-@app.route('/api/instagram/<username>')
-@limit_exempt_uptime()
-def api_instagram(username):
-    username = username.strip()
-    if not username:
-        return jsonify({"error": "Missing username"}), 400
+def fetch_more_user_posts(user_id, debug_info, pages=1):
+    """Continue a user's saved feed cursor past the default post limit"""
+    cached = response_cache.get("feed", user_id)
+    if cached is None:
+        return None
+    feed_state = cached[0]
+    known_ids = {post.id for post in feed_state["items"]}
     
-    # Initialize debug info
-    debug_info = {
+    new_items = []
+    fetched = 0
+    while feed_state["more_available"] and feed_state["next_max_id"] and fetched < pages:
+        try:
+            page = fetch_posts_page(user_id, feed_state["next_max_id"], debug_info)
+        except Exception as e:
+            debug_info["errors"].append(f"Failed to fetch posts page: {str(e)}")
+            break
+        if page is None:
+            break
+        fetched += 1
+        page_items = [post for post in page["items"] if post.id not in known_ids]
+        known_ids.update(post.id for post in page_items)
+        new_items.extend(page_items)
+        feed_state = {
+            "items": feed_state["items"] + page_items,
+            "next_max_id": page["next_max_id"],
+            "more_available": page["more_available"]
+        }
+    
+    response_cache.set("feed", user_id, feed_state)
+    return {
+        "posts": {"count": len(new_items), "items": new_items},
+        "has_more": feed_state["more_available"],
+        "stored_count": len(feed_state["items"])
+    }
+
+def stories_url(user_id):
+    return f"{INSTAGRAM_MOBILE_API}/feed/user/{user_id}/reel_media/"
+
+def process_stories(stories, debug_info):
+    """Turn raw reel items into story records"""
+    start = time.perf_counter()
+    story_items = []
+    for story in stories:
+        try:
+            debug_info["stats"]["stories_processed"] += 1
+            media_data = process_media_item(story, story.get("media_type"), media_id=story.get("id"))
+            if media_data:
+                story_items.append(media_data)
+        except Exception as e:
+            debug_info["stats"]["stories_failed"] += 1
+            debug_info["errors"].append(f"Failed to process story: {str(e)}")
+            continue
+    
+    parse_latency.observe(time.perf_counter() - start, stage="stories")
+    return {"count": len(story_items), "items": story_items}
+
+def fetch_user_stories(user_id, debug_info):
+    """Fetch and process the current stories for a user"""
+    stories_res = make_instagram_request(stories_url(user_id))
+    error = instagram_error(stories_res)
+    if error:
+        debug_info["errors"].append(f"Failed to fetch stories: {error}")
+        stale = response_cache.fallback("stories", user_id, debug_info)
+        if stale is not None:
+            return stale
+        return process_stories([], debug_info)
+    
+    stories_data = process_stories(stories_res.payload.get("items", []), debug_info)
+    response_cache.set("stories", user_id, stories_data)
+    if post_archive:
+        post_archive.save_stories(user_id, stories_data["items"])
+    return stories_data
+
+def timed_call(func, *args, **kwargs):
+    """Run func and return its result together with the elapsed time in seconds"""
+    start = time.time()
+    result = func(*args, **kwargs)
+    return result, round(time.time() - start, 2)
+
+def record_lookup_stages(stats):
+    """Feed a finished lookup's stage timings (from its debug stats) into /metrics"""
+    for stage in ("profile", "stories", "posts"):
+        # Zero means the stage was served from cache and never ran
+        if stats[f"{stage}_time"]:
+            lookup_stage_latency.observe(stats[f"{stage}_time"], stage=stage)
+    lookup_stage_latency.observe(stats["processing_time"], stage="total")
+
+def new_debug_info():
+    """Create the debug_info structure reported alongside Instagram API responses"""
+    return {
         "request_time": datetime.now().isoformat(),
         "errors": [],
         "warnings": [],
+        "cache": {},
         "stats": {
             "posts_processed": 0,
             "posts_failed": 0,
             "stories_processed": 0,
             "stories_failed": 0,
             "api_calls": 0,
+            "profile_time": 0,
+            "stories_time": 0,
+            "posts_time": 0,
             "processing_time": 0
         }
     }
-    
-    start_time = time.time()
-    try:
-        # Get profile data
-        debug_info["stats"]["api_calls"] += 1
-        user_url = f"https://www.instagram.com/api/v1/users/web_profile_info/?username={username}"
-        res = make_instagram_request(user_url)
-        if isinstance(res, str):
-            return jsonify({"error": res, "debug": debug_info}), 500
-            
-        user_data = res.json().get("data", {}).get("user", {})
-        
-        if not user_data:
-            debug_info["errors"].append("User not found in Instagram response")
-            return jsonify({"error": "User not found", "debug": debug_info}), 404
-            
-        pic_url = user_data.get("profile_pic_url_hd") or user_data.get("profile_pic_url")
-        profile_data = {
+
+def profile_url(username):
+    return f"{INSTAGRAM_WEB_API}/users/web_profile_info/?username={username}"
+
+def build_profile_entry(user_data):
+    """Profile record plus the fields the rest of a lookup needs"""
+    pic_url = user_data.get("profile_pic_url_hd") or user_data.get("profile_pic_url")
+    return {
+        "profile": {
             "username": user_data.get("username"),
             "full_name": user_data.get("full_name"),
             "profile_pic": pic_url,
@@ -499,71 +1796,699 @@ def api_instagram(username):
             "following": user_data.get("edge_follow", {}).get("count", 0),
             "posts_count": user_data.get("edge_owner_to_timeline_media", {}).get("count", 0),
             "is_private": user_data.get("is_private", True)
-        }
+        },
+        "user_id": user_data.get("id"),
+        "restricted": bool(user_data.get("is_private") and not user_data.get("followed_by_viewer", False))
+    }
+
+def fetch_user_profile(username, debug_info, refresh=False):
+    """Fetch a user's profile entry; returns (profile_entry, error, status_code)"""
+    profile_key = username.lower()
+    profile_entry = response_cache.lookup("profile", profile_key, debug_info, refresh)
+    if profile_entry is not None:
+        return profile_entry, None, 200
+    
+    debug_info["stats"]["api_calls"] += 1
+    res, debug_info["stats"]["profile_time"] = timed_call(make_instagram_request, profile_url(username))
+    if isinstance(res, str):
+        profile_entry = response_cache.fallback("profile", profile_key, debug_info)
+        if profile_entry is None:
+            return None, res, instagram_error_status(res)
+        return profile_entry, None, 200
+        
+    user_data = (res.payload.get("data") or {}).get("user") or {}
+    
+    if not user_data:
+        debug_info["errors"].append("User not found in Instagram response")
+        return None, "User not found", 404
+        
+    profile_entry = build_profile_entry(user_data)
+    response_cache.set("profile", profile_key, profile_entry)
+    if post_archive:
+        post_archive.save_profile(profile_entry)
+    return profile_entry, None, 200
+
+def lookup_instagram_user(username, refresh=False, incremental=True):
+    """Run a full profile/stories/posts lookup; returns (payload, status_code)"""
+    # Initialize debug info
+    debug_info = new_debug_info()
+    
+    start_time = time.time()
+    try:
+        # Get profile data
+        profile_entry, error, status = fetch_user_profile(username, debug_info, refresh)
+        if error:
+            return {"error": error, "debug": debug_info}, status
         
-        if user_data.get("is_private") and not user_data.get("followed_by_viewer", False):
+        profile_data = profile_entry["profile"]
+        if profile_entry["restricted"]:
             debug_info["warnings"].append("Private account - limited data available")
-            return jsonify({
+            return {
                 "profile": profile_data, 
                 "stories": {"count": 0, "items": []}, 
                 "posts": {"count": 0, "items": []},
                 "debug": debug_info
-            })
+            }, 200
             
-        user_id = user_data.get("id")
+        user_id = profile_entry["user_id"]
         if not user_id:
             debug_info["errors"].append("Could not fetch user ID from Instagram response")
-            return jsonify({"error": "Could not fetch user ID", "debug": debug_info}), 500
+            return {"error": "Could not fetch user ID", "debug": debug_info}, 500
             
-        # Get stories
-        debug_info["stats"]["api_calls"] += 1
-        stories_url = f"https://i.instagram.com/api/v1/feed/user/{user_id}/reel_media/"
-        stories_res = make_instagram_request(stories_url)
-        if isinstance(stories_res, str):
-            debug_info["errors"].append(f"Failed to fetch stories: {stories_res}")
-            stories = []
-        else:
-            stories = stories_res.json().get("items", [])
-        
-        story_items = []
-        for story in stories:
-            try:
-                debug_info["stats"]["stories_processed"] += 1
-                media_type = story.get("media_type")
-                if media_type == 1:  # Image
-                    candidates = story.get('image_versions2', {}).get('candidates', [])
-                    if candidates:
-                        image_url = candidates[0]['url']
-                        story_items.append({"type": "image", "url": image_url})
-                elif media_type == 2:  # Video
-                    videos = story.get('video_versions', [])
-                    if videos:
-                        video_url = videos[0]['url']
-                        story_items.append({"type": "video", "url": video_url})
-            except Exception as e:
-                debug_info["stats"]["stories_failed"] += 1
-                debug_info["errors"].append(f"Failed to process story: {str(e)}")
-                continue
-                
-        stories_data = {"count": len(story_items), "items": story_items}
-        
-        # Get posts using the new helper function
-        posts_data = fetch_user_posts(user_id, debug_info)
+        # Fetch stories and posts concurrently now that the user ID is known
+        stories_data = response_cache.lookup("stories", user_id, debug_info, refresh)
+        posts_data = response_cache.lookup("posts", user_id, debug_info, refresh)
+        if stories_data is None:
+            debug_info["stats"]["api_calls"] += 1
+            stories_future = instagram_executor.submit(timed_call, fetch_user_stories, user_id, debug_info)
+        if posts_data is None:
+            posts_future = instagram_executor.submit(timed_call, fetch_user_posts, user_id, debug_info, incremental)
+        if stories_data is None:
+            stories_data, debug_info["stats"]["stories_time"] = stories_future.result()
+        if posts_data is None:
+            posts_data, debug_info["stats"]["posts_time"] = posts_future.result()
         
         # Calculate processing time
         debug_info["stats"]["processing_time"] = round(time.time() - start_time, 2)
+        record_lookup_stages(debug_info["stats"])
         
-        return jsonify({
+        return {
             "profile": profile_data,
             "stories": stories_data,
             "posts": posts_data,
             "debug": debug_info
-        })
+        }, 200
+    except Exception as e:
+        debug_info["errors"].append(f"Fatal error: {str(e)}")
+        debug_info["stats"]["processing_time"] = round(time.time() - start_time, 2)
+        return {"error": str(e), "debug": debug_info}, 500
+
+# Default rendition for media in responses: largest, smallest, max:<width> or target:<width>
+INSTAGRAM_MEDIA_QUALITY = os.getenv("INSTAGRAM_MEDIA_QUALITY", "largest")
+
+def media_quality(spec=None):
+    """Parsed ?quality= choice, falling back to INSTAGRAM_MEDIA_QUALITY; raises ValueError"""
+    return parse_quality(spec or INSTAGRAM_MEDIA_QUALITY)
+
+def project_payload(payload, fields=None, quality=None):
+    """
+    Shape the records in a payload for a response: a ?fields= projection of the
+    posts (e.g. "id,media.url") and the rendition chosen by ?quality= for every
+    media item, stories included.
+    """
+    if not fields and quality is None:
+        return payload
+    payload = dict(payload)
+    if payload.get("posts"):
+        items = [post.to_dict(fields, quality) for post in payload["posts"]["items"]]
+        payload["posts"] = dict(payload["posts"], items=items)
+    if payload.get("stories") and quality is not None:
+        items = [media.to_dict(quality=quality) for media in payload["stories"]["items"]]
+        payload["stories"] = dict(payload["stories"], items=items)
+    return payload
+
+# Conditional requests for pollers: a digest of a lookup's content is sent as a weak
+# ETag, and the post/story ids behind each digest are kept for a while so that
+# ?since=<etag> can answer with only what was added or removed since.
+INSTAGRAM_SNAPSHOT_TTL = int(os.getenv("INSTAGRAM_SNAPSHOT_TTL", "86400"))
+
+def content_digest(payload, fields=None, quality=None):
+    """
+    Digest of a lookup payload as shaped by fields and quality. The debug block and
+    CDN URL signatures are left out, so a re-fetch of unchanged content keeps its digest.
+    """
+    content = {key: value for key, value in payload.items() if key != "debug"}
+    if content.get("profile"):
+        content["profile"] = dict(content["profile"], profile_pic=records.unsigned_url(content["profile"]["profile_pic"]))
+    shape = records.dumps([fields, quality])
+    return hashlib.sha1((shape + records.dumps(content, default=records.encode_digest)).encode()).hexdigest()
+
+def parse_etag(value):
+    """The bare digest from an ETag as clients send it back: W/"abc", "abc" or abc"""
+    value = (value or "").strip()
+    if value.startswith("W/"):
+        value = value[2:]
+    return value.strip('"')
+
+def etag_matches(if_none_match, etag):
+    """Whether an If-None-Match header lists etag (weak comparison)"""
+    if not if_none_match:
+        return False
+    return any(tag.strip() == "*" or parse_etag(tag) == etag for tag in if_none_match.split(","))
+
+def story_key(media):
+    # Stories cached before ids were recorded fall back to their unsigned URL
+    return media.id or media.url.split("?")[0]
+
+def snapshot_ids(payload):
+    return {
+        "posts": [post.id for post in (payload.get("posts") or {}).get("items", ())],
+        "stories": [story_key(media) for media in (payload.get("stories") or {}).get("items", ())]
+    }
+
+def save_snapshot(etag, payload):
+    key = f"instagram:snapshot:{etag}"
+    if shared_state.get(key) is None:
+        shared_state.set(key, json.dumps(snapshot_ids(payload)), ttl=INSTAGRAM_SNAPSHOT_TTL)
+
+def changes_since_snapshot(payload, shaped, since_ids):
+    """Cut a shaped payload down to the posts and stories missing from since_ids, plus the ids removed since"""
+    changed = dict(shaped)
+    current = snapshot_ids(payload)
+    for part in ("posts", "stories"):
+        if not shaped.get(part):
+            continue
+        known = set(since_ids[part])
+        present = set(current[part])
+        items = [item for key, item in zip(current[part], shaped[part]["items"]) if key not in known]
+        removed = [key for key in since_ids[part] if key not in present]
+        changed[part] = dict(shaped[part], count=len(items), items=items, removed=removed)
+    return changed
+
+def posts_since(payload, shaped, post_id):
+    """Cut a shaped payload's posts down to those newer than post_id; None if that post is not in it"""
+    posts = (payload.get("posts") or {}).get("items", ())
+    since = next((post for post in posts if post.id == post_id), None)
+    if since is None:
+        return None
+    items = [item for post, item in zip(posts, shaped["posts"]["items"]) if post.timestamp > since.timestamp]
+    changed = dict(shaped)
+    changed["posts"] = dict(shaped["posts"], count=len(items), items=items)
+    return changed
+
+def conditional_payload(payload, fields=None, quality=None, since=None, since_id=None):
+    """
+    Shape a successful lookup payload for a response and compute its ETag; returns
+    (payload, etag). With since (an earlier ETag) or since_id (a post id) only the
+    changes are returned; when that baseline is unknown the full payload is, and
+    "changes" says which it was.
+    """
+    shaped = project_payload(payload, fields, quality)
+    etag = content_digest(payload, fields, quality)
+    save_snapshot(etag, payload)
+    if since:
+        since = parse_etag(since)
+        raw = shared_state.get(f"instagram:snapshot:{since}")
+        changed = changes_since_snapshot(payload, shaped, json.loads(raw)) if raw else None
+    elif since_id:
+        changed = posts_since(payload, shaped, since_id)
+    else:
+        return shaped, etag
+    if changed is None:
+        shaped = dict(shaped, changes={"since": since or since_id, "delta": False, "reason": "Unknown or expired baseline"})
+        return shaped, etag
+    changed["changes"] = {"since": since or since_id, "delta": True}
+    return changed, etag
+
+@app.route('/api/instagram/<username>')
+@limit_exempt_uptime()
+def api_instagram(username):
+    username = username.strip()
+    if not username:
+        return jsonify({"error": "Missing username"}), 400
+    
+    refresh = request.args.get("refresh", "").lower() in ("1", "true", "yes")
+    incremental = request.args.get("sync", "incremental").lower() != "full"
+    
+    try:
+        quality = media_quality(request.args.get("quality"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    fields = parse_fields(request.args.get("fields"))
+    payload, status = lookup_instagram_user(username, refresh, incremental)
+    if status != 200:
+        return jsonify(project_payload(payload, fields, quality)), status, retry_after_headers(status)
+    
+    payload, etag = conditional_payload(
+        payload, fields, quality, request.args.get("since"), request.args.get("since_id")
+    )
+    # Checked before serializing: an unchanged poll costs no response body at all
+    if etag_matches(request.headers.get("If-None-Match"), etag):
+        response = Response(status=304)
+    else:
+        response = jsonify(payload)
+    response.set_etag(etag, weak=True)
+    return response
+
+def get_batch_body():
+    """A batch request's JSON body; anything but an object counts as empty"""
+    body = request.get_json(silent=True)
+    return body if isinstance(body, dict) else {}
+
+def get_batch_usernames():
+    """Parse and de-duplicate the usernames list from a batch request body"""
+    usernames = get_batch_body().get("usernames")
+    if not isinstance(usernames, list):
+        return None
+    seen = set()
+    cleaned = []
+    for username in usernames:
+        if not isinstance(username, str) or not username.strip():
+            continue
+        username = username.strip()
+        if username.lower() not in seen:
+            seen.add(username.lower())
+            cleaned.append(username)
+    return cleaned[:BATCH_MAX_USERNAMES]
+
+def batch_upstream_cost():
+    """Limiter cost of a batch: one unit per username whose profile is not cached fresh"""
+    usernames = get_batch_usernames() or []
+    if get_batch_body().get("refresh"):
+        return max(len(usernames), 1)
+    cost = 0
+    for username in usernames:
+        cached = response_cache.get("profile", username.lower())
+        if cached is None or not cached[2]:
+            cost += 1
+    return max(cost, 1)
+
+@app.route('/api/instagram/batch', methods=['POST'])
+@limiter.limit(os.getenv("BATCH_RATE_LIMIT", "200 per hour"), cost=batch_upstream_cost)
+def api_instagram_batch():
+    """Look up many usernames, streaming one NDJSON line per username as it finishes"""
+    usernames = get_batch_usernames()
+    if usernames is None:
+        return jsonify({"error": "Expected a JSON body with a 'usernames' list"}), 400
+    if not usernames:
+        return jsonify({"error": "No usernames provided"}), 400
+    
+    body = get_batch_body()
+    refresh = bool(body.get("refresh"))
+    incremental = str(body.get("sync", "incremental")).lower() != "full"
+    fields = body.get("fields") or request.args.get("fields")
+    if not isinstance(fields, (str, type(None))):
+        return jsonify({"error": "Invalid fields"}), 400
+    fields = parse_fields(fields)
+    quality = body.get("quality") or request.args.get("quality")
+    if not isinstance(quality, (str, type(None))):
+        return jsonify({"error": "Invalid quality"}), 400
+    try:
+        quality = media_quality(quality)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    def generate():
+        futures = {
+            batch_executor.submit(lookup_instagram_user, username, refresh, incremental): username
+            for username in usernames
+        }
+        try:
+            for future in as_completed(futures):
+                payload, status = future.result()
+                result = project_payload(payload, fields, quality)
+                yield records.dumps({"username": futures[future], "status": status, "result": result}) + "\n"
+        finally:
+            # Client went away: drop lookups that have not started yet
+            for future in futures:
+                future.cancel()
+    
+    return Response(generate(), mimetype="application/x-ndjson", headers={"Cache-Control": "no-cache"})
+
+@app.route('/api/instagram/<username>/posts/more')
+@limit_exempt_uptime()
+def api_instagram_more_posts(username):
+    """Continue a user's feed past the default 100 posts from the saved cursor"""
+    username = username.strip()
+    if not username:
+        return jsonify({"error": "Missing username"}), 400
+    
+    try:
+        pages = min(max(int(request.args.get("pages", 1)), 1), 5)
+    except ValueError:
+        return jsonify({"error": "Invalid pages value"}), 400
+    try:
+        quality = media_quality(request.args.get("quality"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    debug_info = new_debug_info()
+    start_time = time.time()
+    try:
+        profile_entry, error, status = fetch_user_profile(username, debug_info)
+        if error:
+            return jsonify({"error": error, "debug": debug_info}), status, retry_after_headers(status)
+        if profile_entry["restricted"] or not profile_entry["user_id"]:
+            return jsonify({"error": "Posts not available for this account", "debug": debug_info}), 403
+        
+        result, debug_info["stats"]["posts_time"] = timed_call(
+            fetch_more_user_posts, profile_entry["user_id"], debug_info, pages
+        )
+        if result is None:
+            return jsonify({
+                "error": "No saved feed cursor; fetch /api/instagram/<username> first",
+                "debug": debug_info
+            }), 409
+        
+        debug_info["stats"]["processing_time"] = round(time.time() - start_time, 2)
+        result["debug"] = debug_info
+        return jsonify(project_payload(result, parse_fields(request.args.get("fields")), quality))
     except Exception as e:
         debug_info["errors"].append(f"Fatal error: {str(e)}")
         debug_info["stats"]["processing_time"] = round(time.time() - start_time, 2)
         return jsonify({"error": str(e), "debug": debug_info}), 500
 
+def stream_instagram_records(username, refresh=False, incremental=True):
+    """Yield (kind, data) records for a lookup as soon as each part is available"""
+    debug_info = new_debug_info()
+    start_time = time.time()
+    try:
+        profile_entry, error, status = fetch_user_profile(username, debug_info, refresh)
+        if error:
+            yield "error", {"error": error, "status": status}
+        elif profile_entry["restricted"]:
+            debug_info["warnings"].append("Private account - limited data available")
+            yield "profile", profile_entry["profile"]
+        elif not profile_entry["user_id"]:
+            debug_info["errors"].append("Could not fetch user ID from Instagram response")
+            yield "error", {"error": "Could not fetch user ID", "status": 500}
+        else:
+            yield "profile", profile_entry["profile"]
+            user_id = profile_entry["user_id"]
+            parts = queue.Queue()
+            pending = 0
+            
+            def run_part(part, func, *args):
+                try:
+                    result, debug_info["stats"][f"{part}_time"] = timed_call(func, *args)
+                    if part == "stories":
+                        parts.put(("stories", result))
+                except Exception as e:
+                    debug_info["errors"].append(f"Failed to fetch {part}: {str(e)}")
+                finally:
+                    parts.put((None, None))
+            
+            stories_data = response_cache.lookup("stories", user_id, debug_info, refresh)
+            if stories_data is None:
+                debug_info["stats"]["api_calls"] += 1
+                instagram_executor.submit(run_part, "stories", fetch_user_stories, user_id, debug_info)
+                pending += 1
+            else:
+                yield "stories", stories_data
+            
+            posts_data = response_cache.lookup("posts", user_id, debug_info, refresh)
+            if posts_data is None:
+                on_page = lambda items: parts.put(("posts", {"count": len(items), "items": items}))
+                instagram_executor.submit(run_part, "posts", fetch_user_posts, user_id, debug_info, incremental, on_page)
+                pending += 1
+            else:
+                yield "posts", posts_data
+            
+            while pending:
+                kind, data = parts.get()
+                if kind is None:
+                    pending -= 1
+                else:
+                    yield kind, data
+    except Exception as e:
+        debug_info["errors"].append(f"Fatal error: {str(e)}")
+        yield "error", {"error": str(e), "status": 500}
+    
+    debug_info["stats"]["processing_time"] = round(time.time() - start_time, 2)
+    yield "done", {"debug": debug_info}
+
+@app.route('/api/instagram/<username>/stream')
+@limit_exempt_uptime()
+def api_instagram_stream(username):
+    """Stream a lookup as NDJSON (default) or Server-Sent Events (?format=sse)"""
+    username = username.strip()
+    if not username:
+        return jsonify({"error": "Missing username"}), 400
+    
+    refresh = request.args.get("refresh", "").lower() in ("1", "true", "yes")
+    incremental = request.args.get("sync", "incremental").lower() != "full"
+    use_sse = request.args.get("format", "ndjson").lower() == "sse"
+    fields = parse_fields(request.args.get("fields"))
+    try:
+        quality = media_quality(request.args.get("quality"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    def generate():
+        for kind, data in stream_instagram_records(username, refresh, incremental):
+            if kind in ("posts", "stories"):
+                data = project_payload({kind: data}, fields, quality)[kind]
+            if use_sse:
+                yield f"event: {kind}\ndata: {records.dumps(data)}\n\n"
+            else:
+                yield records.dumps({"type": kind, "data": data}) + "\n"
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream" if use_sse else "application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def refresh_watched_user(username, parts):
+    """Re-fetch the given parts of a watched user's lookup; the other parts come from cache"""
+    payload, status = lookup_instagram_user(username, refresh=set(parts), incremental=True)
+    if status != 200:
+        raise RuntimeError(payload.get("error") or f"Lookup failed with status {status}")
+
+def watched_cache_ages(username):
+    """Age of each cached part a user's lookup needs, None for a part not cached"""
+    cached = response_cache.get("profile", username.lower())
+    if cached is None:
+        return {"profile": None}
+    profile_entry, age, _ = cached
+    ages = {"profile": age}
+    if profile_entry["restricted"] or not profile_entry["user_id"]:
+        return ages
+    for part in ("stories", "posts"):
+        cached = response_cache.get(part, profile_entry["user_id"])
+        ages[part] = cached[1] if cached is not None else None
+    return ages
+
+# Refresh-ahead for watched usernames. Each part is refreshed at its cache TTL or the
+# user's interval, whichever is shorter; by default that is just the TTL.
+WATCHED_PARTS_TTLS = {part: response_cache.ttls[part] for part in ("profile", "stories", "posts")}
+watch_scheduler = RefreshScheduler(
+    shared_state,
+    refresh_watched_user,
+    watched_cache_ages,
+    lambda: cookie_manager.spare_capacity(request_pacer.available_at if request_pacer.enabled else None),
+    ttls=WATCHED_PARTS_TTLS,
+    default_interval=int(os.getenv("WATCH_DEFAULT_INTERVAL", str(max(WATCHED_PARTS_TTLS.values())))),
+    min_interval=int(os.getenv("WATCH_MIN_INTERVAL", "30")),
+    lead=float(os.getenv("WATCH_REFRESH_LEAD", "10")),
+    max_users=int(os.getenv("WATCH_MAX_USERS", "100")),
+    workers=int(os.getenv("WATCH_WORKERS", "2")),
+    lease_ttl=float(os.getenv("WATCH_LEASE_TTL", "120")),
+    metrics=metrics
+)
+if os.getenv("WATCH_ENABLED", "true").lower() not in ("0", "false", "no"):
+    watch_scheduler.start()
+
+@app.route('/api/watchlist', methods=['GET', 'POST'])
+def api_instagram_watch():
+    """List watched users with their refresh status, or add one: {"username": ..., "interval": seconds}"""
+    if request.method == 'GET':
+        return jsonify({"users": watch_scheduler.describe(), "stats": watch_scheduler.stats()})
+
+    body = request.get_json(silent=True) or {}
+    username = body.get("username")
+    if not isinstance(username, str) or not username.strip():
+        return jsonify({"error": "Expected a JSON body with a 'username'"}), 400
+    interval = body.get("interval")
+    if interval is not None and (not isinstance(interval, (int, float)) or interval <= 0):
+        return jsonify({"error": "'interval' must be a positive number of seconds"}), 400
+
+    try:
+        entry = watch_scheduler.watch(username.strip(), interval)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(entry), 201
+
+@app.route('/api/watchlist/<username>', methods=['DELETE'])
+def api_instagram_unwatch(username):
+    if not watch_scheduler.unwatch(username.strip()):
+        return jsonify({"error": "User is not watched"}), 404
+    return jsonify({"username": username.strip(), "watched": False})
+
+def parse_time_param(value):
+    """Epoch seconds or an ISO 8601 date/time from a query parameter; raises ValueError"""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        raise ValueError(f"Invalid time: {value!r} (expected epoch seconds or ISO 8601)")
+
+def archive_query_args():
+    """Filters shared by the archive endpoints; raises ValueError"""
+    return {
+        "username": request.args.get("username"),
+        "user_id": request.args.get("user_id"),
+        "since": parse_time_param(request.args.get("since")),
+        "until": parse_time_param(request.args.get("until")),
+        "media_type": request.args.get("type"),
+        "cursor": request.args.get("cursor"),
+        "limit": request.args.get("limit", type=int)
+    }
+
+@app.route('/api/archive/posts')
+@limiter.limit(os.getenv("ARCHIVE_RATE_LIMIT", "120 per minute"))
+def api_archive_posts():
+    """
+    Query archived posts without touching Instagram: ?username=, ?since=/?until=
+    (post time), ?type=image|video|carousel, ?q= caption search, ?order=oldest,
+    and ?cursor= from the previous page's next_cursor.
+    """
+    if post_archive is None:
+        return jsonify({"error": "Archive is disabled"}), 404
+    try:
+        result = post_archive.query_posts(
+            text=request.args.get("q"),
+            oldest_first=request.args.get("order", "newest").lower() == "oldest",
+            **archive_query_args()
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(result)
+
+@app.route('/api/archive/stories')
+@limiter.limit(os.getenv("ARCHIVE_RATE_LIMIT", "120 per minute"))
+def api_archive_stories():
+    """Query archived stories by ?username=, ?since=/?until= (first seen) and ?type=image|video"""
+    if post_archive is None:
+        return jsonify({"error": "Archive is disabled"}), 404
+    try:
+        result = post_archive.query_stories(**archive_query_args())
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(result)
+
+def is_allowed_media_url(url):
+    """Only proxy http(s) URLs on the Instagram/TikTok CDNs"""
+    parsed = urlparse(url)
+    host = (parsed.hostname or "").lower()
+    return parsed.scheme in ("http", "https") and any(
+        host == allowed or host.endswith("." + allowed) for allowed in MEDIA_ALLOWED_HOSTS
+    )
+
+def open_media_upstream(url, range_header=None):
+    headers = {
+        "User-Agent": os.getenv("INSTAGRAM_USER_AGENT", "Mozilla/5.0 (iPhone; CPU iPhone OS 16_6 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/16.6 Mobile/15E148 Safari/604.1"),
+        "Referer": "https://www.instagram.com/"
+    }
+    if range_header:
+        headers["Range"] = range_header
+    # Redirects are followed by hand so that every hop stays on the CDN hosts
+    for _ in range(MEDIA_MAX_REDIRECTS + 1):
+        response = session_pool.get("media").get(url, headers=headers, stream=True, timeout=15, allow_redirects=False)
+        if not response.is_redirect:
+            response.raise_for_status()
+            return response
+        url = urljoin(url, response.headers["Location"])
+        response.close()
+        if not is_allowed_media_url(url):
+            raise requests.exceptions.InvalidURL(f"Media redirected off the CDN hosts: {urlparse(url).hostname}")
+    raise requests.exceptions.TooManyRedirects(f"More than {MEDIA_MAX_REDIRECTS} media redirects")
+
+def guess_media_type(url, media_type):
+    guessed = mimetypes.guess_type(urlparse(url).path)[0]
+    if guessed:
+        return guessed
+    return "video/mp4" if media_type == "video" else "image/jpeg"
+
+def fetch_media_into_cache(url, media_type=None):
+    """Download url into the media cache and return its cache metadata"""
+    upstream = open_media_upstream(url)
+    content_type = upstream.headers.get("Content-Type") or guess_media_type(url, media_type)
+    temp_path = media_cache.temp_path(url)
+    try:
+        with open(temp_path, "wb") as f:
+            for chunk in upstream.iter_content(chunk_size=MEDIA_CHUNK_SIZE):
+                f.write(chunk)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    finally:
+        upstream.close()
+    media_cache.commit(url, temp_path, content_type)
+    return media_cache.get(url)
+
+@app.route('/media')
+@limiter.limit(MEDIA_RATE_LIMIT)
+def media_proxy():
+    """Stream CDN media through a local cache, with range and conditional GET support"""
+    url = request.args.get("url", "")
+    if not is_allowed_media_url(url):
+        return jsonify({"error": "Invalid media URL"}), 400
+    
+    cached = media_cache.get(url)
+    if cached:
+        return send_file(cached["path"], mimetype=cached["content_type"], conditional=True, max_age=86400)
+    
+    # A real range on an uncached file is passed upstream; "bytes=0-" is just a full read
+    range_header = request.headers.get("Range")
+    if range_header and range_header.replace(" ", "") == "bytes=0-":
+        range_header = None
+    
+    try:
+        upstream = open_media_upstream(url, range_header)
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Media proxy fetch failed: {str(e)}")
+        return jsonify({"error": "Failed to fetch media"}), 502
+    
+    content_type = upstream.headers.get("Content-Type") or guess_media_type(url, request.args.get("type"))
+    headers = {"Cache-Control": "public, max-age=86400", "Accept-Ranges": "bytes"}
+    for name in ("Content-Length", "Content-Range"):
+        if upstream.headers.get(name) and not upstream.headers.get("Content-Encoding"):
+            headers[name] = upstream.headers[name]
+    
+    def stream_and_cache():
+        # Partial responses are not cached; full ones are teed into the cache as they stream
+        temp_path = None if range_header else media_cache.temp_path(url)
+        complete = False
+        try:
+            with open(temp_path or os.devnull, "wb") as f:
+                for chunk in upstream.iter_content(chunk_size=MEDIA_CHUNK_SIZE):
+                    f.write(chunk)
+                    yield chunk
+            complete = True
+        finally:
+            upstream.close()
+            if temp_path:
+                if complete:
+                    media_cache.commit(url, temp_path, content_type)
+                elif os.path.exists(temp_path):
+                    os.remove(temp_path)
+    
+    return Response(stream_and_cache(), status=upstream.status_code, mimetype=content_type, headers=headers)
+
+@app.route('/media_base64')
+@limiter.limit(MEDIA_RATE_LIMIT)
+def media_base64():
+    """Inline small images as data URIs; anything larger is served through /media"""
+    url = request.args.get("url", "")
+    media_type = request.args.get("type", "image")
+    if not is_allowed_media_url(url):
+        return jsonify({"error": "Invalid media URL"}), 400
+    
+    proxy_url = f"/media?url={quote(url, safe='')}&type={quote(media_type)}"
+    if media_type == "video":
+        return jsonify({"data": proxy_url, "inline": False})
+    
+    try:
+        cached = media_cache.get(url) or fetch_media_into_cache(url, media_type)
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Media fetch failed: {str(e)}")
+        return jsonify({"error": "Failed to fetch media"}), 502
+    
+    if not cached or cached["size"] > MEDIA_INLINE_MAX_BYTES:
+        return jsonify({"data": proxy_url, "inline": False})
+    
+    with open(cached["path"], "rb") as f:
+        encoded = base64.b64encode(f.read()).decode()
+    return jsonify({"data": f"data:{cached['content_type']};base64,{encoded}", "inline": True})
+
 @app.route("/cookies", methods=["GET", "POST"])
 def cookie_management():
     if request.method == "POST":
@@ -618,7 +2543,8 @@ def cookie_management():
             "name": name,
             "cookie": cookie[:50] + "..." if len(cookie) > 50 else cookie,
             "is_active": is_active,
-            "full_cookie": cookie
+            "full_cookie": cookie,
+            "health": cookie_manager.health_stats(cookie)
         })
     
     return render_template(
@@ -633,21 +2559,117 @@ def get_tiktok_video_id(url):
     Extract video ID from TikTok URL, handling both regular and shortened URLs.
     """
     try:
-        # Handle shortened URLs (vt.tiktok.com)
-        if 'vt.tiktok.com' in url:
-            # Follow the redirect to get the full URL
-            response = requests.head(url, allow_redirects=True)
-            url = response.url
-            
-        # Extract video ID from the URL
-        if '/video/' in url:
-            video_id = url.split('/video/')[1].split('?')[0]
-            return video_id
-        else:
-            raise ValueError("Invalid TikTok URL format")
+        return tiktok_links.resolve(url)
     except Exception as e:
         raise ValueError(f"Could not extract video ID: {str(e)}")
 
+# TikTok item detail endpoint to resolve download addresses from instead of TikTokApi
+# (pointed at the local stub when benchmarking; unset in production)
+TIKTOK_ITEM_API = os.getenv("TIKTOK_ITEM_API")
+
+def get_tiktok_download_url(video_id):
+    """Resolve a video's download address with a pooled TikTokApi client"""
+    if TIKTOK_ITEM_API:
+        response = session_pool.get("tiktok").get(TIKTOK_ITEM_API, params={"itemId": video_id}, timeout=15)
+        response.raise_for_status()
+        return response.json()["itemInfo"]["itemStruct"]["video"]["downloadAddr"]
+    with tiktok_clients.client() as client:
+        video_data = client.video_info(video_id)
+    return video_data['video']['downloadAddr']
+
+# Tees an upstream TikTok video into the download store as its chunks are read
+class VideoDownload:
+    def __init__(self, video_id, on_close=None, download_url=None, progress=None):
+        self.video_id = video_id
+        self.on_close = on_close  # called once with this download when it finishes or fails
+        self.progress = progress  # called with the size of each chunk written
+        self.stored = None
+        
+        download_url = download_url or get_tiktok_download_url(video_id)
+        self.started = time.monotonic()
+        self.response = session_pool.get("tiktok").get(download_url, stream=True, timeout=30)
+        try:
+            self.response.raise_for_status()
+        except Exception:
+            self.response.close()
+            raise
+        self.content_type = self.response.headers.get("Content-Type", "video/mp4")
+        length = self.response.headers.get("Content-Length")
+        self.content_length = int(length) if length and not self.response.headers.get("Content-Encoding") else None
+        self.temp_path = video_store.temp_path(video_id)
+        self.file = open(self.temp_path, 'wb')
+        self.digest = hashlib.sha256()
+
+    def __iter__(self):
+        for chunk in self.response.iter_content(chunk_size=TIKTOK_CHUNK_SIZE):
+            self.digest.update(chunk)
+            self.file.write(chunk)
+            tiktok_download_bytes.inc(len(chunk))
+            if self.progress:
+                self.progress(len(chunk))
+            yield chunk
+        self.file.close()
+        size = os.path.getsize(self.temp_path)
+        if self.content_length is not None and size != self.content_length:
+            raise ValueError(f"Truncated download ({size} of {self.content_length} bytes)")
+        if size == 0:
+            raise ValueError("Empty download")
+        self.stored = video_store.commit(self.video_id, self.temp_path, self.digest.hexdigest(), self.content_type)
+        tiktok_download_rate.observe(size / max(time.monotonic() - self.started, 1e-6))
+        # Let waiting requests serve the stored file without waiting for our close()
+        self.notify()
+
+    def notify(self):
+        if self.on_close:
+            self.on_close(self)
+            self.on_close = None
+
+    def close(self):
+        # Runs when the download completes, fails, or the client goes away mid-stream
+        self.response.close()
+        self.file.close()
+        if self.stored is None and os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+        self.notify()
+
+def download_tiktok_video(video_id, download_url=None, progress=None):
+    """Download a video into the store; runs once per id no matter how many requests wait on it"""
+    stored = video_store.get(video_id)
+    if stored:
+        return stored
+    download = VideoDownload(video_id, download_url=download_url, progress=progress)
+    try:
+        for _ in download:
+            pass
+    finally:
+        download.close()
+    return download.stored
+
+def stream_tiktok_video(video_id):
+    """
+    Start streaming a video to the client while it downloads into the store.
+    
+    Returns either stored metadata (someone else finished it) or a VideoDownload to
+    send as the response body. Requests arriving mid-download wait for the store.
+    """
+    call, is_leader = tiktok_flights.begin(video_id)
+    if not is_leader:
+        return tiktok_flights.wait(call)
+    
+    def publish(download):
+        error = None if download.stored else RuntimeError("Streaming download did not complete")
+        tiktok_flights.finish(video_id, call, download.stored, error)
+    
+    try:
+        stored = video_store.get(video_id)
+        if stored:
+            tiktok_flights.finish(video_id, call, stored)
+            return stored
+        return VideoDownload(video_id, on_close=publish)
+    except Exception as e:
+        tiktok_flights.finish(video_id, call, error=e)
+        raise
+
 @app.route('/api/tkdl/<path:video_url>')
 @limit_exempt_uptime()
 def download_tiktok(video_url):
@@ -656,40 +2678,38 @@ def download_tiktok(video_url):
     
     Args:
         video_url (str): URL of the TikTok video to download.
+    
+    Query Parameters:
+        stream (bool): Pass the video through while it downloads (default true);
+            false waits for the full download before responding.
     """
     try:
-        # Create output directory if it doesn't exist
-        output_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'downloads')
-        os.makedirs(output_dir, exist_ok=True)
-        
-        # Initialize TikTok API
-        api = TikTokApi()
-        
         # Get video ID from URL
         video_id = get_tiktok_video_id(video_url)
+        download_name = f"tiktok_{video_id}.mp4"
         
-        # Get video data
-        video_data = api.video(id=video_id).info()
-        
-        # Download video
-        video_url = video_data['video']['downloadAddr']
-        response = requests.get(video_url, stream=True)
-        
-        # Save video
-        video_name = f"tiktok_{video_id}.mp4"
-        video_path = os.path.join(output_dir, video_name)
+        # Serve from the store, or join the download already running for this id
+        stored = video_store.get(video_id)
+        if not stored:
+            if request.args.get("stream", "true").lower() in ("0", "false", "no"):
+                stored = tiktok_flights.do(video_id, download_tiktok_video, video_id)
+            else:
+                stored = stream_tiktok_video(video_id)
         
-        with open(video_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                if chunk:
-                    f.write(chunk)
+        if isinstance(stored, VideoDownload):
+            # Range requests are answered once the video is in the store
+            headers = {"Content-Disposition": f'attachment; filename="{download_name}"'}
+            if stored.content_length is not None:
+                headers["Content-Length"] = str(stored.content_length)
+            return Response(stored, mimetype=stored.content_type, headers=headers)
         
         # Return the video file
         return send_file(
-            video_path,
+            stored["path"],
             as_attachment=True,
-            download_name=video_name,
-            mimetype='video/mp4'
+            download_name=download_name,
+            mimetype=stored["content_type"],
+            conditional=True
         )
         
     except Exception as e:
@@ -699,15 +2719,100 @@ def download_tiktok(video_url):
             "status": "failed"
         }), 500
 
+# Bulk downloads: jobs run on their own worker pool, are journaled to disk and
+# published to the shared state so any worker can report on them
+tiktok_jobs = DownloadJobs(
+    os.getenv("TIKTOK_JOBS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "downloads", "jobs")),
+    shared_state,
+    tiktok_links.resolve_many,
+    get_tiktok_download_url,
+    lambda video_id, download_url, progress: tiktok_flights.do(
+        video_id, download_tiktok_video, video_id, download_url, progress
+    ),
+    workers=int(os.getenv("TIKTOK_JOB_WORKERS", "4")),
+    per_host=int(os.getenv("TIKTOK_JOB_PER_HOST", "2")),
+    retries=int(os.getenv("TIKTOK_JOB_RETRIES", "2")),
+    backoff=float(os.getenv("TIKTOK_JOB_BACKOFF", "2")),
+    lease_ttl=float(os.getenv("TIKTOK_JOB_LEASE_TTL", "300"))
+)
+TIKTOK_JOB_MAX_URLS = int(os.getenv("TIKTOK_JOB_MAX_URLS", "200"))
+
+@app.route('/api/tiktok/jobs', methods=['POST'])
+@limiter.limit(os.getenv("TIKTOK_JOB_RATE_LIMIT", "20 per hour"))
+def create_tiktok_job():
+    """Queue a bulk download of a list of TikTok URLs; poll the returned status URL for progress"""
+    body = request.get_json(silent=True) or {}
+    urls = body.get("urls")
+    if not isinstance(urls, list):
+        return jsonify({"error": "Expected a JSON body with a 'urls' list"}), 400
+    urls = list(dict.fromkeys(url.strip() for url in urls if isinstance(url, str) and url.strip()))
+    if not urls:
+        return jsonify({"error": "No URLs provided"}), 400
+    if len(urls) > TIKTOK_JOB_MAX_URLS:
+        return jsonify({"error": f"At most {TIKTOK_JOB_MAX_URLS} URLs per job"}), 400
+    
+    status = tiktok_jobs.submit(urls)
+    status["status_url"] = f"/api/tiktok/jobs/{status['job_id']}"
+    status["zip_url"] = f"/api/tiktok/jobs/{status['job_id']}/zip"
+    return jsonify(status), 202
+
+@app.route('/api/tiktok/jobs/<job_id>')
+@limiter.exempt
+def tiktok_job_status(job_id):
+    """Progress, throughput and per-item results of a bulk download job"""
+    status = tiktok_jobs.status(job_id)
+    if status is None:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify(status)
+
+@app.route('/api/tiktok/jobs/<job_id>/zip')
+@limiter.exempt
+def tiktok_job_zip(job_id):
+    """Stream the job's finished videos as a zip; items still running are left out"""
+    items = tiktok_jobs.finished_items(job_id)
+    if items is None:
+        return jsonify({"error": "Unknown job"}), 404
+    
+    files = []
+    for video_id in dict.fromkeys(item["video_id"] for item in items):
+        stored = video_store.get(video_id)
+        if stored:
+            files.append((f"tiktok_{video_id}.mp4", stored["path"]))
+    if not files:
+        return jsonify({"error": "No finished videos in this job yet"}), 404
+    
+    return Response(
+        stream_zip(files, chunk_size=TIKTOK_CHUNK_SIZE),
+        mimetype="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="tiktok_job_{job_id}.zip"'}
+    )
+
+@app.route('/metrics')
+@limiter.exempt
+def metrics_endpoint():
+    """Latency histograms and counters in the Prometheus text format"""
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
 @app.route('/uptime')
 def uptime_check():
     """Special endpoint for uptime checks that doesn't count against rate limits"""
-    uptime_cache['last_check'] = datetime.now().isoformat()
-    uptime_cache['requests_served'] = uptime_cache.get('requests_served', 0) + 1
+    record_uptime_check()
     return jsonify({
         "status": "online",
         "last_check": uptime_cache['last_check'],
         "requests_served": uptime_cache['requests_served'],
+        "http_pool": session_pool.stats(),
+        "pacing": get_pacing_stats(),
+        "response_cache": response_cache.stats(),
+        "single_flight": instagram_flights.stats(),
+        "media_cache": media_cache.stats(),
+        "tiktok_store": video_store.stats(),
+        "tiktok_downloads": tiktok_flights.stats(),
+        "tiktok_clients": tiktok_clients.stats(),
+        "tiktok_links": tiktok_links.stats(),
+        "tiktok_jobs": tiktok_jobs.stats(),
+        "watchlist": watch_scheduler.stats(),
+        "archive": post_archive.stats() if post_archive else None,
         "server_time": datetime.now().isoformat()
     }), 200
 
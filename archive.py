@@ -0,0 +1,352 @@
+import os
+import time
+import sqlite3
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+# Local archive of every profile, post and story the app fetches, so historical
+# questions are answered from SQLite instead of by scraping Instagram again.
+# Writes go through one background thread and never hold up a lookup; queries
+# filter by user, time range, media type and caption text (FTS5 when the sqlite
+# build has it, LIKE otherwise) and page with a keyset cursor.
+
+logger = logging.getLogger(__name__)
+
+MEDIA_TYPES = {"image": 1, "video": 2, "carousel": 8}
+MEDIA_TYPE_NAMES = {value: name for name, value in MEDIA_TYPES.items()}
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS users ("
+    "user_id TEXT PRIMARY KEY, username TEXT NOT NULL, full_name TEXT, followers INTEGER, "
+    "following INTEGER, posts_count INTEGER, is_private INTEGER, first_seen REAL, last_seen REAL)",
+    "CREATE INDEX IF NOT EXISTS users_username ON users (username COLLATE NOCASE)",
+    "CREATE TABLE IF NOT EXISTS posts ("
+    "id TEXT PRIMARY KEY, user_id TEXT NOT NULL, timestamp INTEGER NOT NULL, caption TEXT, "
+    "like_count INTEGER, comment_count INTEGER, media_type INTEGER, first_seen REAL, last_seen REAL)",
+    "CREATE INDEX IF NOT EXISTS posts_user_time ON posts (user_id, timestamp, id)",
+    "CREATE INDEX IF NOT EXISTS posts_time ON posts (timestamp, id)",
+    "CREATE TABLE IF NOT EXISTS media ("
+    "post_id TEXT NOT NULL, position INTEGER NOT NULL, type TEXT, url TEXT, width INTEGER, height INTEGER, "
+    "cover_url TEXT, PRIMARY KEY (post_id, position))",
+    "CREATE TABLE IF NOT EXISTS stories ("
+    "id TEXT PRIMARY KEY, user_id TEXT NOT NULL, type TEXT, url TEXT, width INTEGER, height INTEGER, "
+    "cover_url TEXT, first_seen REAL, last_seen REAL)",
+    "CREATE INDEX IF NOT EXISTS stories_user_time ON stories (user_id, first_seen, id)",
+)
+
+# External-content index over posts.caption, kept in step by triggers
+FTS_SCHEMA = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS posts_fts USING fts5(caption, content='posts', content_rowid='rowid')",
+    "CREATE TRIGGER IF NOT EXISTS posts_fts_insert AFTER INSERT ON posts BEGIN "
+    "INSERT INTO posts_fts (rowid, caption) VALUES (new.rowid, new.caption); END",
+    "CREATE TRIGGER IF NOT EXISTS posts_fts_delete AFTER DELETE ON posts BEGIN "
+    "INSERT INTO posts_fts (posts_fts, rowid, caption) VALUES ('delete', old.rowid, old.caption); END",
+    "CREATE TRIGGER IF NOT EXISTS posts_fts_update AFTER UPDATE OF caption ON posts "
+    "WHEN old.caption IS NOT new.caption BEGIN "
+    "INSERT INTO posts_fts (posts_fts, rowid, caption) VALUES ('delete', old.rowid, old.caption); "
+    "INSERT INTO posts_fts (rowid, caption) VALUES (new.rowid, new.caption); END",
+)
+
+def encode_cursor(sort_key, item_id):
+    return f"{sort_key}:{item_id}"
+
+def decode_cursor(cursor):
+    """Split a cursor from a previous page; raises ValueError"""
+    sort_key, sep, item_id = (cursor or "").partition(":")
+    if not sep or not item_id:
+        raise ValueError("Invalid cursor")
+    return float(sort_key), item_id
+
+def match_expression(text):
+    """
+    Turn free text into an FTS5 query: every word must match, "word*" is a prefix
+    search, and FTS syntax in the input is taken literally.
+    """
+    terms = []
+    for word in text.split():
+        prefix = word.endswith("*")
+        word = word.rstrip("*").replace('"', '""')
+        if word:
+            terms.append(f'"{word}"*' if prefix else f'"{word}"')
+    return " ".join(terms)
+
+class PostArchive:
+    def __init__(self, path, max_page=200):
+        self.path = path
+        self.max_page = max_page
+        self.local = threading.local()
+        self.written = {"profiles": 0, "posts": 0, "stories": 0, "failed": 0}
+        self.pending = 0
+        self.lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        conn = self.connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        for statement in SCHEMA:
+            conn.execute(statement)
+        try:
+            for statement in FTS_SCHEMA:
+                conn.execute(statement)
+            self.fts = True
+        except sqlite3.OperationalError as e:
+            logger.warning(f"SQLite has no FTS5 ({e}); caption search falls back to LIKE")
+            self.fts = False
+        # One writer: SQLite serializes writes anyway, and lookups only ever enqueue
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="archive-writer")
+        logger.info(f"PostArchive initialized at {path} (full-text search: {self.fts})")
+
+    def connection(self):
+        # sqlite3 connections are per thread; each worker process opens its own
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            self.local.conn = conn
+        return conn
+
+    def submit(self, kind, write, *args):
+        with self.lock:
+            self.pending += 1
+        self.writer.submit(self.run_write, kind, write, *args)
+
+    def run_write(self, kind, write, *args):
+        conn = self.connection()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                count = write(conn, time.time(), *args)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            with self.lock:
+                self.written[kind] += count
+        except Exception as e:
+            logger.error(f"Archive write of {kind} failed: {e}")
+            with self.lock:
+                self.written["failed"] += 1
+        finally:
+            with self.lock:
+                self.pending -= 1
+
+    def save_profile(self, profile_entry):
+        """Queue an upsert of a profile entry (as built by build_profile_entry)"""
+        if profile_entry.get("user_id"):
+            self.submit("profiles", self.write_profile, profile_entry)
+
+    def save_posts(self, user_id, posts):
+        """Queue an upsert of PostRecords and their media"""
+        if posts:
+            self.submit("posts", self.write_posts, user_id, list(posts))
+
+    def save_stories(self, user_id, stories):
+        """Queue an upsert of story MediaRecords; stories without an id are skipped"""
+        stories = [story for story in stories if story.id]
+        if stories:
+            self.submit("stories", self.write_stories, user_id, stories)
+
+    def write_profile(self, conn, now, profile_entry):
+        profile = profile_entry["profile"]
+        conn.execute(
+            "INSERT INTO users (user_id, username, full_name, followers, following, posts_count, is_private, "
+            "first_seen, last_seen) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (user_id) DO UPDATE SET username = excluded.username, full_name = excluded.full_name, "
+            "followers = excluded.followers, following = excluded.following, posts_count = excluded.posts_count, "
+            "is_private = excluded.is_private, last_seen = excluded.last_seen",
+            (
+                profile_entry["user_id"], profile["username"], profile["full_name"], profile["followers"],
+                profile["following"], profile["posts_count"], int(bool(profile["is_private"])), now, now
+            )
+        )
+        return 1
+
+    def write_posts(self, conn, now, user_id, posts):
+        conn.executemany(
+            "INSERT INTO posts (id, user_id, timestamp, caption, like_count, comment_count, media_type, "
+            "first_seen, last_seen) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (id) DO UPDATE SET caption = excluded.caption, like_count = excluded.like_count, "
+            "comment_count = excluded.comment_count, last_seen = excluded.last_seen",
+            [
+                (post.id, user_id, post.timestamp, post.caption, post.like_count, post.comment_count,
+                 post.media_type, now, now)
+                for post in posts
+            ]
+        )
+        conn.executemany("DELETE FROM media WHERE post_id = ?", [(post.id,) for post in posts])
+        conn.executemany(
+            "INSERT INTO media (post_id, position, type, url, width, height, cover_url) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [
+                (post.id, position, *self.media_row(media))
+                for post in posts for position, media in enumerate(post.media)
+            ]
+        )
+        return len(posts)
+
+    def write_stories(self, conn, now, user_id, stories):
+        conn.executemany(
+            "INSERT INTO stories (id, user_id, type, url, width, height, cover_url, first_seen, last_seen) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (id) DO UPDATE SET url = excluded.url, cover_url = excluded.cover_url, "
+            "last_seen = excluded.last_seen",
+            [(story.id, user_id, *self.media_row(story), now, now) for story in stories]
+        )
+        return len(stories)
+
+    @staticmethod
+    def media_row(media):
+        """(type, url, width, height, cover_url) of a MediaRecord's largest rendition"""
+        url, width, height = media.renditions[0]
+        cover_url = media.cover_renditions[0][0] if media.cover_renditions else None
+        return (media.type, url, width, height, cover_url)
+
+    def user_filter(self, username, user_id, clauses, params, column):
+        if user_id:
+            clauses.append(f"{column} = ?")
+            params.append(user_id)
+        elif username:
+            clauses.append(f"{column} IN (SELECT user_id FROM users WHERE username = ? COLLATE NOCASE)")
+            params.append(username)
+
+    def page(self, limit):
+        return max(1, min(int(limit or 50), self.max_page))
+
+    def query_posts(self, username=None, user_id=None, since=None, until=None, media_type=None,
+                    text=None, cursor=None, limit=50, oldest_first=False):
+        """
+        Archived posts, newest first unless oldest_first; since/until bound the post
+        timestamp (epoch seconds, until exclusive). Returns {"items", "next_cursor"};
+        raises ValueError for a bad media type, search text or cursor.
+        """
+        limit = self.page(limit)
+        clauses, params = [], []
+        self.user_filter(username, user_id, clauses, params, "p.user_id")
+        if since is not None:
+            clauses.append("p.timestamp >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("p.timestamp < ?")
+            params.append(until)
+        if media_type:
+            if media_type not in MEDIA_TYPES:
+                raise ValueError(f"Invalid media type: {media_type!r} (expected image, video or carousel)")
+            clauses.append("p.media_type = ?")
+            params.append(MEDIA_TYPES[media_type])
+        join = ""
+        if text and text.strip():
+            if self.fts:
+                expression = match_expression(text)
+                if not expression:
+                    raise ValueError("Invalid search text")
+                join = "JOIN posts_fts ON posts_fts.rowid = p.rowid"
+                clauses.append("posts_fts MATCH ?")
+                params.append(expression)
+            else:
+                for word in text.split():
+                    clauses.append("p.caption LIKE ?")
+                    params.append(f"%{word.rstrip('*')}%")
+        direction = "ASC" if oldest_first else "DESC"
+        if cursor:
+            timestamp, post_id = decode_cursor(cursor)
+            clauses.append(f"(p.timestamp, p.id) {'>' if oldest_first else '<'} (?, ?)")
+            params.extend((int(timestamp), post_id))
+
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self.connection().execute(
+            f"SELECT p.*, u.username FROM posts p {join} LEFT JOIN users u ON u.user_id = p.user_id "
+            f"{where} ORDER BY p.timestamp {direction}, p.id {direction} LIMIT ?",
+            params + [limit + 1]
+        ).fetchall()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        media = self.media_for([row["id"] for row in rows])
+        items = [self.post_item(row, media.get(row["id"], [])) for row in rows]
+        last = rows[-1] if rows else None
+        return {
+            "items": items,
+            "next_cursor": encode_cursor(last["timestamp"], last["id"]) if has_more else None
+        }
+
+    def media_for(self, post_ids):
+        media = {}
+        if not post_ids:
+            return media
+        rows = self.connection().execute(
+            f"SELECT * FROM media WHERE post_id IN ({','.join('?' * len(post_ids))}) ORDER BY post_id, position",
+            post_ids
+        ).fetchall()
+        for row in rows:
+            item = {"type": row["type"], "url": row["url"], "width": row["width"], "height": row["height"]}
+            if row["cover_url"]:
+                item["cover_url"] = row["cover_url"]
+            media.setdefault(row["post_id"], []).append(item)
+        return media
+
+    @staticmethod
+    def post_item(row, media):
+        return {
+            "id": row["id"],
+            "user_id": row["user_id"],
+            "username": row["username"],
+            "caption": row["caption"],
+            "timestamp": row["timestamp"],
+            "like_count": row["like_count"],
+            "comment_count": row["comment_count"],
+            "media_type": MEDIA_TYPE_NAMES.get(row["media_type"]),
+            "media": media,
+            "first_seen": row["first_seen"],
+            "last_seen": row["last_seen"]
+        }
+
+    def query_stories(self, username=None, user_id=None, since=None, until=None, media_type=None,
+                      cursor=None, limit=50):
+        """Archived stories, most recently first seen first; since/until bound first_seen"""
+        limit = self.page(limit)
+        clauses, params = [], []
+        self.user_filter(username, user_id, clauses, params, "s.user_id")
+        if since is not None:
+            clauses.append("s.first_seen >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("s.first_seen < ?")
+            params.append(until)
+        if media_type:
+            if media_type not in ("image", "video"):
+                raise ValueError(f"Invalid media type: {media_type!r} (expected image or video)")
+            clauses.append("s.type = ?")
+            params.append(media_type)
+        if cursor:
+            first_seen, story_id = decode_cursor(cursor)
+            clauses.append("(s.first_seen, s.id) < (?, ?)")
+            params.extend((first_seen, story_id))
+
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self.connection().execute(
+            f"SELECT s.*, u.username FROM stories s LEFT JOIN users u ON u.user_id = s.user_id "
+            f"{where} ORDER BY s.first_seen DESC, s.id DESC LIMIT ?",
+            params + [limit + 1]
+        ).fetchall()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        items = [
+            {key: row[key] for key in ("id", "user_id", "username", "type", "url", "width", "height",
+                                       "cover_url", "first_seen", "last_seen")}
+            for row in rows
+        ]
+        last = rows[-1] if rows else None
+        return {
+            "items": items,
+            "next_cursor": encode_cursor(repr(last["first_seen"]), last["id"]) if has_more else None
+        }
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.written, pending=self.pending)
+        stats["full_text_search"] = self.fts
+        try:
+            stats["bytes"] = sum(
+                os.path.getsize(self.path + suffix) for suffix in ("", "-wal") if os.path.exists(self.path + suffix)
+            )
+        except OSError:
+            stats["bytes"] = None
+        return stats
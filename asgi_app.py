@@ -0,0 +1,599 @@
+import os
+import time
+import hashlib
+import asyncio
+import logging
+from datetime import datetime
+from urllib.parse import parse_qs
+
+import httpx
+from limits import parse as parse_limit
+from limits.storage import storage_from_string
+from limits.strategies import FixedWindowRateLimiter
+
+import records
+from app import (
+    app as flask_app,
+    uptime_cache,
+    record_uptime_check,
+    SHARED_STATE_URL,
+    cookie_manager,
+    request_pacer,
+    response_cache,
+    post_archive,
+    session_pool,
+    video_store,
+    TIKTOK_CHUNK_SIZE,
+    get_pacing_stats,
+    get_instagram_headers,
+    handle_instagram_response,
+    instagram_error,
+    instagram_error_status,
+    retry_after_headers,
+    CookiesQuarantined,
+    TERMINAL_STATUSES,
+    classify_instagram_failure,
+    new_debug_info,
+    profile_url,
+    build_profile_entry,
+    stories_url,
+    process_stories,
+    posts_page_url,
+    process_posts_page,
+    project_payload,
+    conditional_payload,
+    etag_matches,
+    media_quality,
+    FeedSync,
+    get_tiktok_video_id,
+    get_tiktok_download_url,
+    tiktok_clients,
+    tiktok_links,
+    metrics,
+    upstream_latency,
+    pacing_sleep,
+    backoff_imposed,
+    serialize_latency,
+    tiktok_download_rate,
+    tiktok_download_bytes,
+    instagram_endpoint,
+    record_lookup_stages,
+    watch_scheduler,
+)
+
+# Async serving mode for the Instagram, TikTok, uptime and metrics endpoints.
+# Run with: uvicorn asgi_app:app --host 0.0.0.0 --port 5000
+# It shares the cookie scheduler, pacer and caches with the Flask app in app.py,
+# but upstream calls go through httpx so one process can hold hundreds of lookups.
+
+logger = logging.getLogger(__name__)
+
+# Keep-alive async HTTP clients, one per cookie (plus one for TikTok downloads)
+class AsyncClientPool:
+    def __init__(self, pool_size=10, retries=2):
+        self.pool_size = pool_size
+        self.retries = retries
+        self.clients = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        client = self.clients.get(key)
+        if client is not None:
+            self.hits += 1
+            return client
+        self.misses += 1
+        limits = httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size)
+        client = httpx.AsyncClient(
+            transport=httpx.AsyncHTTPTransport(limits=limits, retries=self.retries),
+            timeout=15,
+            follow_redirects=True
+        )
+        self.clients[key] = client
+        return client
+
+    async def close(self):
+        clients = list(self.clients.values())
+        self.clients.clear()
+        for client in clients:
+            await client.aclose()
+
+    def stats(self):
+        return {"clients": len(self.clients), "hits": self.hits, "misses": self.misses}
+
+class CancelledCall(RuntimeError):
+    """Raised to the waiters of a coalesced call whose leading task was cancelled"""
+
+# Coalesces identical concurrent calls onto one in-flight task
+class AsyncSingleFlight:
+    def __init__(self, timeout=60):
+        self.timeout = timeout
+        self.calls = {}
+        self.leaders = 0
+        self.coalesced = 0
+        self.timeouts = 0
+
+    async def do(self, key, func, *args):
+        future = self.calls.get(key)
+        if future is not None:
+            self.coalesced += 1
+            try:
+                return await asyncio.wait_for(asyncio.shield(future), self.timeout)
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                raise TimeoutError(f"Timed out after {self.timeout}s waiting for in-flight call")
+
+        future = asyncio.get_running_loop().create_future()
+        self.calls[key] = future
+        self.leaders += 1
+        try:
+            result = await func(*args)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            if not isinstance(e, Exception):
+                # The leader was cancelled (client gone, shutdown); fail the waiters
+                # now instead of leaving them to time out
+                e = CancelledCall(f"In-flight call for {key} was cancelled")
+            future.set_exception(e)
+            # Mark the exception retrieved so an unawaited future does not log a warning
+            future.exception()
+            raise
+        finally:
+            self.calls.pop(key, None)
+
+    def stats(self):
+        return {
+            "in_flight": len(self.calls),
+            "leaders": self.leaders,
+            "coalesced_waiters": self.coalesced,
+            "timeouts": self.timeouts
+        }
+
+client_pool = AsyncClientPool(
+    pool_size=int(os.getenv("HTTP_POOL_SIZE", "10")),
+    retries=int(os.getenv("HTTP_POOL_RETRIES", "2"))
+)
+instagram_flights = AsyncSingleFlight(timeout=float(os.getenv("INSTAGRAM_SINGLE_FLIGHT_TIMEOUT", "60")))
+tiktok_flights = AsyncSingleFlight(timeout=float(os.getenv("TIKTOK_DOWNLOAD_TIMEOUT", "300")))
+
+rate_limiter = FixedWindowRateLimiter(storage_from_string(SHARED_STATE_URL))
+lookup_limit = parse_limit("5 per minute")
+
+async def send_instagram_request(url):
+    """Make a request to Instagram with retry logic and rate limiting"""
+    max_retries = len(cookie_manager.cookies) if cookie_manager.cookies else 1
+    tried = set()
+
+    for attempt in range(max_retries):
+        # Each attempt goes to the healthiest cookie not tried yet. The scheduler reads and
+        # writes the shared state (sqlite/redis), so it runs off the loop.
+        try:
+            cookie_index, current_cookie = await asyncio.to_thread(
+                cookie_manager.acquire, tried, request_pacer.available_at
+            )
+        except CookiesQuarantined as e:
+            logger.warning(f"No cookie available: {str(e)}")
+            return str(e)
+        tried.add(current_cookie)
+        outcome = "error"
+        latency = None
+        try:
+            # Wait for this cookie's next send slot without holding a thread
+            waited = await request_pacer.wait_async(current_cookie)
+            pacing_sleep.observe(waited, cookie=cookie_index)
+
+            client = client_pool.get(current_cookie)
+            sent_at = time.time()
+            status = "error"
+            try:
+                response = await client.get(url, headers=get_instagram_headers(current_cookie))
+                status = response.status_code
+            finally:
+                upstream_latency.observe(
+                    time.time() - sent_at, endpoint=instagram_endpoint(url), cookie=cookie_index,
+                    status=status, attempt=attempt + 1
+                )
+            latency = time.time() - sent_at
+
+            success, result = handle_instagram_response(response)
+            if success:
+                outcome = "success"
+                return result
+
+            if response.status_code in TERMINAL_STATUSES:
+                # The request was rejected, not the cookie; no other cookie would do better
+                outcome = "success"
+                return result
+
+            # Back off the failing cookie; the next attempt uses another one
+            outcome = classify_instagram_failure(response, result)
+            delay = request_pacer.penalize(current_cookie, attempt)
+            backoff_imposed.inc(delay, cookie=cookie_index)
+            if attempt < max_retries - 1:
+                logger.warning(f"Request failed, cookie backed off {delay}s. Error: {result}")
+                continue
+
+            logger.error(f"All retry attempts failed. Last error: {result}")
+            return result
+
+        except httpx.HTTPError as e:
+            logger.error(f"Request failed: {str(e)}")
+            delay = request_pacer.penalize(current_cookie, attempt)
+            backoff_imposed.inc(delay, cookie=cookie_index)
+            if attempt < max_retries - 1:
+                logger.warning(f"Retrying, cookie backed off {delay}s")
+                continue
+            raise
+        finally:
+            await asyncio.to_thread(cookie_manager.release, current_cookie, outcome, latency)
+
+async def make_instagram_request(url):
+    """Make a request to Instagram, sharing one in-flight call between identical concurrent GETs"""
+    try:
+        return await instagram_flights.do(url, send_instagram_request, url)
+    except (TimeoutError, CancelledCall) as e:
+        logger.warning(f"Coalesced request to {url} failed: {str(e)}")
+        return str(e)
+
+async def timed_call(func, *args):
+    start = time.time()
+    result = await func(*args)
+    return result, round(time.time() - start, 2)
+
+async def fetch_user_profile(username, debug_info, refresh=False):
+    """Fetch a user's profile entry; returns (profile_entry, error, status_code)"""
+    profile_key = username.lower()
+    profile_entry = await asyncio.to_thread(response_cache.lookup, "profile", profile_key, debug_info, refresh)
+    if profile_entry is not None:
+        return profile_entry, None, 200
+
+    debug_info["stats"]["api_calls"] += 1
+    res, debug_info["stats"]["profile_time"] = await timed_call(make_instagram_request, profile_url(username))
+    if isinstance(res, str):
+        profile_entry = await asyncio.to_thread(response_cache.fallback, "profile", profile_key, debug_info)
+        if profile_entry is None:
+            return None, res, instagram_error_status(res)
+        return profile_entry, None, 200
+
+    user_data = (res.payload.get("data") or {}).get("user") or {}
+    if not user_data:
+        debug_info["errors"].append("User not found in Instagram response")
+        return None, "User not found", 404
+
+    profile_entry = build_profile_entry(user_data)
+    await asyncio.to_thread(response_cache.set, "profile", profile_key, profile_entry)
+    if post_archive:
+        await asyncio.to_thread(post_archive.save_profile, profile_entry)
+    return profile_entry, None, 200
+
+async def fetch_user_stories(user_id, debug_info):
+    """Fetch and process the current stories for a user"""
+    stories_res = await make_instagram_request(stories_url(user_id))
+    error = instagram_error(stories_res)
+    if error:
+        debug_info["errors"].append(f"Failed to fetch stories: {error}")
+        stale = await asyncio.to_thread(response_cache.fallback, "stories", user_id, debug_info)
+        if stale is not None:
+            return stale
+        return process_stories([], debug_info)
+
+    stories_data = process_stories(stories_res.payload.get("items", []), debug_info)
+    await asyncio.to_thread(response_cache.set, "stories", user_id, stories_data)
+    if post_archive:
+        await asyncio.to_thread(post_archive.save_stories, user_id, stories_data["items"])
+    return stories_data
+
+async def fetch_user_posts(user_id, debug_info, incremental=True):
+    """Fetch and process posts for a user, stopping at posts already synced earlier"""
+    # FeedSync loads and saves the feed state through the response cache
+    feed_sync = await asyncio.to_thread(FeedSync, user_id, incremental)
+    while feed_sync.wants_more():
+        try:
+            debug_info["stats"]["api_calls"] += 1
+            posts_res = await make_instagram_request(posts_page_url(user_id, feed_sync.max_id))
+            error = instagram_error(posts_res)
+            if error:
+                debug_info["errors"].append(f"Failed to fetch posts: {error}")
+                feed_sync.failed = True
+                break
+            page = process_posts_page(posts_res.payload, debug_info)
+            if post_archive:
+                await asyncio.to_thread(post_archive.save_posts, user_id, page["items"])
+            feed_sync.add_page(page)
+        except Exception as e:
+            debug_info["errors"].append(f"Failed to fetch posts page: {str(e)}")
+            feed_sync.failed = True
+            break
+    return await asyncio.to_thread(feed_sync.finish, debug_info)
+
+async def lookup_instagram_user(username, refresh=False, incremental=True):
+    """Run a full profile/stories/posts lookup; returns (payload, status_code)"""
+    debug_info = new_debug_info()
+    start_time = time.time()
+    try:
+        profile_entry, error, status = await fetch_user_profile(username, debug_info, refresh)
+        if error:
+            return {"error": error, "debug": debug_info}, status
+
+        profile_data = profile_entry["profile"]
+        if profile_entry["restricted"]:
+            debug_info["warnings"].append("Private account - limited data available")
+            return {
+                "profile": profile_data,
+                "stories": {"count": 0, "items": []},
+                "posts": {"count": 0, "items": []},
+                "debug": debug_info
+            }, 200
+
+        user_id = profile_entry["user_id"]
+        if not user_id:
+            debug_info["errors"].append("Could not fetch user ID from Instagram response")
+            return {"error": "Could not fetch user ID", "debug": debug_info}, 500
+
+        # Fetch stories and posts concurrently now that the user ID is known
+        stories_data = await asyncio.to_thread(response_cache.lookup, "stories", user_id, debug_info, refresh)
+        posts_data = await asyncio.to_thread(response_cache.lookup, "posts", user_id, debug_info, refresh)
+        tasks = {}
+        if stories_data is None:
+            debug_info["stats"]["api_calls"] += 1
+            tasks["stories"] = timed_call(fetch_user_stories, user_id, debug_info)
+        if posts_data is None:
+            tasks["posts"] = timed_call(fetch_user_posts, user_id, debug_info, incremental)
+        results = dict(zip(tasks, await asyncio.gather(*tasks.values())))
+        if "stories" in results:
+            stories_data, debug_info["stats"]["stories_time"] = results["stories"]
+        if "posts" in results:
+            posts_data, debug_info["stats"]["posts_time"] = results["posts"]
+
+        debug_info["stats"]["processing_time"] = round(time.time() - start_time, 2)
+        record_lookup_stages(debug_info["stats"])
+        return {
+            "profile": profile_data,
+            "stories": stories_data,
+            "posts": posts_data,
+            "debug": debug_info
+        }, 200
+    except Exception as e:
+        debug_info["errors"].append(f"Fatal error: {str(e)}")
+        debug_info["stats"]["processing_time"] = round(time.time() - start_time, 2)
+        return {"error": str(e), "debug": debug_info}, 500
+
+async def send_json(send, payload, status=200, headers=()):
+    with serialize_latency.time():
+        body = records.dumps(payload).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()), *headers
+        ]
+    })
+    await send({"type": "http.response.body", "body": body})
+
+async def api_instagram(scope, send, username):
+    username = username.strip()
+    if not username or "/" in username:
+        return await send_json(send, {"error": "Missing username"}, 400)
+
+    if flask_app.config["RATELIMIT_ENABLED"]:
+        client_ip = (scope.get("client") or ("unknown",))[0]
+        if not await asyncio.to_thread(rate_limiter.hit, lookup_limit, "api_instagram", client_ip):
+            return await send_json(send, {"error": "Rate limit exceeded: 5 per 1 minute"}, 429)
+
+    query = parse_qs(scope.get("query_string", b"").decode())
+    refresh = query.get("refresh", [""])[0].lower() in ("1", "true", "yes")
+    incremental = query.get("sync", ["incremental"])[0].lower() != "full"
+    fields = records.parse_fields(query.get("fields", [""])[0])
+    try:
+        quality = media_quality(query.get("quality", [""])[0])
+    except ValueError as e:
+        return await send_json(send, {"error": str(e)}, 400)
+    payload, status = await lookup_instagram_user(username, refresh, incremental)
+    if status != 200:
+        headers = await asyncio.to_thread(retry_after_headers, status)
+        return await send_json(
+            send, project_payload(payload, fields, quality), status,
+            [(name.lower().encode(), value.encode()) for name, value in headers.items()]
+        )
+
+    # Saves the lookup's snapshot to the shared state
+    payload, etag = await asyncio.to_thread(
+        conditional_payload, payload, fields, quality, query.get("since", [""])[0], query.get("since_id", [""])[0]
+    )
+    etag_header = (b"etag", f'W/"{etag}"'.encode())
+    if_none_match = dict(scope.get("headers") or []).get(b"if-none-match", b"").decode()
+    if etag_matches(if_none_match, etag):
+        await send({"type": "http.response.start", "status": 304, "headers": [etag_header]})
+        return await send({"type": "http.response.body", "body": b""})
+    await send_json(send, payload, headers=[etag_header])
+
+async def download_tiktok_video(video_id, send=None):
+    """
+    Download a video into the shared store; runs once per id across concurrent requests.
+
+    With send, the leading request also streams each chunk to its client as it arrives.
+    """
+    stored = await asyncio.to_thread(video_store.get, video_id)
+    if stored:
+        return stored
+
+    # The pooled TikTok client is blocking; keep it off the loop
+    download_addr = await asyncio.to_thread(get_tiktok_download_url, video_id)
+
+    temp_path = video_store.temp_path(video_id)
+    digest = hashlib.sha256()
+    stored = None
+    started = time.monotonic()
+    try:
+        async with client_pool.get("tiktok").stream("GET", download_addr) as response:
+            response.raise_for_status()
+            content_type = response.headers.get("content-type", "video/mp4")
+            expected = response.headers.get("content-length")
+            if send:
+                headers = [
+                    (b"content-type", content_type.encode()),
+                    (b"content-disposition", f'attachment; filename="tiktok_{video_id}.mp4"'.encode())
+                ]
+                if expected and not response.headers.get("content-encoding"):
+                    headers.append((b"content-length", expected.encode()))
+                await send({"type": "http.response.start", "status": 200, "headers": headers})
+            with open(temp_path, 'wb') as f:
+                async for chunk in response.aiter_bytes(TIKTOK_CHUNK_SIZE):
+                    digest.update(chunk)
+                    f.write(chunk)
+                    tiktok_download_bytes.inc(len(chunk))
+                    if send:
+                        await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            if expected and int(expected) != response.num_bytes_downloaded:
+                raise ValueError(f"Truncated download ({response.num_bytes_downloaded} of {expected} bytes)")
+        size = os.path.getsize(temp_path)
+        if size == 0:
+            raise ValueError("Empty download")
+        stored = await asyncio.to_thread(video_store.commit, video_id, temp_path, digest.hexdigest(), content_type)
+        tiktok_download_rate.observe(size / max(time.monotonic() - started, 1e-6))
+    finally:
+        if stored is None and os.path.exists(temp_path):
+            os.remove(temp_path)
+    if send:
+        await send({"type": "http.response.body", "body": b""})
+    return stored
+
+def parse_range(header, size):
+    """Parse a single "bytes=start-end" range; returns (start, end) inclusive, or None"""
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, _, last = header[len("bytes="):].strip().partition("-")
+    try:
+        if first:
+            start, end = int(first), int(last) if last else size - 1
+        else:
+            start, end = size - int(last), size - 1
+    except ValueError:
+        return None
+    if start < 0 or start > end or start >= size:
+        return None
+    return start, min(end, size - 1)
+
+async def download_tiktok(scope, send, video_url):
+    """Serve a TikTok video from the download store, streaming it through on a miss"""
+    started = []
+
+    async def send_tracked(message):
+        if message["type"] == "http.response.start":
+            started.append(True)
+        await send(message)
+
+    async def stream_to_client(video_id):
+        # Only the request that leads the download streams; the rest wait for the store
+        return await download_tiktok_video(video_id, send_tracked)
+
+    try:
+        # Short-link resolution is blocking; keep it off the loop
+        video_id = await asyncio.to_thread(get_tiktok_video_id, video_url)
+        stored = await asyncio.to_thread(video_store.get, video_id)
+        if not stored:
+            query = parse_qs(scope.get("query_string", b"").decode())
+            if query.get("stream", ["true"])[0].lower() in ("0", "false", "no"):
+                stored = await tiktok_flights.do(video_id, download_tiktok_video, video_id)
+            else:
+                stored = await tiktok_flights.do(video_id, stream_to_client, video_id)
+                if started:
+                    return
+    except Exception as e:
+        logger.error(f"Error downloading TikTok video: {str(e)}")
+        if started:
+            # Headers are already out; abort so the client sees a short read
+            raise
+        return await send_json(send, {"error": str(e), "status": "failed"}, 500)
+
+    # Range requests are answered once the video is in the store
+    request_headers = dict(scope.get("headers") or [])
+    byte_range = parse_range(request_headers.get(b"range", b"").decode(), stored["size"])
+    start, end = byte_range or (0, stored["size"] - 1)
+    video_name = f"tiktok_{video_id}.mp4"
+    headers = [
+        (b"content-type", stored["content_type"].encode()),
+        (b"content-length", str(end - start + 1).encode()),
+        (b"accept-ranges", b"bytes"),
+        (b"etag", f'"{stored["digest"]}"'.encode()),
+        (b"content-disposition", f'attachment; filename="{video_name}"'.encode())
+    ]
+    if byte_range:
+        headers.append((b"content-range", f"bytes {start}-{end}/{stored['size']}".encode()))
+    await send({"type": "http.response.start", "status": 206 if byte_range else 200, "headers": headers})
+    with open(stored["path"], 'rb') as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(TIKTOK_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+        if remaining > 0:
+            await send({"type": "http.response.body", "body": b""})
+
+async def metrics_endpoint(send):
+    """Latency histograms and counters in the Prometheus text format"""
+    body = metrics.render().encode()
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [(b"content-type", b"text/plain; version=0.0.4"), (b"content-length", str(len(body)).encode())]
+    })
+    await send({"type": "http.response.body", "body": body})
+
+def uptime_payload():
+    record_uptime_check()
+    return {
+        "status": "online",
+        "last_check": uptime_cache['last_check'],
+        "requests_served": uptime_cache['requests_served'],
+        "http_pool": session_pool.stats(),
+        "async_http_pool": client_pool.stats(),
+        "pacing": get_pacing_stats(),
+        "response_cache": response_cache.stats(),
+        "single_flight": instagram_flights.stats(),
+        "tiktok_store": video_store.stats(),
+        "tiktok_downloads": tiktok_flights.stats(),
+        "tiktok_clients": tiktok_clients.stats(),
+        "tiktok_links": tiktok_links.stats(),
+        "watchlist": watch_scheduler.stats(),
+        "archive": post_archive.stats() if post_archive else None,
+        "server_time": datetime.now().isoformat()
+    }
+
+async def uptime_check(send):
+    """Special endpoint for uptime checks that doesn't count against rate limits"""
+    # The uptime counters and the cookie/watch list stats live in the shared state
+    await send_json(send, await asyncio.to_thread(uptime_payload))
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await client_pool.close()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+    if scope["type"] != "http":
+        return
+
+    path = scope["path"]
+    if scope["method"] not in ("GET", "HEAD"):
+        return await send_json(send, {"error": "Method not allowed"}, 405)
+    if path == "/uptime":
+        return await uptime_check(send)
+    if path == "/metrics":
+        return await metrics_endpoint(send)
+    if path.startswith("/api/instagram/"):
+        return await api_instagram(scope, send, path[len("/api/instagram/"):])
+    if path.startswith("/api/tkdl/"):
+        return await download_tiktok(scope, send, path[len("/api/tkdl/"):])
+    await send_json(send, {"error": "Not found"}, 404)
@@ -0,0 +1,133 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("TIKTOK_CLIENT_POOL_WARM", "0")
+
+import records
+from app import create_post_info
+from stub_upstream import make_post
+
+# Micro-benchmark of post extraction and serialization: the dict-per-post path
+# the app used before PostRecord/MediaRecord against the record path, with the
+# stdlib json encoder and orjson, with and without a ?fields= projection.
+
+def legacy_media_item(media, media_type, is_carousel=False, carousel_index=None):
+    if media_type == 1:
+        candidates = (media.get("image_versions2", {}) or {}).get("candidates", []) or []
+        if candidates and candidates[0].get("url"):
+            media_data = {"type": "image", "url": candidates[0].get("url")}
+            if is_carousel:
+                media_data.update({"is_carousel_item": True, "carousel_index": carousel_index})
+            return media_data
+    elif media_type == 2:
+        video_versions = media.get("video_versions", []) or []
+        if video_versions and video_versions[0].get("url"):
+            candidates = (media.get("image_versions2", {}) or {}).get("candidates", []) or []
+            media_data = {
+                "type": "video",
+                "url": video_versions[0].get("url"),
+                "cover_url": candidates[0].get("url") if candidates else None
+            }
+            if is_carousel:
+                media_data.update({"is_carousel_item": True, "carousel_index": carousel_index})
+            return media_data
+    return None
+
+def legacy_post_info(post):
+    caption = post.get("caption", {}) or {}
+    post_info = {
+        "id": post.get("id", ""),
+        "caption": caption.get("text", "") if isinstance(caption, dict) else "",
+        "timestamp": post.get("taken_at", 0),
+        "like_count": post.get("like_count", 0),
+        "comment_count": post.get("comment_count", 0),
+        "is_video": post.get("media_type") == 2,
+        "is_carousel": post.get("media_type") == 8,
+        "media": []
+    }
+    media_type = post.get("media_type")
+    if media_type in (1, 2):
+        media_data = legacy_media_item(post, media_type)
+        if media_data:
+            post_info["media"].append(media_data)
+    elif media_type == 8:
+        for idx, media in enumerate(post.get("carousel_media", []) or []):
+            media_data = legacy_media_item(media, media.get("media_type"), True, idx)
+            if media_data:
+                post_info["media"].append(media_data)
+    return post_info
+
+def load_items(args):
+    if args.fixture:
+        with open(args.fixture) as f:
+            data = json.load(f)
+        items = data.get("items", data) if isinstance(data, dict) else data
+        return (items * (args.posts // max(len(items), 1) + 1))[:args.posts]
+    return [make_post("1234567890", index) for index in range(args.posts)]
+
+def measure(name, func, rounds):
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return {"case": name, "rounds": rounds, "best_ms": round(timings[0] * 1000, 3),
+            "median_ms": round(timings[len(timings) // 2] * 1000, 3)}
+
+def retained_bytes(build):
+    tracemalloc.start()
+    result = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return size
+
+def main():
+    parser = argparse.ArgumentParser(description="Post extraction and serialization micro-benchmark")
+    parser.add_argument("--posts", type=int, default=1000, help="Posts per round")
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--fixture", help="Recorded feed/user page (JSON) to use instead of synthetic posts")
+    parser.add_argument("--fields", default="id,timestamp,media.url", help="Projection for the ?fields= cases")
+    args = parser.parse_args()
+
+    items = load_items(args)
+    debug_info = {"errors": []}
+    legacy = [legacy_post_info(post) for post in items]
+    posts = [create_post_info(post, debug_info) for post in items]
+    fields = records.parse_fields(args.fields)
+    page = {"items": posts}
+
+    results = [
+        measure("extract_dicts", lambda: [legacy_post_info(post) for post in items], args.rounds),
+        measure("extract_records", lambda: [create_post_info(post, debug_info) for post in items], args.rounds),
+        measure("serialize_dicts_json", lambda: json.dumps({"items": legacy}), args.rounds),
+        measure("serialize_records_json", lambda: json.dumps(page, default=records.encode_default), args.rounds),
+        measure("serialize_records", lambda: records.dumps(page), args.rounds),
+        measure("serialize_records_projected",
+                lambda: records.dumps({"items": [post.to_dict(fields) for post in posts]}), args.rounds),
+    ]
+    response_bytes = {
+        "full": len(records.dumps(page)),
+        "projected": len(records.dumps({"items": [post.to_dict(fields) for post in posts]}))
+    }
+    memory = {
+        "dicts": retained_bytes(lambda: [legacy_post_info(post) for post in items]),
+        "records": retained_bytes(lambda: [create_post_info(post, debug_info) for post in items])
+    }
+
+    for result in results:
+        result.update({"posts": len(items), "orjson": records.orjson is not None})
+        print(json.dumps(result), flush=True)
+    print(json.dumps({"case": "response_bytes", **response_bytes, "fields": args.fields}), flush=True)
+    print(json.dumps({"case": "retained_bytes", **memory, "posts": len(items)}), flush=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from stub_upstream import start_stub_server
+
+# Compares /api/instagram/<username> throughput of the Flask (threaded WSGI) app
+# and the ASGI app against the local stub upstream.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SERVERS = {
+    "sync": [sys.executable, "-c",
+             "import sys, app; from werkzeug.serving import run_simple; "
+             "run_simple('127.0.0.1', int(sys.argv[1]), app.app, threaded=True)"],
+    "async": [sys.executable, "-m", "uvicorn", "asgi_app:app", "--host", "127.0.0.1", "--log-level", "warning", "--port"],
+}
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def server_env(stub_port, work_dir, pacing=False):
+    """
+    Environment pointing a server at the stub, with its caches, stores and archive under
+    work_dir so nothing is written into the working tree; pacing=False turns off every
+    pacing sleep.
+    """
+    env = dict(os.environ)
+    env.update({
+        "INSTAGRAM_WEB_API": f"http://127.0.0.1:{stub_port}/api/v1",
+        "INSTAGRAM_MOBILE_API": f"http://127.0.0.1:{stub_port}/api/v1",
+        "TIKTOK_ITEM_API": f"http://127.0.0.1:{stub_port}/api/item/detail/",
+        "TIKTOK_CLIENT_POOL_WARM": "false",
+        "INSTAGRAM_COOKIES": "bench::sessionid=benchmark",
+        "INSTAGRAM_PACING": "true" if pacing else "false",
+        "INSTAGRAM_WORKERS": "64",
+        "HTTP_POOL_SIZE": "100",
+        "RATELIMIT_ENABLED": "false",
+        "TIKTOK_STORE_DIR": os.path.join(work_dir, "downloads"),
+        "TIKTOK_JOBS_DIR": os.path.join(work_dir, "jobs"),
+        "MEDIA_CACHE_DIR": os.path.join(work_dir, "media_cache"),
+        "INSTAGRAM_ARCHIVE_DB": os.path.join(work_dir, "archive.db"),
+    })
+    return env
+
+def wait_for_port(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Server on port {port} did not start")
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+def instagram_lookup_path(i):
+    # Distinct usernames and refresh=1 so every request goes upstream
+    return f"/api/instagram/bench_user_{i}?refresh=1&sync=full"
+
+async def run_load(base_url, requests_total, concurrency, path_for=instagram_lookup_path):
+    latencies = []
+    failures = 0
+    counter = iter(range(requests_total))
+    limits = httpx.Limits(max_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=120, limits=limits) as client:
+        async def worker():
+            nonlocal failures
+            for i in counter:
+                start = time.perf_counter()
+                response = await client.get(path_for(i))
+                latencies.append(time.perf_counter() - start)
+                if response.status_code != 200:
+                    failures += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    return {
+        "requests": requests_total,
+        "concurrency": concurrency,
+        "failures": failures,
+        "elapsed_s": round(elapsed, 3),
+        "requests_per_s": round(requests_total / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Sync vs async load benchmark against a stub upstream")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--latency", type=float, default=0.1, help="Stub upstream latency per call (s)")
+    parser.add_argument("--modes", nargs="+", default=["sync", "async"], choices=list(SERVERS))
+    args = parser.parse_args()
+
+    stub = start_stub_server(latency=args.latency)
+    results = []
+    with tempfile.TemporaryDirectory(prefix="bench-") as work_dir:
+        for mode in args.modes:
+            port = free_port()
+            process = subprocess.Popen(
+                SERVERS[mode] + [str(port)],
+                cwd=ROOT,
+                env=server_env(stub.server_port, work_dir),
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL
+            )
+            try:
+                wait_for_port(port)
+                for concurrency in args.concurrency:
+                    result = asyncio.run(run_load(f"http://127.0.0.1:{port}", args.requests, concurrency))
+                    result["mode"] = mode
+                    results.append(result)
+                    print(json.dumps(result), flush=True)
+            finally:
+                process.terminate()
+                process.wait()
+    stub.shutdown()
+
+if __name__ == "__main__":
+    main()
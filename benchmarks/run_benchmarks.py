@@ -0,0 +1,208 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from stub_upstream import start_stub_server, load_fixture
+from load_sync_vs_async import ROOT, SERVERS, free_port, server_env, wait_for_port, percentile, run_load, instagram_lookup_path
+
+# Offline benchmark suite. Load-tests /api/instagram/<username>, /api/tkdl/<path> and
+# /uptime against the stub upstream (recorded fixtures, optional latency and 429s,
+# pacing sleeps off unless --pacing) across concurrency levels, and micro-benchmarks
+# create_post_info and handle_instagram_response in-process on the same fixtures.
+#
+# Every result is printed as one JSON line; --output saves them all, and --baseline
+# compares against a saved run and exits 1 when something regressed past --tolerance.
+
+def tiktok_download_path(offset):
+    # A fresh id per request (and per run) so every download misses the store
+    return lambda i: f"/api/tkdl/https://www.tiktok.com/@bench/video/{offset + i}"
+
+ENDPOINTS = {
+    "instagram": lambda offset: instagram_lookup_path,
+    "tkdl": tiktok_download_path,
+    "uptime": lambda offset: (lambda i: "/uptime"),
+}
+
+def run_load_suite(args, stub, work_dir):
+    results = []
+    env = server_env(stub.server_port, work_dir, pacing=args.pacing)
+    for mode in args.modes:
+        port = free_port()
+        process = subprocess.Popen(
+            SERVERS[mode] + [str(port)],
+            cwd=ROOT,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL
+        )
+        try:
+            wait_for_port(port)
+            for endpoint in args.endpoints:
+                for concurrency in args.concurrency:
+                    offset = 7300000000000000000 + time.time_ns() % 10 ** 12
+                    result = asyncio.run(run_load(
+                        f"http://127.0.0.1:{port}", args.requests, concurrency, ENDPOINTS[endpoint](offset)
+                    ))
+                    result.update({"suite": "load", "endpoint": endpoint, "mode": mode})
+                    results.append(result)
+                    print(json.dumps(result), flush=True)
+        finally:
+            process.terminate()
+            process.wait()
+    return results
+
+def time_calls(name, calls, make_call):
+    """Time calls of make_call()(); building the callable is not timed"""
+    timings = []
+    for _ in range(calls):
+        call = make_call()
+        start = time.perf_counter()
+        call()
+        timings.append(time.perf_counter() - start)
+    total = sum(timings)
+    return {
+        "suite": "micro",
+        "name": name,
+        "calls": calls,
+        "ops_per_s": round(calls / total, 1) if total else None,
+        "p50_us": round(percentile(timings, 0.50) * 1e6, 2),
+        "p95_us": round(percentile(timings, 0.95) * 1e6, 2),
+        "p99_us": round(percentile(timings, 0.99) * 1e6, 2),
+    }
+
+def run_micro_suite(args, work_dir):
+    # Importing app starts its caches; keep them out of the working tree and skip TikTok warm-up
+    os.environ.update({
+        "TIKTOK_CLIENT_POOL_WARM": "false",
+        "TIKTOK_STORE_DIR": os.path.join(work_dir, "downloads"),
+        "TIKTOK_JOBS_DIR": os.path.join(work_dir, "jobs"),
+        "MEDIA_CACHE_DIR": os.path.join(work_dir, "media_cache"),
+        "INSTAGRAM_ARCHIVE_DB": os.path.join(work_dir, "archive.db"),
+    })
+    sys.path.insert(0, ROOT)
+    import requests
+    from app import create_post_info, handle_instagram_response, new_debug_info
+
+    def response_for(body):
+        # A fresh Response per call: requests caches the decoded body on the object
+        response = requests.models.Response()
+        response.status_code = 200
+        response._content = body
+        response.encoding = "utf-8"
+        response.headers["Content-Type"] = "application/json"
+        return response
+
+    feed = load_fixture("feed_user")
+    debug_info = new_debug_info()
+    parse_feed = lambda: [create_post_info(post, debug_info) for post in feed["items"]]
+    bodies = {name: json.dumps(load_fixture(name)).encode() for name in ("feed_user", "web_profile_info")}
+
+    results = [time_calls("create_post_info", args.micro_calls, lambda: parse_feed)]
+    results[0]["posts_per_call"] = len(feed["items"])
+    def parse_response(response):
+        # What every caller does: classify the response, then read its parsed body
+        success, result = handle_instagram_response(response)
+        return result.payload if success else result
+
+    for name, body in bodies.items():
+        result = time_calls(
+            f"handle_instagram_response/{name}", args.micro_calls,
+            lambda: (lambda response=response_for(body): parse_response(response))
+        )
+        result["body_bytes"] = len(body)
+        results.append(result)
+    for result in results:
+        print(json.dumps(result), flush=True)
+    return results
+
+def result_key(result):
+    if result["suite"] == "load":
+        return ("load", result["mode"], result["endpoint"], result["concurrency"])
+    return ("micro", result["name"])
+
+def compare(results, baseline, tolerance):
+    """Regressions against a baseline run: slower p95/p50 or lower throughput beyond tolerance"""
+    previous = {result_key(result): result for result in baseline if result.get("suite") in ("load", "micro")}
+    regressions = []
+    for result in results:
+        before = previous.get(result_key(result))
+        if before is None:
+            continue
+        if result["suite"] == "load":
+            checks = [("p95_ms", True), ("requests_per_s", False)]
+        else:
+            checks = [("p50_us", True)]
+        for metric, lower_is_better in checks:
+            old, new = before.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if (change > tolerance) if lower_is_better else (change < -tolerance):
+                regressions.append({
+                    "suite": "regression",
+                    "key": list(result_key(result)),
+                    "metric": metric,
+                    "baseline": old,
+                    "current": new,
+                    "change": round(change, 3)
+                })
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark suite against a stub upstream")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per endpoint and concurrency level")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--endpoints", nargs="+", default=list(ENDPOINTS), choices=list(ENDPOINTS))
+    parser.add_argument("--modes", nargs="+", default=["sync"], choices=list(SERVERS))
+    parser.add_argument("--latency", type=float, default=0.05, help="Stub upstream latency per call (s)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of upstream API calls answered with 429")
+    parser.add_argument("--video-size", type=int, default=2 * 1024 * 1024, help="Bytes per stub TikTok video")
+    parser.add_argument("--synthetic", action="store_true", help="Serve small synthetic posts instead of the fixtures")
+    parser.add_argument("--pacing", action="store_true", help="Keep the app's per-cookie pacing sleeps on")
+    parser.add_argument("--micro-calls", type=int, default=200)
+    parser.add_argument("--skip-load", action="store_true")
+    parser.add_argument("--skip-micro", action="store_true")
+    parser.add_argument("--output", help="Write all results to this JSON file")
+    parser.add_argument("--baseline", help="Compare against results saved with --output")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative slowdown before flagging")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix="bench-") as work_dir:
+        if not args.skip_load:
+            stub = start_stub_server(
+                latency=args.latency, error_rate=args.error_rate,
+                fixtures=not args.synthetic, video_size=args.video_size
+            )
+            try:
+                results += run_load_suite(args, stub, work_dir)
+            finally:
+                stub.shutdown()
+        if not args.skip_micro:
+            results += run_micro_suite(args, work_dir)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "created_at": time.time(),
+                "settings": {k: v for k, v in vars(args).items() if k not in ("output", "baseline")},
+                "results": results
+            }, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(json.dumps(regression), flush=True)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
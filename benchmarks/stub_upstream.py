@@ -0,0 +1,209 @@
+import os
+import re
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+# Local stand-in for the Instagram and TikTok APIs used by the benchmarks.
+# Serves web_profile_info, feed/user and reel_media from the recorded payloads in
+# fixtures/ (or small synthetic posts), plus TikTok item detail and video bytes,
+# with optional injected latency and 429 responses.
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+def load_fixture(name, directory=FIXTURES_DIR):
+    with open(os.path.join(directory, f"{name}.json"), encoding="utf-8") as f:
+        return json.load(f)
+
+def make_post(user_id, index):
+    media_type = (1, 2, 8)[index % 3]
+    image = {"candidates": [
+        {"url": f"https://scontent.cdninstagram.com/v/{user_id}_{index}_1080.jpg?oe=ABC", "width": 1080, "height": 1350},
+        {"url": f"https://scontent.cdninstagram.com/v/{user_id}_{index}_320.jpg?oe=ABC", "width": 320, "height": 400}
+    ]}
+    post = {
+        "id": f"{index}_{user_id}",
+        "taken_at": 1700000000 + index,
+        "like_count": index * 7,
+        "comment_count": index,
+        "media_type": media_type,
+        "caption": {"text": f"Post {index} " + "lorem ipsum " * 20},
+        "image_versions2": image
+    }
+    if media_type == 2:
+        post["video_versions"] = [{"url": f"https://scontent.cdninstagram.com/v/{user_id}_{index}.mp4?oe=ABC", "width": 720, "height": 1280}]
+    if media_type == 8:
+        post["carousel_media"] = [
+            {"media_type": 1, "image_versions2": image},
+            {"media_type": 2, "image_versions2": image, "video_versions": [{"url": f"https://scontent.cdninstagram.com/v/{user_id}_{index}_c.mp4", "width": 720, "height": 1280}]}
+        ]
+    return post
+
+class Fixtures:
+    """Recorded payloads, re-keyed per user/post so every response looks like a distinct account"""
+
+    def __init__(self, directory=FIXTURES_DIR):
+        self.profile = load_fixture("web_profile_info", directory)
+        feed = load_fixture("feed_user", directory)
+        reels = load_fixture("reel_media", directory)
+        self.tiktok = load_fixture("tiktok_item_detail", directory)
+        user = self.profile["data"]["user"]
+        self.user_id = user["id"]
+        self.username = user["username"]
+        # Items are kept as JSON text and re-keyed with string replacement: cheap enough
+        # that the stub does not become the bottleneck at high concurrency
+        self.feed_items = [(item["pk"], json.dumps(item, ensure_ascii=False)) for item in feed["items"]]
+        self.reel_items = json.dumps(reels["items"], ensure_ascii=False)
+
+    def profile_json(self, username, user_id):
+        text = json.dumps(self.profile, ensure_ascii=False)
+        return text.replace(self.username, username).replace(self.user_id, user_id)
+
+    def feed_item_json(self, user_id, index):
+        pk, text = self.feed_items[index % len(self.feed_items)]
+        new_pk = str(int(pk) - len(self.feed_items) * (index // len(self.feed_items)) * 7919)
+        return text.replace(pk, new_pk).replace(self.user_id, user_id)
+
+    def reels_json(self, user_id):
+        return '{"items": ' + self.reel_items.replace(self.user_id, user_id) + ', "status": "ok"}'
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    latency = 0.0
+    error_rate = 0.0
+    total_posts = 120
+    fixtures = None  # Fixtures, or None for synthetic make_post() items
+    video_size = 2 * 1024 * 1024
+    video_block = random.Random(0).randbytes(64 * 1024)
+
+    def send_body(self, body, status=200, content_type="application/json"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, payload, status=200):
+        self.send_body(payload.encode() if isinstance(payload, str) else json.dumps(payload).encode(), status)
+
+    def send_video(self, video_id):
+        # Deterministic per id, so each id has its own digest in the download store
+        prefix = hashlib.sha256(video_id.encode()).digest()
+        self.send_response(200)
+        self.send_header("Content-Type", "video/mp4")
+        self.send_header("Content-Length", str(self.video_size))
+        self.end_headers()
+        remaining = self.video_size
+        first = True
+        while remaining > 0:
+            chunk = (prefix + self.video_block) if first else self.video_block
+            first = False
+            self.wfile.write(chunk[:remaining])
+            remaining -= min(len(chunk), remaining)
+
+    def do_GET(self):
+        if self.latency:
+            time.sleep(self.latency * random.uniform(0.8, 1.2))
+        parsed = urlparse(self.path)
+        query = parse_qs(parsed.query)
+
+        match = re.search(r"/tiktok/video/(\d+)\.mp4$", parsed.path)
+        if match:
+            return self.send_video(match.group(1))
+
+        if self.error_rate and random.random() < self.error_rate:
+            return self.send_json({"message": "Please wait a few minutes before you try again.", "status": "fail"}, 429)
+
+        if parsed.path.endswith("/item/detail/"):
+            video_id = query.get("itemId", ["0"])[0]
+            detail = self.fixtures.tiktok if self.fixtures else load_fixture("tiktok_item_detail")
+            detail = json.loads(json.dumps(detail))
+            item = detail["itemInfo"]["itemStruct"]
+            item["id"] = item["video"]["id"] = video_id
+            item["video"]["downloadAddr"] = f"http://{self.headers['Host']}/tiktok/video/{video_id}.mp4"
+            return self.send_json(detail)
+
+        if parsed.path.endswith("/users/web_profile_info/"):
+            username = query.get("username", ["user"])[0]
+            if username.startswith("missing"):
+                # What Instagram serves for an unknown username
+                return self.send_body(b"<html><body>Page Not Found</body></html>", 404, "text/html")
+            user_id = str(abs(hash(username)) % 10 ** 10)
+            if self.fixtures:
+                return self.send_json(self.fixtures.profile_json(username, user_id))
+            return self.send_json({"data": {"user": {
+                "id": user_id,
+                "username": username,
+                "full_name": username.title(),
+                "biography": "Benchmark user",
+                "profile_pic_url": "https://scontent.cdninstagram.com/v/pic.jpg",
+                "edge_followed_by": {"count": 1000},
+                "edge_follow": {"count": 100},
+                "edge_owner_to_timeline_media": {"count": self.total_posts},
+                "is_private": False
+            }}})
+
+        match = re.search(r"/feed/user/(\d+)/reel_media/$", parsed.path)
+        if match:
+            if self.fixtures:
+                return self.send_json(self.fixtures.reels_json(match.group(1)))
+            return self.send_json({"items": [make_post(match.group(1), i) for i in range(5)]})
+
+        match = re.search(r"/feed/user/(\d+)/$", parsed.path)
+        if match:
+            start = int(query.get("max_id", ["0"])[0])
+            count = int(query.get("count", ["50"])[0])
+            end = min(start + count, self.total_posts)
+            more = end < self.total_posts
+            if self.fixtures:
+                items = ",".join(self.fixtures.feed_item_json(match.group(1), i) for i in range(start, end))
+                return self.send_json(
+                    f'{{"items": [{items}], "num_results": {end - start}, "more_available": {json.dumps(more)}, '
+                    f'"next_max_id": {json.dumps(str(end) if more else None)}, "status": "ok"}}'
+                )
+            return self.send_json({
+                "items": [make_post(match.group(1), i) for i in range(start, end)],
+                "more_available": more,
+                "next_max_id": str(end) if more else None
+            })
+
+        self.send_json({"message": "not found"}, 404)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_stub_server(port=0, latency=0.0, error_rate=0.0, fixtures=True, video_size=2 * 1024 * 1024):
+    """
+    Start the stub in a background thread; returns the server (see server_port).
+
+    fixtures=True serves the recorded payloads in fixtures/, a path serves those in
+    another directory, and False serves small synthetic posts.
+    """
+    if fixtures:
+        fixtures = Fixtures(FIXTURES_DIR if fixtures is True else fixtures)
+    handler = type("ConfiguredStubHandler", (StubHandler,), {
+        "latency": latency,
+        "error_rate": error_rate,
+        "fixtures": fixtures or None,
+        "video_size": video_size
+    })
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stub Instagram/TikTok API for benchmarks")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds of latency per upstream call")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of API calls answered with 429")
+    parser.add_argument("--synthetic", action="store_true", help="Serve small synthetic posts instead of the fixtures")
+    args = parser.parse_args()
+    server = start_stub_server(args.port, args.latency, args.error_rate, fixtures=not args.synthetic)
+    print(f"Stub upstream listening on http://127.0.0.1:{server.server_port}")
+    threading.Event().wait()
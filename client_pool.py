@@ -0,0 +1,157 @@
+import time
+import threading
+import logging
+from contextlib import contextmanager
+
+# Process-wide pool of clients that are expensive to build (TikTokApi instances,
+# cloudscraper sessions that have already passed the Cloudflare handshake).
+# Clients are checked out one request at a time; the pool size bounds concurrency.
+
+logger = logging.getLogger(__name__)
+
+class ClientPool:
+    def __init__(self, name, factory, size=2, checkout_timeout=30, max_uses=500, max_age=3600, check=None):
+        self.name = name
+        self.factory = factory
+        self.check = check  # check(client) -> bool, run on idle clients before they are handed out
+        self.size = size
+        self.checkout_timeout = checkout_timeout
+        self.max_uses = max_uses
+        self.max_age = max_age
+        self.idle = []  # entries ready for checkout, most recently returned last
+        self.slots = threading.BoundedSemaphore(size)
+        self.in_use = 0
+        self.created = 0
+        self.recycled = 0
+        self.discarded = 0
+        self.unhealthy = 0
+        self.checkouts = 0
+        self.checkout_timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.total_init_time = 0.0
+        self.last_init_time = 0.0
+        self.lock = threading.Lock()
+
+    def create(self):
+        start = time.monotonic()
+        client = self.factory()
+        elapsed = time.monotonic() - start
+        with self.lock:
+            self.created += 1
+            self.total_init_time += elapsed
+            self.last_init_time = elapsed
+        logger.info(f"Created {self.name} client in {elapsed:.2f}s")
+        return {"client": client, "created_at": time.time(), "uses": 0}
+
+    def warm(self):
+        """Fill the pool up to its size so the first requests skip client setup"""
+        with self.lock:
+            missing = self.size - len(self.idle) - self.in_use
+        for _ in range(missing):
+            try:
+                entry = self.create()
+            except Exception as e:
+                logger.error(f"Failed to warm {self.name} pool: {str(e)}")
+                break
+            with self.lock:
+                self.idle.append(entry)
+        logger.info(f"{self.name} pool warmed with {len(self.idle)} clients")
+
+    def expired(self, entry):
+        return entry["uses"] >= self.max_uses or time.time() - entry["created_at"] > self.max_age
+
+    def healthy(self, entry):
+        if self.check is None:
+            return True
+        try:
+            return bool(self.check(entry["client"]))
+        except Exception as e:
+            logger.warning(f"{self.name} health check failed: {str(e)}")
+            return False
+
+    def close(self, entry):
+        close = getattr(entry["client"], "close", None)
+        if callable(close):
+            try:
+                close()
+            except Exception as e:
+                logger.warning(f"Error closing {self.name} client: {str(e)}")
+
+    @contextmanager
+    def client(self):
+        """
+        Check out a client for the duration of the with block.
+
+        A client whose block raises is discarded rather than returned, so a session
+        stuck on a challenge or a broken connection is not handed to the next request.
+        """
+        start = time.monotonic()
+        if not self.slots.acquire(timeout=self.checkout_timeout):
+            with self.lock:
+                self.checkout_timeouts += 1
+            raise TimeoutError(f"No {self.name} client free after {self.checkout_timeout}s")
+
+        entry = None
+        stale = []
+        try:
+            wait = time.monotonic() - start
+            with self.lock:
+                self.in_use += 1
+                self.checkouts += 1
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+            while entry is None:
+                with self.lock:
+                    if not self.idle:
+                        break
+                    candidate = self.idle.pop()
+                    if self.expired(candidate):
+                        stale.append(candidate)
+                        self.recycled += 1
+                        continue
+                # Probe outside the lock; a client whose browser or session died while
+                # idle is closed and the next one tried
+                if self.healthy(candidate):
+                    entry = candidate
+                else:
+                    with self.lock:
+                        self.unhealthy += 1
+                    stale.append(candidate)
+            for old in stale:
+                self.close(old)
+            if entry is None:
+                entry = self.create()
+            entry["uses"] += 1
+            yield entry["client"]
+        except Exception:
+            if entry is not None:
+                with self.lock:
+                    self.discarded += 1
+                self.close(entry)
+                entry = None
+            raise
+        finally:
+            with self.lock:
+                self.in_use -= 1
+                if entry is not None:
+                    self.idle.append(entry)
+            self.slots.release()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "size": self.size,
+                "idle": len(self.idle),
+                "in_use": self.in_use,
+                "created": self.created,
+                "recycled": self.recycled,
+                "discarded": self.discarded,
+                "unhealthy": self.unhealthy,
+                "checkouts": self.checkouts,
+                "checkout_timeouts": self.checkout_timeouts,
+                "avg_checkout_wait": round(self.total_wait / self.checkouts, 4) if self.checkouts else 0.0,
+                "max_checkout_wait": round(self.max_wait, 4),
+                "avg_init_time": round(self.total_init_time / self.created, 4) if self.created else 0.0,
+                "last_init_time": round(self.last_init_time, 4)
+            }
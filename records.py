@@ -0,0 +1,206 @@
+import json
+
+try:
+    import orjson
+except ImportError:  # optional; the stdlib encoder is used instead
+    orjson = None
+
+# Compact in-memory records for processed posts and media. They are kept in the
+# response cache as-is and only turned into dicts when a response is serialized,
+# optionally projected down to the fields a caller asked for (?fields=id,media.url).
+# Media keep every rendition upstream offered, so the one served (?quality=) is
+# chosen per response rather than baked into the cached record.
+
+def renditions(versions):
+    """Compact (url, width, height) tuples for image_versions2 candidates or video_versions, largest first"""
+    return tuple(
+        (version["url"], version.get("width"), version.get("height"))
+        for version in versions or () if version.get("url")
+    )
+
+def parse_quality(spec):
+    """
+    Parse a media quality choice: "largest" (the default), "smallest", "max:<width>"
+    (largest rendition no wider than width) or "target:<width>" (closest to width).
+
+    Returns None for the default so callers can skip re-shaping records entirely.
+    """
+    spec = (spec or "").strip().lower()
+    if spec in ("", "largest"):
+        return None
+    if spec == "smallest":
+        return ("smallest", None)
+    mode, _, width = spec.partition(":")
+    if mode not in ("max", "target") or not width.isdigit():
+        raise ValueError(f"Invalid media quality: {spec!r}")
+    return (mode, int(width))
+
+def select_rendition(options, quality=None):
+    """Pick one (url, width, height) rendition according to a parsed quality"""
+    if not options:
+        return (None, None, None)
+    if quality is None:
+        return options[0]
+    mode, target = quality
+    # Renditions without a reported width sort as if they were the largest
+    width = lambda option: option[1] if option[1] is not None else float("inf")
+    if mode == "smallest":
+        return min(options, key=width)
+    if mode == "max":
+        fitting = [option for option in options if width(option) <= target]
+        return max(fitting, key=width) if fitting else min(options, key=width)
+    return min(options, key=lambda option: (abs(width(option) - target), -width(option)))
+
+class MediaRecord:
+    __slots__ = ("type", "renditions", "cover_renditions", "carousel_index", "id")
+
+    def __init__(self, type, renditions, cover_renditions=(), carousel_index=None, id=None):
+        self.type = type
+        self.renditions = renditions
+        self.cover_renditions = cover_renditions
+        self.carousel_index = carousel_index
+        self.id = id  # set for stories, which have no post to identify them
+
+    @property
+    def url(self):
+        return self.renditions[0][0]
+
+    def to_dict(self, fields=None, quality=None):
+        url, width, height = select_rendition(self.renditions, quality)
+        data = {"type": self.type, "url": url, "width": width, "height": height}
+        if self.type == "video":
+            data["cover_url"] = select_rendition(self.cover_renditions, quality)[0]
+        if self.carousel_index is not None:
+            data["is_carousel_item"] = True
+            data["carousel_index"] = self.carousel_index
+        if self.id is not None:
+            data["id"] = self.id
+        if fields:
+            return {name: data[name] for name in fields if name in data}
+        return data
+
+    def to_state(self):
+        """Lossless form for the shared store: every rendition, not just the selected one"""
+        return {
+            "type": self.type,
+            "renditions": self.renditions,
+            "cover_renditions": self.cover_renditions,
+            "carousel_index": self.carousel_index,
+            "id": self.id
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        if "renditions" in data:
+            return cls(
+                data["type"], tuple(map(tuple, data["renditions"])),
+                tuple(map(tuple, data["cover_renditions"] or ())), data.get("carousel_index"), data.get("id")
+            )
+        # Entries stored before renditions were kept carry only the selected URLs
+        cover = ((data["cover_url"], None, None),) if data.get("cover_url") else ()
+        return cls(
+            data["type"], ((data["url"], data.get("width"), data.get("height")),), cover,
+            data.get("carousel_index"), data.get("id")
+        )
+
+class PostRecord:
+    __slots__ = ("id", "caption", "timestamp", "like_count", "comment_count", "media_type", "media")
+
+    def __init__(self, id, caption, timestamp, like_count, comment_count, media_type, media):
+        self.id = id
+        self.caption = caption
+        self.timestamp = timestamp
+        self.like_count = like_count
+        self.comment_count = comment_count
+        self.media_type = media_type
+        self.media = media
+
+    def field(self, name, subfields=None, quality=None):
+        if name == "media":
+            return [media.to_dict(subfields, quality) for media in self.media]
+        if name == "is_video":
+            return self.media_type == 2
+        if name == "is_carousel":
+            return self.media_type == 8
+        return getattr(self, name)
+
+    def to_dict(self, fields=None, quality=None):
+        if fields:
+            return {name: self.field(name, subfields, quality) for name, subfields in fields.items() if name in POST_FIELDS}
+        return {
+            "id": self.id,
+            "caption": self.caption,
+            "timestamp": self.timestamp,
+            "like_count": self.like_count,
+            "comment_count": self.comment_count,
+            "is_video": self.media_type == 2,
+            "is_carousel": self.media_type == 8,
+            "media": [media.to_dict(quality=quality) for media in self.media]
+        }
+
+    def to_state(self):
+        data = self.to_dict()
+        data["media"] = [media.to_state() for media in self.media]
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        media_type = 2 if data.get("is_video") else 8 if data.get("is_carousel") else 1
+        return cls(
+            data["id"], data["caption"], data["timestamp"], data["like_count"], data["comment_count"],
+            media_type, [MediaRecord.from_dict(media) for media in data["media"]]
+        )
+
+POST_FIELDS = ("id", "caption", "timestamp", "like_count", "comment_count", "is_video", "is_carousel", "media")
+
+def parse_fields(spec):
+    """Parse "id,media.url" into {"id": {}, "media": {"url": {}}}; None when no projection"""
+    if not spec:
+        return None
+    fields = {}
+    for path in spec.split(","):
+        node = fields
+        for part in path.strip().split("."):
+            if part:
+                node = node.setdefault(part, {})
+    return fields or None
+
+def encode_default(obj):
+    if isinstance(obj, (PostRecord, MediaRecord)):
+        return obj.to_dict()
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+def encode_state(obj):
+    if isinstance(obj, (PostRecord, MediaRecord)):
+        return obj.to_state()
+    return encode_default(obj)
+
+def unsigned_url(url):
+    """A CDN URL without its query string, which holds per-fetch signatures and expiry"""
+    return url.split("?", 1)[0] if url else url
+
+def encode_digest(obj):
+    """
+    Encoder for content digests: records as plain lists. Media are identified by the
+    unsigned URL of their largest rendition; the others are resized copies of it.
+    """
+    if isinstance(obj, MediaRecord):
+        cover = obj.cover_renditions[0][0] if obj.cover_renditions else None
+        return [obj.type, unsigned_url(obj.url), unsigned_url(cover), obj.carousel_index, obj.id]
+    if isinstance(obj, PostRecord):
+        return [obj.id, obj.caption, obj.timestamp, obj.like_count, obj.comment_count, obj.media_type, obj.media]
+    return encode_default(obj)
+
+def loads(data):
+    """Parse JSON bytes or text, with orjson when it is installed; raises ValueError"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def dumps(obj, default=encode_default):
+    """Serialize to a JSON string, with orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(obj, default=default, option=orjson.OPT_NON_STR_KEYS).decode()
+    return json.dumps(obj, default=default)
@@ -0,0 +1,277 @@
+import os
+import time
+import sqlite3
+import threading
+import logging
+from urllib.parse import urlparse
+
+from limits.storage import Storage
+
+# Key/value state shared between worker processes: limiter counters, cookie
+# health and the response cache. Select a backend with SHARED_STATE_URL:
+#   memory://                 in-process only (default, and the stand-in for tests)
+#   sqlite:////path/state.db  all workers on one node
+#   redis://host:6379/0       several nodes (needs the redis package)
+
+logger = logging.getLogger(__name__)
+
+class MemoryBackend:
+    def __init__(self):
+        self.data = {}  # key -> (value, expires_at)
+        self.lock = threading.Lock()
+
+    def get_entry(self, key, now):
+        # Caller holds the lock
+        entry = self.data.get(key)
+        if entry is not None and entry[1] is not None and entry[1] <= now:
+            del self.data[key]
+            return None
+        return entry
+
+    def get(self, key):
+        with self.lock:
+            entry = self.get_entry(key, time.time())
+            return entry[0] if entry else None
+
+    def set(self, key, value, ttl=None):
+        with self.lock:
+            self.data[key] = (value, time.time() + ttl if ttl else None)
+
+    def delete(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+
+    def incr(self, key, amount=1, ttl=None):
+        """Add amount to an integer key; ttl only applies when the key is created"""
+        with self.lock:
+            now = time.time()
+            entry = self.get_entry(key, now)
+            if entry is None:
+                entry = (0, now + ttl if ttl else None)
+            value = int(entry[0]) + amount
+            self.data[key] = (value, entry[1])
+            return value
+
+    def touch(self, key, ttl):
+        """Restart an existing key's TTL; False when the key is absent"""
+        with self.lock:
+            now = time.time()
+            entry = self.get_entry(key, now)
+            if entry is None:
+                return False
+            self.data[key] = (entry[0], now + ttl)
+            return True
+
+    def compare_and_set(self, key, expected, value, ttl=None):
+        """Set key to value only if it still holds expected (None: absent); True when set"""
+        with self.lock:
+            entry = self.get_entry(key, time.time())
+            if (entry[0] if entry else None) != expected:
+                return False
+            self.data[key] = (value, time.time() + ttl if ttl else None)
+            return True
+
+    def expiry(self, key):
+        with self.lock:
+            entry = self.get_entry(key, time.time())
+            return entry[1] if entry else None
+
+class SQLiteBackend:
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        conn = self.connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS shared_state ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)"
+        )
+
+    def connection(self):
+        # sqlite3 connections are per thread; each worker process opens its own
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            self.local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self.connection().execute(
+            "SELECT value FROM shared_state WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (key, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key, value, ttl=None):
+        self.connection().execute(
+            "INSERT OR REPLACE INTO shared_state (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, str(value), time.time() + ttl if ttl else None)
+        )
+
+    def delete(self, key):
+        self.connection().execute("DELETE FROM shared_state WHERE key = ?", (key,))
+
+    def incr(self, key, amount=1, ttl=None):
+        """Add amount to an integer key; ttl only applies when the key is created"""
+        conn = self.connection()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT value, expires_at FROM shared_state WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or (row[1] is not None and row[1] <= now):
+                value, expires_at = amount, now + ttl if ttl else None
+            else:
+                value, expires_at = int(row[0]) + amount, row[1]
+            conn.execute(
+                "INSERT OR REPLACE INTO shared_state (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, str(value), expires_at)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return value
+
+    def touch(self, key, ttl):
+        """Restart an existing key's TTL; False when the key is absent"""
+        now = time.time()
+        cursor = self.connection().execute(
+            "UPDATE shared_state SET expires_at = ? WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (now + ttl, key, now)
+        )
+        return cursor.rowcount > 0
+
+    def compare_and_set(self, key, expected, value, ttl=None):
+        """Set key to value only if it still holds expected (None: absent); True when set"""
+        conn = self.connection()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT value FROM shared_state WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                (key, now)
+            ).fetchone()
+            if (row[0] if row else None) != expected:
+                conn.execute("ROLLBACK")
+                return False
+            conn.execute(
+                "INSERT OR REPLACE INTO shared_state (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, str(value), now + ttl if ttl else None)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return True
+
+    def expiry(self, key):
+        row = self.connection().execute(
+            "SELECT expires_at FROM shared_state WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (key, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+class RedisBackend:
+    def __init__(self, url):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("SHARED_STATE_URL uses redis:// but the redis package is not installed")
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+        self.watch_error = redis.WatchError
+
+    def get(self, key):
+        return self.client.get(key)
+
+    def set(self, key, value, ttl=None):
+        self.client.set(key, value, ex=int(ttl) if ttl else None)
+
+    def delete(self, key):
+        self.client.delete(key)
+
+    def incr(self, key, amount=1, ttl=None):
+        """Add amount to an integer key; ttl only applies when the key is created"""
+        # One MULTI/EXEC round trip: the key can never be created without its TTL
+        pipe = self.client.pipeline()
+        if ttl:
+            pipe.set(key, 0, ex=max(1, int(ttl)), nx=True)
+        pipe.incrby(key, amount)
+        return pipe.execute()[-1]
+
+    def touch(self, key, ttl):
+        """Restart an existing key's TTL; False when the key is absent"""
+        return bool(self.client.expire(key, max(1, int(ttl))))
+
+    def compare_and_set(self, key, expected, value, ttl=None):
+        """Set key to value only if it still holds expected (None: absent); True when set"""
+        with self.client.pipeline() as pipe:
+            try:
+                pipe.watch(key)
+                if pipe.get(key) != expected:
+                    return False
+                pipe.multi()
+                pipe.set(key, value, ex=int(ttl) if ttl else None)
+                pipe.execute()
+                return True
+            except self.watch_error:
+                return False
+
+    def expiry(self, key):
+        ttl = self.client.ttl(key)
+        return time.time() + ttl if ttl and ttl > 0 else None
+
+def sqlite_path(url):
+    parsed = urlparse(url)
+    return (parsed.netloc + parsed.path) or ":memory:"
+
+def backend_from_url(url):
+    """Build a shared state backend from a memory://, sqlite:// or redis:// URL"""
+    scheme = urlparse(url).scheme
+    if scheme == "memory":
+        return MemoryBackend()
+    if scheme == "sqlite":
+        path = sqlite_path(url)
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        return SQLiteBackend(path)
+    if scheme in ("redis", "rediss"):
+        return RedisBackend(url)
+    raise ValueError(f"Unsupported shared state URL: {url}")
+
+# Lets flask-limiter / limits use sqlite:// URLs; memory:// and redis:// are built in
+class SQLiteLimiterStorage(Storage):
+    STORAGE_SCHEME = ["sqlite"]
+
+    def __init__(self, uri=None, wrap_exceptions=False, **options):
+        self.backend = SQLiteBackend(sqlite_path(uri))
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+
+    @property
+    def base_exceptions(self):
+        return sqlite3.Error
+
+    def incr(self, key, expiry, elastic_expiry=False, amount=1):
+        return self.backend.incr(f"limiter:{key}", amount, ttl=expiry)
+
+    def get(self, key):
+        return int(self.backend.get(f"limiter:{key}") or 0)
+
+    def get_expiry(self, key):
+        return self.backend.expiry(f"limiter:{key}") or time.time()
+
+    def check(self):
+        try:
+            self.backend.get("limiter:check")
+            return True
+        except sqlite3.Error:
+            return False
+
+    def reset(self):
+        return self.backend.connection().execute(
+            "DELETE FROM shared_state WHERE key LIKE 'limiter:%'"
+        ).rowcount
+
+    def clear(self, key):
+        self.backend.delete(f"limiter:{key}")
@@ -0,0 +1,31 @@
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The app's modules live at the repository root, not in a package
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+from stub_upstream import start_stub_server
+
+# app reads its configuration at import: point it at the stub upstream, keep its
+# caches and stores out of the working tree and leave the background threads off
+STUB = start_stub_server(fixtures=False, video_size=64 * 1024)
+WORK_DIR = tempfile.mkdtemp(prefix="app-tests-")
+os.environ.update({
+    "INSTAGRAM_WEB_API": f"http://127.0.0.1:{STUB.server_port}/api/v1",
+    "INSTAGRAM_MOBILE_API": f"http://127.0.0.1:{STUB.server_port}/api/v1",
+    "TIKTOK_ITEM_API": f"http://127.0.0.1:{STUB.server_port}/api/item/detail/",
+    "INSTAGRAM_COOKIES": "first::sessionid=first||second::sessionid=second",
+    "INSTAGRAM_PACING": "false",
+    "TIKTOK_CLIENT_POOL_WARM": "false",
+    "WATCH_ENABLED": "false",
+    "RATELIMIT_ENABLED": "false",
+    "SHARED_STATE_URL": "memory://",
+    "INSTAGRAM_ARCHIVE_DB": "",
+    "TIKTOK_STORE_DIR": os.path.join(WORK_DIR, "downloads"),
+    "TIKTOK_JOBS_DIR": os.path.join(WORK_DIR, "jobs"),
+    "MEDIA_CACHE_DIR": os.path.join(WORK_DIR, "media_cache"),
+})
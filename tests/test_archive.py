@@ -0,0 +1,111 @@
+import pytest
+
+from archive import PostArchive, decode_cursor, match_expression
+from records import MediaRecord, PostRecord
+
+USER_ID = "1001"
+
+def make_post(index, caption, media_type=1):
+    media = [MediaRecord("image", ((f"https://cdn/{index}.jpg", 1080, 1080), (f"https://cdn/{index}_s.jpg", 320, 320)))]
+    return PostRecord(f"{index}_{USER_ID}", caption, 1700000000 + index, index, 0, media_type, media)
+
+def flush(archive):
+    # The writer is a single thread, so a no-op runs after every queued write
+    archive.writer.submit(lambda: None).result()
+
+@pytest.fixture
+def archive(tmp_path):
+    archive = PostArchive(str(tmp_path / "archive.db"), max_page=100)
+    archive.save_profile({
+        "user_id": USER_ID,
+        "profile": {
+            "username": "Someone", "full_name": "Some One", "followers": 1, "following": 2,
+            "posts_count": 10, "is_private": False
+        }
+    })
+    captions = ["sunset at the beach", "coffee time", "beach volleyball", "Sunsets again", "just text"]
+    archive.save_posts(USER_ID, [make_post(i, captions[i % len(captions)]) for i in range(10)])
+    flush(archive)
+    yield archive
+    archive.writer.shutdown()
+
+def test_match_expression():
+    assert match_expression("beach sun*") == '"beach" "sun"*'
+    assert match_expression('say "hi" OR') == '"say" """hi""" "OR"'
+    assert match_expression("*") == ""
+
+def test_query_by_username_newest_first(archive):
+    page = archive.query_posts(username="someone", limit=3)
+    assert [item["id"] for item in page["items"]] == [f"{i}_{USER_ID}" for i in (9, 8, 7)]
+    assert page["items"][0]["username"] == "Someone"
+    assert page["items"][0]["media"] == [{"type": "image", "url": "https://cdn/9.jpg", "width": 1080, "height": 1080}]
+    assert page["next_cursor"] is not None
+
+def test_cursor_pages_through_everything_once(archive):
+    for oldest_first in (False, True):
+        seen, cursor = [], None
+        while True:
+            page = archive.query_posts(user_id=USER_ID, cursor=cursor, limit=4, oldest_first=oldest_first)
+            seen.extend(item["id"] for item in page["items"])
+            cursor = page["next_cursor"]
+            if cursor is None:
+                break
+        expected = [f"{i}_{USER_ID}" for i in range(10)]
+        assert seen == (expected if oldest_first else expected[::-1])
+
+def test_cursor_is_stable_under_inserts(archive):
+    first = archive.query_posts(user_id=USER_ID, limit=5)
+    # A newer post arriving between pages does not shift the next page
+    archive.save_posts(USER_ID, [make_post(20, "brand new")])
+    flush(archive)
+    second = archive.query_posts(user_id=USER_ID, cursor=first["next_cursor"], limit=5)
+    assert [item["id"] for item in second["items"]] == [f"{i}_{USER_ID}" for i in (4, 3, 2, 1, 0)]
+    assert second["next_cursor"] is None
+
+def test_invalid_cursor(archive):
+    with pytest.raises(ValueError):
+        archive.query_posts(cursor="garbage")
+    with pytest.raises(ValueError):
+        decode_cursor("1700000000:")
+
+def test_text_search(archive):
+    assert archive.fts
+    ids = lambda page: {item["id"] for item in page["items"]}
+    assert ids(archive.query_posts(text="beach")) == {f"{i}_{USER_ID}" for i in (0, 2, 5, 7)}
+    assert ids(archive.query_posts(text="sunset")) == {f"{i}_{USER_ID}" for i in (0, 5)}
+    assert ids(archive.query_posts(text="sunset*")) == {f"{i}_{USER_ID}" for i in (0, 3, 5, 8)}
+    assert ids(archive.query_posts(text="beach volleyball")) == {f"{i}_{USER_ID}" for i in (2, 7)}
+    # FTS operators in the input are searched for literally, not parsed
+    assert archive.query_posts(text="beach OR coffee")["items"] == []
+
+def test_text_search_follows_caption_updates(archive):
+    edited = make_post(1, "now at the beach")
+    archive.save_posts(USER_ID, [edited])
+    flush(archive)
+    assert f"1_{USER_ID}" in {item["id"] for item in archive.query_posts(text="beach")["items"]}
+    assert archive.query_posts(text="coffee", user_id=USER_ID)["items"][0]["id"] == f"6_{USER_ID}"
+
+def test_text_search_with_cursor(archive):
+    first = archive.query_posts(text="beach", limit=2)
+    second = archive.query_posts(text="beach", cursor=first["next_cursor"], limit=2)
+    assert [item["id"] for item in first["items"] + second["items"]] == [f"{i}_{USER_ID}" for i in (7, 5, 2, 0)]
+    assert second["next_cursor"] is None
+
+def test_filters(archive):
+    archive.save_posts(USER_ID, [make_post(30, "a reel", media_type=2)])
+    flush(archive)
+    videos = archive.query_posts(media_type="video")
+    assert [item["id"] for item in videos["items"]] == [f"30_{USER_ID}"]
+    assert videos["items"][0]["media_type"] == "video"
+    window = archive.query_posts(since=1700000002, until=1700000005)
+    assert [item["id"] for item in window["items"]] == [f"{i}_{USER_ID}" for i in (4, 3, 2)]
+    with pytest.raises(ValueError):
+        archive.query_posts(media_type="gif")
+
+def test_stories(archive):
+    stories = [MediaRecord("image", (("https://cdn/s.jpg", 1080, 1920),), id="s1"), MediaRecord("image", (("x", 1, 1),))]
+    archive.save_stories(USER_ID, stories)
+    flush(archive)
+    page = archive.query_stories(username="SOMEONE")
+    assert [item["id"] for item in page["items"]] == ["s1"]
+    assert archive.stats()["stories"] == 1
@@ -0,0 +1,37 @@
+import json
+
+import pytest
+
+import app
+
+@pytest.fixture
+def client():
+    return app.app.test_client()
+
+def lines(res):
+    return [json.loads(line) for line in res.get_data(as_text=True).splitlines()]
+
+def test_batch_streams_one_line_per_username(client):
+    res = client.post("/api/instagram/batch", json={
+        "usernames": ["batch_a", "Batch_A", " batch_b ", 7, ""], "fields": "id", "quality": "smallest"
+    })
+    assert res.status_code == 200
+    results = {line["username"]: line for line in lines(res)}
+    assert sorted(results) == ["batch_a", "batch_b"]
+    assert all(line["status"] == 200 for line in results.values())
+    assert set(results["batch_a"]["result"]["posts"]["items"][0]) == {"id"}
+
+@pytest.mark.parametrize("body, error", [
+    ({"usernames": ["batch_a"], "quality": 640}, "Invalid quality"),
+    ({"usernames": ["batch_a"], "quality": ["smallest"]}, "Invalid quality"),
+    ({"usernames": ["batch_a"], "quality": "huge"}, "Invalid media quality: 'huge'"),
+    ({"usernames": ["batch_a"], "fields": ["id"]}, "Invalid fields"),
+    ({"usernames": ["batch_a"], "fields": {"id": True}}, "Invalid fields"),
+    ({"usernames": "batch_a"}, "Expected a JSON body with a 'usernames' list"),
+    (["batch_a"], "Expected a JSON body with a 'usernames' list"),
+    ({"usernames": [1, None]}, "No usernames provided"),
+])
+def test_invalid_batch_bodies(client, body, error):
+    res = client.post("/api/instagram/batch", json=body)
+    assert res.status_code == 400
+    assert res.get_json()["error"] == error
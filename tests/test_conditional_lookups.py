@@ -0,0 +1,74 @@
+import pytest
+
+import app
+from records import MediaRecord, PostRecord
+
+@pytest.fixture
+def client():
+    return app.app.test_client()
+
+def make_post(post_id, timestamp, url="https://scontent.cdninstagram.com/v/1.jpg?oh=a"):
+    return PostRecord(post_id, "", timestamp, 0, 0, 1, [MediaRecord("image", ((url, 640, 640),))])
+
+def make_payload(posts):
+    return {
+        "profile": {"username": "alice", "profile_pic": "https://scontent.cdninstagram.com/v/pic.jpg?oh=a"},
+        "stories": {"count": 0, "items": []},
+        "posts": {"count": len(posts), "items": posts},
+        "debug": app.new_debug_info()
+    }
+
+def test_etag_ignores_url_signatures_and_debug():
+    first = make_payload([make_post("1", 100)])
+    resigned = make_payload([make_post("1", 100, url="https://scontent.cdninstagram.com/v/1.jpg?oh=b")])
+    resigned["profile"]["profile_pic"] = "https://scontent.cdninstagram.com/v/pic.jpg?oh=b"
+    resigned["debug"]["stats"]["api_calls"] = 3
+    assert app.content_digest(first) == app.content_digest(resigned)
+    assert app.content_digest(first) != app.content_digest(make_payload([make_post("2", 200)]))
+    # The response shape is part of the tag
+    assert app.content_digest(first) != app.content_digest(first, fields=app.parse_fields("id"))
+
+def test_etag_matching():
+    assert app.etag_matches('W/"abc"', "abc")
+    assert app.etag_matches('"x", W/"abc"', "abc")
+    assert app.etag_matches("*", "abc")
+    assert not app.etag_matches('W/"abd"', "abc")
+    assert not app.etag_matches(None, "abc")
+
+def test_changes_since_an_earlier_etag():
+    _, etag = app.conditional_payload(make_payload([make_post("2", 200), make_post("1", 100)]))
+    payload = make_payload([make_post("3", 300), make_post("2", 200)])
+    changed, new_etag = app.conditional_payload(payload, since=f'W/"{etag}"')
+    assert new_etag != etag
+    assert [post.id for post in changed["posts"]["items"]] == ["3"]
+    assert changed["posts"]["removed"] == ["1"]
+    assert changed["changes"] == {"since": etag, "delta": True}
+
+def test_changes_since_a_post_id():
+    payload = make_payload([make_post("3", 300), make_post("2", 200), make_post("1", 100)])
+    changed, _ = app.conditional_payload(payload, since_id="2")
+    assert [post.id for post in changed["posts"]["items"]] == ["3"]
+    unknown, _ = app.conditional_payload(payload, since_id="9")
+    assert unknown["posts"]["count"] == 3
+    assert unknown["changes"]["delta"] is False
+
+def test_polling_a_lookup(client):
+    first = client.get("/api/instagram/etag_user")
+    assert first.status_code == 200
+    etag = first.headers["ETag"]
+    assert etag.startswith('W/"')
+    assert first.get_json()["posts"]["count"] == 100
+
+    unchanged = client.get("/api/instagram/etag_user", headers={"If-None-Match": etag})
+    assert unchanged.status_code == 304
+    assert unchanged.data == b""
+    assert unchanged.headers["ETag"] == etag
+
+    delta = client.get("/api/instagram/etag_user", query_string={"since": etag}).get_json()
+    assert delta["changes"]["delta"] is True
+    assert delta["posts"]["count"] == 0
+    assert delta["posts"]["removed"] == []
+
+    expired = client.get("/api/instagram/etag_user", query_string={"since": "unknown"}).get_json()
+    assert expired["changes"]["delta"] is False
+    assert expired["posts"]["count"] == 100
@@ -0,0 +1,78 @@
+import time
+
+import pytest
+
+import app
+from shared_state import MemoryBackend
+
+@pytest.fixture
+def manager():
+    return app.CookieManager(MemoryBackend())
+
+def test_rate_limited_cookie_is_quarantined(manager):
+    first, second = manager.cookies
+    index, cookie = manager.acquire()
+    manager.release(cookie, "rate_limited")
+    other = second if cookie == first else first
+    assert manager.health_stats(cookie)["quarantined_for"] == manager.cooldown_base
+    for _ in range(3):
+        _, picked = manager.acquire()
+        assert picked == other
+        manager.release(picked, "success")
+
+def test_repeated_strikes_double_the_cooldown(manager):
+    cookie = manager.cookies[0]
+    manager.release(cookie, "challenge")
+    manager.release(cookie, "challenge")
+    assert manager.health_stats(cookie)["quarantined_for"] == 2 * manager.cooldown_base
+    # A success clears the strikes, not the running quarantine
+    manager.release(cookie, "success")
+    assert manager.sync_health(cookie)["strikes"] == 0
+
+def test_all_cookies_quarantined(manager):
+    for cookie in manager.cookies:
+        manager.release(cookie, "rate_limited")
+    with pytest.raises(app.CookiesQuarantined) as raised:
+        manager.acquire()
+    assert 0 < raised.value.retry_after <= manager.cooldown_base
+    assert 0 < manager.quarantine_remaining() <= manager.cooldown_base
+    assert manager.spare_capacity() == 0
+    assert all(manager.health_stats(cookie)["in_flight"] == 0 for cookie in manager.cookies)
+
+def test_quarantine_is_shared_between_workers(manager):
+    other_worker = app.CookieManager(manager.state)
+    manager.release(manager.cookies[0], "rate_limited")
+    _, picked = other_worker.acquire()
+    assert picked == manager.cookies[1]
+
+def test_lookup_while_quarantined_is_unavailable(monkeypatch):
+    monkeypatch.setattr(app.cookie_manager, "state", MemoryBackend())
+    monkeypatch.setattr(app.cookie_manager, "health", {})
+    for cookie in app.cookie_manager.cookies:
+        app.cookie_manager.release(cookie, "rate_limited")
+    res = app.app.test_client().get("/api/instagram/quarantined_user?refresh=1")
+    assert res.status_code == 503
+    assert res.get_json()["error"].startswith("Cookies quarantined")
+    assert 0 < int(res.headers["Retry-After"]) <= app.cookie_manager.cooldown_base
+
+def test_in_flight_count_outlives_its_first_ttl(manager, monkeypatch):
+    monkeypatch.setattr(manager, "IN_FLIGHT_TTL", 0.2)
+    _, cookie = manager.acquire()
+    time.sleep(0.15)
+    manager.acquire(exclude=[c for c in manager.cookies if c != cookie])
+    time.sleep(0.1)
+    # Past the first acquire's TTL, but the second one restarted it
+    assert manager.health_stats(cookie)["in_flight"] == 2
+    manager.release(cookie, "success")
+    assert manager.health_stats(cookie)["in_flight"] == 1
+    time.sleep(0.25)
+    assert manager.health_stats(cookie)["in_flight"] == 0
+
+def test_rotation_is_per_worker(manager):
+    other_worker = app.CookieManager(manager.state)
+    manager.rotate_cookie()
+    assert manager.current_index == 1
+    assert other_worker.current_index == 0
+    assert manager.remove_cookie(0)
+    assert manager.current_index == 0
+    assert manager.get_current_cookie() == other_worker.cookies[1]
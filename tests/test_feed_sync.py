@@ -0,0 +1,70 @@
+import pytest
+
+import app
+from records import MediaRecord, PostRecord
+
+@pytest.fixture(autouse=True)
+def cache(monkeypatch):
+    cache = app.ResponseCache(app.response_cache.ttls, decoders=app.response_cache.decoders)
+    monkeypatch.setattr(app, "response_cache", cache)
+    return cache
+
+def make_post(post_id):
+    return PostRecord(post_id, "", 1800000000, 0, 0, 1, [MediaRecord("image", (("https://cdn/new.jpg", 640, 640),))])
+
+def sync(user_id, incremental=True):
+    debug_info = app.new_debug_info()
+    posts = app.fetch_user_posts(user_id, debug_info, incremental)
+    return [post.id for post in posts["items"]], debug_info["posts_sync"]
+
+def test_full_sync_saves_the_cursor(cache):
+    ids, stats = sync("1001")
+    # The stub serves 120 posts in pages of 50; a sync stops at 100
+    assert ids[:2] == ["0_1001", "1_1001"]
+    assert len(ids) == 100
+    assert stats == {"mode": "full", "pages": 2, "new_posts": 100, "stored_posts": 100}
+    feed = cache.get("feed", "1001")[0]
+    assert (feed["next_max_id"], feed["more_available"]) == ("100", True)
+
+def test_incremental_sync_stops_at_known_posts():
+    sync("1002")
+    ids, stats = sync("1002")
+    assert len(ids) == 100
+    assert stats == {"mode": "incremental", "pages": 1, "new_posts": 0, "stored_posts": 100}
+    assert sync("1002", incremental=False)[1]["mode"] == "full"
+
+def test_new_posts_are_merged_above_the_saved_feed(monkeypatch, cache):
+    sync("1003")
+    fetch_page = app.fetch_posts_page
+    def with_new_posts(user_id, max_id, debug_info):
+        page = fetch_page(user_id, max_id, debug_info)
+        if max_id is None:
+            page = dict(page, items=[make_post("new_2"), make_post("new_1")] + page["items"])
+        return page
+    monkeypatch.setattr(app, "fetch_posts_page", with_new_posts)
+
+    ids, stats = sync("1003")
+    assert ids[:3] == ["new_2", "new_1", "0_1003"]
+    assert len(ids) == 100
+    assert stats == {"mode": "incremental", "pages": 1, "new_posts": 2, "stored_posts": 102}
+    # Only the head changed: the deeper cursor from the first sync is kept
+    assert cache.get("feed", "1003")[0]["next_max_id"] == "100"
+
+def test_pinned_known_posts_do_not_end_the_sync(cache):
+    cache.set("feed", "1004", {"items": [make_post("old"), make_post("pinned")], "next_max_id": "2", "more_available": True})
+    feed_sync = app.FeedSync("1004")
+    page = {
+        "items": [make_post("pinned"), make_post("new"), make_post("old"), make_post("older")],
+        "pinned_ids": {"pinned"}, "more_available": True, "next_max_id": "4"
+    }
+    assert [post.id for post in feed_sync.add_page(page)] == ["new"]
+    assert feed_sync.reached_known
+    assert not feed_sync.wants_more()
+
+def test_failed_sync_serves_stale_posts(monkeypatch):
+    sync("1005")
+    monkeypatch.setattr(app, "fetch_posts_page", lambda user_id, max_id, debug_info: None)
+    debug_info = app.new_debug_info()
+    posts = app.fetch_user_posts("1005", debug_info)
+    assert posts["count"] == 100
+    assert debug_info["cache"]["posts"]["status"] == "stale"
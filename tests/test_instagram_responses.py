@@ -0,0 +1,70 @@
+import json
+
+import pytest
+import requests
+
+import app
+
+def response(status, body, content_type="application/json"):
+    res = requests.models.Response()
+    res.status_code = status
+    res._content = body if isinstance(body, bytes) else json.dumps(body).encode()
+    res.encoding = "utf-8"
+    res.headers["Content-Type"] = content_type
+    return res
+
+@pytest.mark.parametrize("status, body, error", [
+    (429, {"message": "Please wait a few minutes before you try again.", "status": "fail"}, "Rate limit exceeded"),
+    (403, b"<html>Forbidden</html>", "Access forbidden"),
+    (401, {"message": "login_required"}, "Authentication required"),
+    (200, b"<html>Log in to Instagram</html>", "Invalid cookie or session expired"),
+    (200, {"message": "challenge_required", "checkpoint_url": "/challenge/"}, "Challenge required"),
+    (400, {"message": "checkpoint_required", "status": "fail"}, "Challenge required: checkpoint_required"),
+    (500, b"<html>Something went wrong: login_required</html>", "Challenge required: login_required"),
+    (500, {"message": "Please wait a few minutes before you try again.", "status": "fail"}, "Instagram error (HTTP 500)"),
+    (200, {"message": "Unexpected error", "status": "fail"}, "Instagram error (HTTP 200): Unexpected error"),
+    (502, b"<html>Bad gateway</html>", "Instagram error (HTTP 502)"),
+    (400, {"message": "Invalid request", "status": "fail"}, "Instagram error (HTTP 400): Invalid request"),
+])
+def test_failures(status, body, error):
+    success, result = app.handle_instagram_response(response(status, body))
+    assert not success
+    assert result.startswith(error)
+
+def test_success_parses_body_once():
+    success, result = app.handle_instagram_response(response(200, {"items": [{"id": "1"}], "status": "ok"}))
+    assert success
+    assert result.status_code == 200
+    assert result.payload["items"] == [{"id": "1"}]
+    assert app.instagram_error(result) is None
+
+@pytest.mark.parametrize("body", [b"<html>Page Not Found</html>", {"message": "User not found", "status": "fail"}])
+def test_not_found_is_final_and_empty(body):
+    success, result = app.handle_instagram_response(response(404, body))
+    assert success
+    assert result.status_code == 404
+    assert result.payload == {}
+    assert app.instagram_error(result) == "Not found (HTTP 404)"
+
+def test_media_fields_do_not_trigger_challenges():
+    # Only top-level fields carry challenge markers; captions can say anything
+    body = {"items": [{"caption": {"text": "challenge_required checkpoint"}}], "status": "ok"}
+    success, _ = app.handle_instagram_response(response(200, body))
+    assert success
+
+def test_unknown_user_is_not_retried_or_penalized():
+    # The stub serves an HTML 404 for usernames starting with "missing"
+    before = dict(app.backoff_imposed.values)
+    payload, status = app.lookup_instagram_user("missing_user_1")
+    assert status == 404
+    assert payload["error"] == "User not found"
+    assert app.backoff_imposed.values == before
+
+def test_failed_stories_are_not_cached(monkeypatch):
+    fail = "Instagram error (HTTP 500): Please wait a few minutes before you try again."
+    monkeypatch.setattr(app, "make_instagram_request", lambda url: fail)
+    debug_info = app.new_debug_info()
+    stories = app.fetch_user_stories("stories-fail-1", debug_info)
+    assert stories["count"] == 0
+    assert debug_info["errors"] == [f"Failed to fetch stories: {fail}"]
+    assert app.response_cache.get("stories", "stories-fail-1") is None
@@ -0,0 +1,79 @@
+import io
+
+import pytest
+import requests
+
+import app
+
+def redirect(location):
+    res = requests.models.Response()
+    res.status_code = 302
+    res.headers["Location"] = location
+    res.raw = io.BytesIO()
+    return res
+
+def media(body=b"jpeg"):
+    res = requests.models.Response()
+    res.status_code = 200
+    res._content = body
+    res.headers["Content-Type"] = "image/jpeg"
+    return res
+
+class FakeSession:
+    def __init__(self, responses):
+        self.responses = dict(responses)
+        self.fetched = []
+
+    def get(self, url, **kwargs):
+        assert kwargs["allow_redirects"] is False
+        self.fetched.append(url)
+        return self.responses[url]
+
+@pytest.fixture
+def upstream(monkeypatch):
+    def install(responses):
+        session = FakeSession(responses)
+        monkeypatch.setattr(app.session_pool, "get", lambda name: session)
+        return session
+    return install
+
+@pytest.mark.parametrize("url, allowed", [
+    ("https://scontent-lhr8-1.cdninstagram.com/v/t51/1.jpg", True),
+    ("https://scontent.xx.fbcdn.net/v/2.jpg", True),
+    ("https://v16m.tiktokcdn.com/video/3.mp4", True),
+    ("https://l.instagram.com/?u=https%3A%2F%2Fexample.com", False),
+    ("https://www.instagram.com/p/abc/", False),
+    ("https://cdninstagram.com.example.com/1.jpg", False),
+    ("ftp://scontent.cdninstagram.com/1.jpg", False),
+])
+def test_allowed_media_hosts(url, allowed):
+    assert app.is_allowed_media_url(url) is allowed
+
+def test_redirects_on_the_cdn_are_followed(upstream):
+    session = upstream({
+        "https://a.cdninstagram.com/1.jpg": redirect("https://b.fbcdn.net/1.jpg"),
+        "https://b.fbcdn.net/1.jpg": media(),
+    })
+    res = app.open_media_upstream("https://a.cdninstagram.com/1.jpg")
+    assert res.content == b"jpeg"
+    assert session.fetched == ["https://a.cdninstagram.com/1.jpg", "https://b.fbcdn.net/1.jpg"]
+
+def test_redirects_off_the_cdn_are_refused(upstream):
+    session = upstream({"https://a.cdninstagram.com/1.jpg": redirect("http://169.254.169.254/latest/meta-data/")})
+    with pytest.raises(requests.exceptions.RequestException):
+        app.open_media_upstream("https://a.cdninstagram.com/1.jpg")
+    assert session.fetched == ["https://a.cdninstagram.com/1.jpg"]
+
+    res = app.app.test_client().get("/media", query_string={"url": "https://a.cdninstagram.com/1.jpg"})
+    assert res.status_code == 502
+
+def test_redirect_loops_are_cut_off(upstream):
+    upstream({"https://a.cdninstagram.com/1.jpg": redirect("/1.jpg")})
+    with pytest.raises(requests.exceptions.TooManyRedirects):
+        app.open_media_upstream("https://a.cdninstagram.com/1.jpg")
+
+def test_link_shim_is_not_proxied():
+    client = app.app.test_client()
+    url = "https://l.instagram.com/?u=http%3A%2F%2F127.0.0.1%2F"
+    assert client.get("/media", query_string={"url": url}).status_code == 400
+    assert client.get("/media_base64", query_string={"url": url}).status_code == 400
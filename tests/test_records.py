@@ -0,0 +1,79 @@
+import pytest
+
+import records
+from records import MediaRecord, PostRecord, parse_fields, parse_quality, renditions, select_rendition
+
+OPTIONS = (
+    ("https://cdn/1080.jpg?oh=a", 1080, 1350),
+    ("https://cdn/640.jpg?oh=b", 640, 800),
+    ("https://cdn/320.jpg?oh=c", 320, 400),
+)
+
+def make_post():
+    image = MediaRecord("image", OPTIONS, (), 0)
+    video = MediaRecord("video", (("https://cdn/v.mp4", 720, 1280),), OPTIONS, 1)
+    return PostRecord("42_7", "hello #world", 1700000000, 10, 2, 8, [image, video])
+
+def test_parse_fields():
+    assert parse_fields("") is None
+    assert parse_fields(None) is None
+    assert parse_fields(",") is None
+    assert parse_fields("id,media.url") == {"id": {}, "media": {"url": {}}}
+    assert parse_fields(" id , media.url,media.type") == {"id": {}, "media": {"url": {}, "type": {}}}
+
+def test_parse_quality():
+    assert parse_quality(None) is None
+    assert parse_quality("largest") is None
+    assert parse_quality(" Smallest ") == ("smallest", None)
+    assert parse_quality("max:640") == ("max", 640)
+    assert parse_quality("target:500") == ("target", 500)
+    for spec in ("huge", "max:", "max:abc", "target:-1", "min:100"):
+        with pytest.raises(ValueError):
+            parse_quality(spec)
+
+def test_select_rendition():
+    assert select_rendition((), None) == (None, None, None)
+    assert select_rendition(OPTIONS, None) == OPTIONS[0]
+    assert select_rendition(OPTIONS, ("smallest", None)) == OPTIONS[2]
+    assert select_rendition(OPTIONS, ("max", 700)) == OPTIONS[1]
+    assert select_rendition(OPTIONS, ("max", 640)) == OPTIONS[1]
+    # Nothing fits: fall back to the smallest rather than nothing
+    assert select_rendition(OPTIONS, ("max", 100)) == OPTIONS[2]
+    assert select_rendition(OPTIONS, ("target", 500)) == OPTIONS[1]
+    assert select_rendition(OPTIONS, ("target", 2000)) == OPTIONS[0]
+
+def test_select_rendition_without_width_sorts_largest():
+    options = (("https://cdn/unknown.jpg", None, None), ("https://cdn/320.jpg", 320, 400))
+    assert select_rendition(options, ("smallest", None)) == options[1]
+    assert select_rendition(options, ("max", 1000)) == options[1]
+
+def test_renditions_skips_versions_without_url():
+    versions = [{"url": "https://cdn/a.jpg", "width": 10, "height": 20}, {"width": 5}, {"url": ""}]
+    assert renditions(versions) == (("https://cdn/a.jpg", 10, 20),)
+    assert renditions(None) == ()
+
+def test_post_to_dict_round_trip():
+    post = make_post()
+    restored = PostRecord.from_dict(post.to_dict())
+    assert restored.to_dict() == post.to_dict()
+    # The plain dict only carries the selected rendition
+    assert restored.media[0].renditions == (OPTIONS[0],)
+
+def test_post_state_round_trip_keeps_renditions():
+    post = make_post()
+    state = records.loads(records.dumps(post.to_state()))
+    restored = PostRecord.from_dict(state)
+    assert restored.media_type == 8
+    assert restored.media[0].renditions == OPTIONS
+    assert restored.media[1].cover_renditions == OPTIONS
+    quality = ("max", 700)
+    assert restored.to_dict(quality=quality) == post.to_dict(quality=quality)
+
+def test_post_to_dict_projection():
+    post = make_post()
+    data = post.to_dict(parse_fields("id,is_carousel,media.url,unknown"), ("smallest", None))
+    assert data == {
+        "id": "42_7",
+        "is_carousel": True,
+        "media": [{"url": "https://cdn/320.jpg?oh=c"}, {"url": "https://cdn/v.mp4"}],
+    }
@@ -0,0 +1,48 @@
+import asyncio
+import time
+
+import pytest
+
+from app import RequestPacer
+
+def delay(pacer, key):
+    return pacer.reserve(key) - time.monotonic()
+
+def test_burst_then_spaced_at_rate():
+    pacer = RequestPacer(rate=2, burst=3, jitter=0)
+    assert [delay(pacer, "a") <= 0.01 for _ in range(3)] == [True] * 3
+    # Every send past the burst queues another 1/rate behind the one before it
+    assert delay(pacer, "a") == pytest.approx(0.5, abs=0.02)
+    assert delay(pacer, "a") == pytest.approx(1.0, abs=0.02)
+    # Keys are paced independently
+    assert delay(pacer, "b") <= 0.01
+
+def test_penalize_pushes_the_next_slot_back():
+    pacer = RequestPacer(rate=1, burst=3, jitter=0, backoff=2)
+    assert pacer.available_at("a") <= time.monotonic()
+    assert pacer.penalize("a", 0) == 2
+    assert pacer.available_at("a") - time.monotonic() == pytest.approx(3, abs=0.05)
+    assert pacer.penalize("a", 2) == 8
+    assert delay(pacer, "a") == pytest.approx(11, abs=0.05)
+
+def test_wait_records_the_queue():
+    pacer = RequestPacer(rate=20, burst=1, jitter=0)
+    assert pacer.wait("a") == 0
+    assert pacer.wait("a") == pytest.approx(0.05, abs=0.02)
+    stats = pacer.stats("a")
+    assert stats["wait_count"] == 2
+    assert stats["queue_depth"] == 0
+    assert stats["max_queue_depth"] == 1
+    assert stats["wait_histogram"]["le_0.1"] == 2
+    assert pacer.stats("unknown") is None
+
+def test_wait_async_shares_the_bucket():
+    pacer = RequestPacer(rate=20, burst=1, jitter=0)
+    pacer.wait("a")
+    assert asyncio.run(pacer.wait_async("a")) == pytest.approx(0.05, abs=0.02)
+    assert pacer.stats("a")["wait_count"] == 2
+
+def test_disabled_pacer_never_waits():
+    pacer = RequestPacer(rate=0.01, burst=1, jitter=0, enabled=False)
+    assert [pacer.wait("a") for _ in range(3)] == [0.0] * 3
+    assert asyncio.run(pacer.wait_async("a")) == 0.0
@@ -0,0 +1,73 @@
+import time
+
+import pytest
+
+import app
+from records import MediaRecord, PostRecord
+from shared_state import MemoryBackend
+
+TTLS = {"profile": 60, "posts": 600}
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1700000000.0]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    return now
+
+def make_cache(**kwargs):
+    kwargs.setdefault("max_stale", 3600)
+    return app.ResponseCache(TTLS, decoders={"posts": app.decode_post_records}, **kwargs)
+
+def test_fresh_then_stale_then_gone(clock):
+    cache = make_cache()
+    cache.set("profile", "alice", {"username": "alice"})
+    debug_info = app.new_debug_info()
+    assert cache.lookup("profile", "alice", debug_info) == {"username": "alice"}
+    assert debug_info["cache"]["profile"]["status"] == "hit"
+
+    clock[0] += 61
+    assert cache.lookup("profile", "alice", debug_info) is None
+    assert debug_info["cache"]["profile"]["status"] == "miss"
+    # Expired but within max_stale: still served when the upstream fails
+    assert cache.fallback("profile", "alice", debug_info) == {"username": "alice"}
+    assert debug_info["cache"]["profile"] == {"status": "stale", "age": 61.0}
+
+    clock[0] += 3600
+    assert cache.fallback("profile", "alice", debug_info) is None
+    assert cache.stats()["entries"] == 0
+
+def test_refresh_bypasses_the_cache(clock):
+    cache = make_cache()
+    cache.set("profile", "alice", {"username": "alice"})
+    cache.set("posts", "1", {"items": []})
+    debug_info = app.new_debug_info()
+    assert cache.lookup("profile", "alice", debug_info, refresh=True) is None
+    assert debug_info["cache"]["profile"]["status"] == "refresh"
+    assert cache.lookup("profile", "alice", debug_info, refresh={"posts"}) is not None
+    assert cache.lookup("posts", "1", debug_info, refresh={"posts"}) is None
+
+def test_least_recently_used_entries_are_evicted(clock):
+    cache = make_cache(max_bytes=160)
+    for name in ("a", "b", "c"):
+        cache.set("profile", name, {"username": name})
+    assert cache.stats()["entries"] == 3
+    cache.get("profile", "a")
+    cache.set("profile", "d", {"username": "d"})
+    assert cache.get("profile", "b") is None
+    assert cache.get("profile", "a") is not None
+    assert cache.stats()["bytes"] <= 160
+
+def test_shared_store_warms_other_workers(clock):
+    store = MemoryBackend()
+    first, second = make_cache(store=store), make_cache(store=store)
+    post = PostRecord("1_2", "caption", 1700000000, 3, 4, 1, [MediaRecord("image", (("https://cdn/1.jpg", 640, 640),))])
+    first.set("posts", "1", {"items": [post], "more_available": False})
+
+    clock[0] += 10
+    cached = second.lookup("posts", "1", app.new_debug_info())
+    assert isinstance(cached["items"][0], PostRecord)
+    assert cached["items"][0].to_dict() == post.to_dict()
+    # Loaded into the second worker's LRU; the age is the first worker's
+    assert second.stats()["entries"] == 1
+    assert second.get("posts", "1")[1] == 10
+    assert make_cache().get("posts", "1") is None
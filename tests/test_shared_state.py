@@ -0,0 +1,87 @@
+import time
+
+import pytest
+
+from shared_state import MemoryBackend, SQLiteBackend, backend_from_url
+
+@pytest.fixture(params=["memory", "sqlite"])
+def backend(request, tmp_path):
+    if request.param == "memory":
+        return MemoryBackend()
+    return SQLiteBackend(str(tmp_path / "state.db"))
+
+def test_get_set_delete(backend):
+    assert backend.get("missing") is None
+    backend.set("key", "value")
+    assert backend.get("key") == "value"
+    backend.delete("key")
+    assert backend.get("key") is None
+
+def test_set_ttl_expires(backend):
+    backend.set("key", "value", ttl=0.05)
+    assert backend.get("key") == "value"
+    time.sleep(0.1)
+    assert backend.get("key") is None
+    assert backend.expiry("key") is None
+
+def test_incr_counts(backend):
+    assert backend.incr("counter") == 1
+    assert backend.incr("counter") == 2
+    assert backend.incr("counter", 5) == 7
+    assert backend.incr("counter", -7) == 0
+    assert int(backend.get("counter")) == 0
+
+def test_incr_ttl_only_applies_on_create(backend):
+    assert backend.incr("lease", ttl=0.2) == 1
+    expires_at = backend.expiry("lease")
+    assert expires_at is not None and expires_at <= time.time() + 0.2
+    time.sleep(0.05)
+    # Later increments keep the original expiry instead of extending it
+    assert backend.incr("lease", ttl=10) == 2
+    assert backend.expiry("lease") == pytest.approx(expires_at)
+    time.sleep(0.2)
+    # Once expired the key starts over, with the new TTL
+    assert backend.incr("lease", ttl=10) == 1
+    assert backend.expiry("lease") > time.time() + 5
+
+def test_touch_restarts_the_ttl(backend):
+    assert not backend.touch("missing", 10)
+    backend.incr("counter", ttl=0.2)
+    time.sleep(0.15)
+    assert backend.touch("counter", 0.2)
+    time.sleep(0.1)
+    assert backend.get("counter") is not None
+    time.sleep(0.15)
+    assert backend.get("counter") is None
+    assert not backend.touch("counter", 10)
+
+def test_incr_without_ttl_never_expires(backend):
+    backend.incr("counter")
+    assert backend.expiry("counter") is None
+
+def test_sqlite_state_is_shared_between_instances(tmp_path):
+    path = str(tmp_path / "state.db")
+    first, second = SQLiteBackend(path), SQLiteBackend(path)
+    first.incr("counter", ttl=60)
+    assert second.incr("counter", ttl=60) == 2
+    second.set("key", "value")
+    assert first.get("key") == "value"
+
+def test_backend_from_url(tmp_path):
+    assert isinstance(backend_from_url("memory://"), MemoryBackend)
+    backend = backend_from_url(f"sqlite:///{tmp_path}/nested/state.db")
+    assert isinstance(backend, SQLiteBackend)
+    assert (tmp_path / "nested" / "state.db").exists()
+    with pytest.raises(ValueError):
+        backend_from_url("memcached://localhost")
+
+def test_compare_and_set(backend):
+    assert backend.compare_and_set("key", None, "first")
+    assert not backend.compare_and_set("key", None, "again")
+    assert not backend.compare_and_set("key", "stale", "second")
+    assert backend.get("key") == "first"
+    assert backend.compare_and_set("key", "first", "second", ttl=0.05)
+    assert backend.get("key") == "second"
+    time.sleep(0.1)
+    # An expired key counts as absent
+    assert backend.compare_and_set("key", None, "third")
@@ -0,0 +1,80 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import app
+
+def wait_for(predicate, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+def run_concurrently(flights, key, func, callers=5):
+    """Start callers at once; the first leads and blocks in func until the rest have joined"""
+    executor = ThreadPoolExecutor(callers)
+    futures = [executor.submit(flights.do, key, func)]
+    assert wait_for(lambda: flights.stats()["in_flight"] == 1)
+    futures += [executor.submit(flights.do, key, func) for _ in range(callers - 1)]
+    assert wait_for(lambda: flights.stats()["coalesced_waiters"] == callers - 1)
+    executor.shutdown(wait=False)
+    return futures
+
+def test_concurrent_callers_share_one_call():
+    flights, release, calls = app.SingleFlight(timeout=5), threading.Event(), []
+    def fetch():
+        calls.append(1)
+        release.wait(5)
+        return {"data": 1}
+    futures = run_concurrently(flights, "url", fetch)
+    release.set()
+    results = [future.result() for future in futures]
+    assert len(calls) == 1
+    assert all(result is results[0] for result in results)
+    assert flights.stats() == {"in_flight": 0, "leaders": 1, "coalesced_waiters": 4, "timeouts": 0}
+    # Finished calls are not cached: the next caller leads a new one
+    assert flights.do("url", fetch) == {"data": 1}
+    assert len(calls) == 2
+
+def test_errors_reach_every_caller():
+    flights, release = app.SingleFlight(timeout=5), threading.Event()
+    def fail():
+        release.wait(5)
+        raise ValueError("upstream down")
+    futures = run_concurrently(flights, "url", fail, callers=3)
+    release.set()
+    for future in futures:
+        with pytest.raises(ValueError, match="upstream down"):
+            future.result()
+
+def test_waiters_give_up_after_the_timeout():
+    flights, release = app.SingleFlight(timeout=0.05), threading.Event()
+    futures = run_concurrently(flights, "url", lambda: release.wait(5), callers=2)
+    with pytest.raises(TimeoutError):
+        futures[1].result()
+    release.set()
+    assert futures[0].result() is True
+    assert flights.stats()["timeouts"] == 1
+
+def test_identical_instagram_requests_are_coalesced(monkeypatch):
+    release, sent = threading.Event(), []
+    def send(url, method="GET", **kwargs):
+        sent.append(url)
+        release.wait(5)
+        return app.InstagramResult(200, {"url": url})
+    monkeypatch.setattr(app, "send_instagram_request", send)
+    url = app.profile_url("coalesced_user")
+    coalesced = app.instagram_flights.stats()["coalesced_waiters"]
+    with ThreadPoolExecutor(4) as executor:
+        futures = [executor.submit(app.make_instagram_request, url) for _ in range(4)]
+        assert wait_for(lambda: app.instagram_flights.stats()["coalesced_waiters"] - coalesced == 3)
+        release.set()
+    assert sent == [url]
+    assert all(future.result().payload == {"url": url} for future in futures)
+    # Only plain GETs are shared
+    app.make_instagram_request(url, method="POST")
+    assert len(sent) == 2
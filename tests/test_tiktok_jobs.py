@@ -0,0 +1,94 @@
+import io
+import json
+import threading
+import time
+import zipfile
+
+from shared_state import MemoryBackend
+from tiktok_jobs import DownloadJobs, stream_zip
+
+def test_stream_zip(tmp_path):
+    first = tmp_path / "a.mp4"
+    first.write_bytes(b"a" * 5000)
+    second = tmp_path / "b.mp4"
+    second.write_bytes(bytes(range(256)) * 10)
+    chunks = list(stream_zip(
+        [("tiktok_1.mp4", str(first)), ("missing.mp4", str(tmp_path / "gone.mp4")), ("tiktok_2.mp4", str(second))],
+        chunk_size=1024
+    ))
+    # Written out as the files are read, not in one piece at the end
+    assert len(chunks) > 2
+    with zipfile.ZipFile(io.BytesIO(b"".join(chunks))) as archive:
+        assert archive.testzip() is None
+        assert archive.namelist() == ["tiktok_1.mp4", "tiktok_2.mp4"]
+        assert archive.getinfo("tiktok_1.mp4").compress_type == zipfile.ZIP_STORED
+        assert archive.read("tiktok_1.mp4") == first.read_bytes()
+        assert archive.read("tiktok_2.mp4") == second.read_bytes()
+
+def test_stream_zip_empty():
+    with zipfile.ZipFile(io.BytesIO(b"".join(stream_zip([])))) as archive:
+        assert archive.namelist() == []
+
+def wait_until(predicate, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+def make_jobs(directory, state, downloads, release=None, lease_ttl=300):
+    def download(video_id, url, progress):
+        downloads.append(video_id)
+        if release is not None:
+            release.wait(5)
+        progress(3)
+        return {"path": f"/store/{video_id}.mp4", "size": 3}
+    return DownloadJobs(
+        str(directory), state,
+        lambda urls: {url: url.rsplit("/", 1)[-1] for url in urls},
+        lambda video_id: f"https://cdn.example/{video_id}",
+        download, backoff=0, lease_ttl=lease_ttl
+    )
+
+def test_job_status_is_visible_to_other_workers(tmp_path):
+    state, downloads = MemoryBackend(), []
+    first = make_jobs(tmp_path, state, downloads)
+    job_id = first.submit(["https://www.tiktok.com/@a/video/1", "https://www.tiktok.com/@a/video/2"])["job_id"]
+    assert wait_until(lambda: first.status(job_id)["status"] == "completed")
+
+    second = make_jobs(tmp_path / "elsewhere", state, [])
+    status = second.status(job_id)
+    assert status["status"] == "completed"
+    assert status["counts"]["done"] == 2
+    assert [item["video_id"] for item in second.finished_items(job_id)] == ["1", "2"]
+    assert sorted(downloads) == ["1", "2"]
+    assert second.status("unknown") is None
+
+def test_journaled_job_is_resumed_by_one_worker(tmp_path):
+    job = {
+        "id": "resumed", "created_at": time.time(), "started_at": None, "finished_at": None,
+        "items": [{"url": "https://www.tiktok.com/@a/video/9", "video_id": None, "status": "running",
+                   "attempts": 1, "bytes": 10, "size": None, "error": None}]
+    }
+    (tmp_path / "resumed.json").write_text(json.dumps(job))
+    state, downloads = MemoryBackend(), []
+    workers = [make_jobs(tmp_path, state, downloads) for _ in range(3)]
+    assert wait_until(lambda: workers[0].status("resumed")["status"] == "completed")
+    assert downloads == ["9"]
+    assert sum("resumed" in worker.published_at for worker in workers) == 1
+
+def test_lease_is_renewed_while_a_download_is_stalled(tmp_path):
+    state, downloads, release = MemoryBackend(), [], threading.Event()
+    first = make_jobs(tmp_path, state, downloads, release=release, lease_ttl=0.2)
+    job_id = first.submit(["https://www.tiktok.com/@a/video/1"])["job_id"]
+    assert wait_until(lambda: downloads == ["1"])
+    # No progress is published for several lease periods; the job must not look orphaned
+    time.sleep(0.6)
+    second = make_jobs(tmp_path, state, downloads, lease_ttl=0.2)
+    release.set()
+    assert wait_until(lambda: first.status(job_id)["status"] == "completed")
+    assert downloads == ["1"]
+    assert job_id not in second.published_at
+    first.stop()
+    second.stop()
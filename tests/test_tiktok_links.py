@@ -0,0 +1,87 @@
+import pytest
+
+from tiktok_links import ShortLinkResolver, match_video_id, short_link
+
+class FakeStore:
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ttl=None):
+        self.data[key] = value
+
+def redirects(mapping):
+    calls = []
+
+    def head(url, timeout):
+        calls.append(url)
+        return mapping[url]
+    return head, calls
+
+def test_short_link():
+    assert short_link("https://vt.tiktok.com/ZShye2gFt/") == "vt.tiktok.com/ZShye2gFt"
+    assert short_link("https:/vm.tiktok.com/ZMabc-12") == "vm.tiktok.com/ZMabc-12"
+    assert short_link("https://www.tiktok.com/t/ZT8xyz/") == "www.tiktok.com/t/ZT8xyz"
+    assert short_link("https://www.tiktok.com/@user/video/7300000000000000001") is None
+
+def test_match_video_id():
+    assert match_video_id("https://www.tiktok.com/@user/video/7300000000000000001?lang=en") == "7300000000000000001"
+    assert match_video_id("https://m.tiktok.com/v/?v=123456") == "123456"
+    assert match_video_id("https://www.tiktok.com/embed/987654/") == "987654"
+    assert match_video_id("https://www.tiktok.com/@user") is None
+
+def test_resolve_full_url_without_request():
+    head, calls = redirects({})
+    resolver = ShortLinkResolver(head)
+    assert resolver.resolve("https://www.tiktok.com/@user/video/111") == "111"
+    assert calls == []
+    with pytest.raises(ValueError):
+        resolver.resolve("https://www.tiktok.com/@user")
+
+def test_resolve_short_link_once():
+    head, calls = redirects({"https://vt.tiktok.com/ABC/": "https://www.tiktok.com/@user/video/222?is_from_webapp=1"})
+    store = FakeStore()
+    resolver = ShortLinkResolver(head, store=store)
+    assert resolver.resolve("https://vt.tiktok.com/ABC/") == "222"
+    assert resolver.resolve("vt.tiktok.com/ABC") == "222"
+    assert calls == ["https://vt.tiktok.com/ABC/"]
+    assert store.data == {"tiktok_link:vt.tiktok.com/ABC": "222"}
+
+    # A fresh resolver (another worker, a restart) finds it in the store
+    other = ShortLinkResolver(head, store=store)
+    assert other.resolve("https://vt.tiktok.com/ABC/") == "222"
+    assert len(calls) == 1
+    assert other.stats()["store_hits"] == 1
+
+def test_resolve_short_link_not_to_a_video():
+    head, _ = redirects({"https://vm.tiktok.com/XYZ/": "https://www.tiktok.com/@user"})
+    resolver = ShortLinkResolver(head)
+    with pytest.raises(ValueError):
+        resolver.resolve("https://vm.tiktok.com/XYZ/")
+    assert resolver.stats()["failures"] == 1
+    assert resolver.stats()["entries"] == 0
+
+def test_resolve_many():
+    head, calls = redirects({
+        "https://vt.tiktok.com/ONE/": "https://www.tiktok.com/@a/video/1",
+        "https://vm.tiktok.com/TWO/": "https://www.tiktok.com/@b",
+    })
+    resolver = ShortLinkResolver(head)
+    results = resolver.resolve_many([
+        "https://vt.tiktok.com/ONE/",
+        "https://vt.tiktok.com/ONE",
+        "https://vm.tiktok.com/TWO/",
+        "https://www.tiktok.com/@c/video/3",
+        "not a link",
+        "  ",
+    ])
+    assert results["https://vt.tiktok.com/ONE/"] == "1"
+    assert results["https://vt.tiktok.com/ONE"] == "1"
+    assert results["https://www.tiktok.com/@c/video/3"] == "3"
+    assert isinstance(results["https://vm.tiktok.com/TWO/"], ValueError)
+    assert isinstance(results["not a link"], ValueError)
+    assert "  " not in results
+    # Both spellings of the same short link share one request
+    assert sorted(calls) == ["https://vm.tiktok.com/TWO/", "https://vt.tiktok.com/ONE/"]
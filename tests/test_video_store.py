@@ -0,0 +1,46 @@
+import hashlib
+import os
+
+from app import VideoStore
+
+def store_video(store, video_id, data):
+    temp_path = store.temp_path(video_id)
+    with open(temp_path, "wb") as f:
+        f.write(data)
+    return store.commit(video_id, temp_path, hashlib.sha256(data).hexdigest())
+
+def test_video_stored_by_another_worker_is_found(tmp_path):
+    first = VideoStore(str(tmp_path))
+    second = VideoStore(str(tmp_path))
+    stored = store_video(first, "111", b"video bytes")
+    found = second.get("111")
+    assert found is not None
+    assert found["path"] == stored["path"]
+    assert found["digest"] == stored["digest"]
+    assert second.get("222") is None
+
+def test_same_bytes_share_one_blob(tmp_path):
+    store = VideoStore(str(tmp_path))
+    first = store_video(store, "111", b"same")
+    second = store_video(store, "222", b"same")
+    assert first["path"] == second["path"]
+    assert store.stats()["blobs"] == 1
+
+def test_startup_keeps_recent_unreferenced_blobs(tmp_path):
+    first = VideoStore(str(tmp_path))
+    stored = store_video(first, "111", b"video bytes")
+    # A commit by another worker lands its blob before its id file
+    os.remove(first.meta_path("111"))
+    VideoStore(str(tmp_path))
+    assert os.path.exists(stored["path"])
+    # Past the grace period an unreferenced blob is garbage
+    VideoStore(str(tmp_path), grace=-1)
+    assert not os.path.exists(stored["path"])
+
+def test_truncated_blob_is_dropped(tmp_path):
+    store = VideoStore(str(tmp_path))
+    stored = store_video(store, "111", b"video bytes")
+    with open(stored["path"], "wb") as f:
+        f.write(b"video")
+    assert store.get("111") is None
+    assert not os.path.exists(store.meta_path("111"))
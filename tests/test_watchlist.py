@@ -0,0 +1,106 @@
+import time
+
+from shared_state import MemoryBackend
+from watchlist import RefreshScheduler
+
+TTLS = {"profile": 600, "stories": 120, "posts": 1800}
+
+class FakeCache:
+    """Per-part fetch times of one user's lookup; a refresh re-fetches the parts it is given"""
+
+    def __init__(self, ages):
+        self.fetched_at = {part: time.time() - age for part, age in ages.items()}
+        self.refreshes = []
+
+    def ages(self, username):
+        return {part: time.time() - at for part, at in self.fetched_at.items()}
+
+    def refresh(self, username, parts):
+        self.refreshes.append(parts)
+        for part in parts:
+            self.fetched_at[part] = time.time()
+
+    def age(self, part, age):
+        self.fetched_at[part] = time.time() - age
+
+def make_scheduler(cache, state=None, capacity=4):
+    return RefreshScheduler(
+        state or MemoryBackend(), cache.refresh, cache.ages, lambda: capacity,
+        ttls=TTLS, default_interval=1800, lead=10
+    )
+
+def run_tick(scheduler):
+    scheduler.schedule()
+    # Wait for the refreshes the tick started
+    scheduler.executor.submit(lambda: None).result()
+    while scheduler.in_progress:
+        time.sleep(0.01)
+
+def test_only_due_parts_are_refreshed():
+    cache = FakeCache({"profile": 0, "stories": 115, "posts": 0})
+    scheduler = make_scheduler(cache)
+    scheduler.watch("someone")
+    run_tick(scheduler)
+    assert cache.refreshes == [["stories"]]
+    run_tick(scheduler)
+    assert cache.refreshes == [["stories"]]
+
+def test_refresh_releases_its_lease():
+    cache = FakeCache({"profile": 0, "stories": 115, "posts": 0})
+    state = MemoryBackend()
+    scheduler = make_scheduler(cache, state)
+    scheduler.watch("someone")
+    run_tick(scheduler)
+    assert state.get("watchlist:lease:someone") is None
+    # Stories come due again well before a long interval would have let a lease lapse
+    cache.age("stories", 115)
+    run_tick(scheduler)
+    assert cache.refreshes == [["stories"], ["stories"]]
+
+def test_refresh_leased_by_another_worker_is_skipped():
+    cache = FakeCache({"profile": 0, "stories": 115, "posts": 0})
+    state = MemoryBackend()
+    scheduler = make_scheduler(cache, state)
+    scheduler.watch("someone")
+    state.incr("watchlist:lease:someone", ttl=60)
+    run_tick(scheduler)
+    assert cache.refreshes == []
+    assert scheduler.describe()[0]["skipped"] == 1
+    assert scheduler.skip_counter.values[("leased",)] == 1
+
+def test_interval_shorter_than_ttl_wins():
+    cache = FakeCache({"profile": 65, "stories": 0, "posts": 0})
+    scheduler = make_scheduler(cache)
+    scheduler.watch("someone", interval=60)
+    run_tick(scheduler)
+    assert cache.refreshes == [["profile"]]
+
+def test_missing_parts_are_due_at_once():
+    cache = FakeCache({})
+    cache.ages = lambda username: {"profile": None}
+    scheduler = make_scheduler(cache)
+    scheduler.watch("someone")
+    run_tick(scheduler)
+    assert cache.refreshes == [["profile"]]
+
+def test_watch_list_updates_from_several_workers_all_land():
+    state = MemoryBackend()
+    cache = FakeCache({})
+    workers = [make_scheduler(cache, state) for _ in range(2)]
+    original_get = state.get
+
+    def interleaved_get(key):
+        # Another worker adds a user between this worker's read and write, once
+        raw = original_get(key)
+        if key == "watchlist:users" and not interleaved.get("done"):
+            interleaved["done"] = True
+            workers[1].watch("other")
+        return raw
+    interleaved = {}
+    state.get = interleaved_get
+    workers[0].watch("someone")
+    state.get = original_get
+    assert sorted(workers[1].load()) == ["other", "someone"]
+    assert workers[0].unwatch("other")
+    assert not workers[1].unwatch("other")
+    assert sorted(workers[1].load()) == ["someone"]
@@ -1,10 +1,12 @@
 import os
-import re
 import requests
 import cloudscraper
 from bs4 import BeautifulSoup
 from urllib.parse import urlparse, parse_qs
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from client_pool import ClientPool
+from tiktok_links import ShortLinkResolver
 
 # Configure logging
 logging.basicConfig(
@@ -13,15 +15,37 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+def create_scraper():
+    return cloudscraper.create_scraper(
+        browser={
+            'browser': 'chrome',
+            'platform': 'windows',
+            'mobile': False
+        }
+    )
+
+# Shared by every TikTokDownloader so the Cloudflare handshake is paid once per scraper,
+# not once per downloader
+scraper_pool = ClientPool(
+    "cloudscraper",
+    create_scraper,
+    size=int(os.getenv("TIKTOK_SCRAPER_POOL_SIZE", "2")),
+    checkout_timeout=float(os.getenv("TIKTOK_SCRAPER_CHECKOUT_TIMEOUT", "30")),
+    max_uses=int(os.getenv("TIKTOK_SCRAPER_MAX_USES", "200")),
+    max_age=int(os.getenv("TIKTOK_SCRAPER_MAX_AGE", "1800"))
+)
+
+def follow_redirects(url, timeout):
+    with scraper_pool.client() as scraper:
+        return scraper.head(url, allow_redirects=True, timeout=timeout).url
+
+# Short link -> video id, shared by every TikTokDownloader
+link_resolver = ShortLinkResolver(follow_redirects, timeout=(3.05, float(os.getenv("TIKTOK_LINK_TIMEOUT", "5"))))
+
 class TikTokDownloader:
-    def __init__(self):
-        self.scraper = cloudscraper.create_scraper(
-            browser={
-                'browser': 'chrome',
-                'platform': 'windows',
-                'mobile': False
-            }
-        )
+    def __init__(self, scrapers=None, links=None):
+        self.scrapers = scrapers or scraper_pool
+        self.links = links or link_resolver
         self.headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
             'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
@@ -35,52 +59,38 @@ class TikTokDownloader:
     def extract_video_id(self, url):
         """Extract video ID from various TikTok URL formats."""
         try:
-            # Handle shortened URLs
-            if 'vt.tiktok.com' in url:
-                response = self.scraper.head(url, allow_redirects=True)
-                url = response.url
-
-            # Extract video ID using regex
-            patterns = [
-                r'/video/(\d+)',  # Standard format
-                r'video/(\d+)',   # Alternative format
-                r'v=(\d+)',       # Query parameter format
-                r'/(\d+)/?$'      # Direct ID format
-            ]
-
-            for pattern in patterns:
-                match = re.search(pattern, url)
-                if match:
-                    return match.group(1)
-
-            raise ValueError("Could not extract video ID from URL")
-
+            return self.links.resolve(url)
         except Exception as e:
             logger.error(f"Error extracting video ID: {str(e)}")
             raise
 
+    def extract_video_ids(self, urls):
+        """Extract video IDs for many URLs, resolving short links concurrently."""
+        return self.links.resolve_many(urls)
+
     def get_video_url(self, video_id):
         """Get video URL without watermark."""
         try:
             # Use ssstik.io API to get video without watermark
             api_url = f"https://ssstik.io/abc?url=https://www.tiktok.com/@tiktok/video/{video_id}"
             
-            # First request to get the token
-            response = self.scraper.get(api_url, headers=self.headers)
-            soup = BeautifulSoup(response.text, 'html.parser')
-            
-            # Extract the token
-            token = soup.find('input', {'name': 'token'})['value']
-            
-            # Prepare data for the second request
-            data = {
-                'id': video_id,
-                'token': token,
-                'tt_watermark': 'off'
-            }
-            
-            # Second request to get the download URL
-            response = self.scraper.post(api_url, data=data, headers=self.headers)
+            with self.scrapers.client() as scraper:
+                # First request to get the token
+                response = scraper.get(api_url, headers=self.headers)
+                soup = BeautifulSoup(response.text, 'html.parser')
+                
+                # Extract the token
+                token = soup.find('input', {'name': 'token'})['value']
+                
+                # Prepare data for the second request
+                data = {
+                    'id': video_id,
+                    'token': token,
+                    'tt_watermark': 'off'
+                }
+                
+                # Second request to get the download URL
+                response = scraper.post(api_url, data=data, headers=self.headers)
             soup = BeautifulSoup(response.text, 'html.parser')
             
             # Find the download link
@@ -95,47 +105,99 @@ class TikTokDownloader:
             logger.error(f"Error getting video URL: {str(e)}")
             raise
 
-    def download_video(self, url, output_dir='downloads'):
+    def stream_video(self, url, output_dir='downloads', chunk_size=1024 * 1024):
+        """
+        Stream a TikTok video without watermark, saving it to disk as it goes.
+        
+        Yields each chunk as soon as it arrives and returns the saved path. The
+        file appears at output_dir/tiktok_<id>.mp4 only once the download has completed.
+        
+        Args:
+            url (str): TikTok video URL (any format)
+            output_dir (str): Directory to save the video
+            chunk_size (int): Bytes per chunk read from the upstream response
+        """
+        # Create output directory if it doesn't exist
+        os.makedirs(output_dir, exist_ok=True)
+        
+        # Extract video ID
+        video_id = self.extract_video_id(url)
+        logger.info(f"Extracted video ID: {video_id}")
+        
+        # Get video URL without watermark
+        video_url = self.get_video_url(video_id)
+        logger.info("Got video URL without watermark")
+        
+        # Tee the download into a temp file, then rename it into place
+        video_path = os.path.join(output_dir, f"tiktok_{video_id}.mp4")
+        temp_path = f"{video_path}.{os.getpid()}.tmp"
+        with self.scrapers.client() as scraper:
+            response = scraper.get(video_url, headers=self.headers, stream=True)
+            try:
+                with open(temp_path, 'wb') as f:
+                    for chunk in response.iter_content(chunk_size=chunk_size):
+                        if chunk:
+                            f.write(chunk)
+                            yield chunk
+                os.replace(temp_path, video_path)
+                logger.info(f"Video downloaded successfully: {video_path}")
+                return video_path
+            finally:
+                response.close()
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+
+    def download_video(self, url, output_dir='downloads', chunk_size=1024 * 1024):
         """
         Download TikTok video without watermark.
         
         Args:
             url (str): TikTok video URL (any format)
             output_dir (str): Directory to save the video
+            chunk_size (int): Bytes per chunk read from the upstream response
             
         Returns:
             str: Path to the downloaded video
         """
         try:
-            # Create output directory if it doesn't exist
-            os.makedirs(output_dir, exist_ok=True)
-            
-            # Extract video ID
-            video_id = self.extract_video_id(url)
-            logger.info(f"Extracted video ID: {video_id}")
-            
-            # Get video URL without watermark
-            video_url = self.get_video_url(video_id)
-            logger.info("Got video URL without watermark")
-            
-            # Download the video
-            response = self.scraper.get(video_url, headers=self.headers, stream=True)
-            video_path = os.path.join(output_dir, f"tiktok_{video_id}.mp4")
-            
-            with open(video_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:
-                        f.write(chunk)
-            
-            logger.info(f"Video downloaded successfully: {video_path}")
-            return video_path
+            stream = self.stream_video(url, output_dir, chunk_size)
+            while True:
+                try:
+                    next(stream)
+                except StopIteration as done:
+                    return done.value
             
         except Exception as e:
             logger.error(f"Error downloading video: {str(e)}")
             raise
 
+    def download_videos(self, urls, output_dir='downloads', max_workers=4):
+        """
+        Download many TikTok videos concurrently.
+        
+        Args:
+            urls (list): TikTok video URLs (any format)
+            output_dir (str): Directory to save the videos
+            max_workers (int): Downloads running at once; the scraper pool also caps this
+            
+        Returns:
+            dict: url -> path of the downloaded video, or the exception it failed with
+        """
+        # Resolve all short links up front, concurrently
+        self.extract_video_ids(urls)
+        results = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {url: executor.submit(self.download_video, url, output_dir) for url in dict.fromkeys(urls)}
+            for url, future in futures.items():
+                try:
+                    results[url] = future.result()
+                except Exception as e:
+                    results[url] = e
+        return results
+
 def main():
     # Example usage
+    scraper_pool.warm()
     downloader = TikTokDownloader()
     
     # Test with different URL formats
@@ -146,13 +208,12 @@ def main():
         "https://tiktok.com/t/123456789/"
     ]
     
-    for url in test_urls:
-        try:
-            print(f"\nTesting URL: {url}")
-            video_path = downloader.download_video(url)
-            print(f"Successfully downloaded to: {video_path}")
-        except Exception as e:
-            print(f"Failed to download: {str(e)}")
+    for url, result in downloader.download_videos(test_urls).items():
+        print(f"\nTesting URL: {url}")
+        if isinstance(result, Exception):
+            print(f"Failed to download: {str(result)}")
+        else:
+            print(f"Successfully downloaded to: {result}")
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -0,0 +1,337 @@
+import os
+import json
+import time
+import uuid
+import zipfile
+import threading
+import logging
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+# Bulk TikTok downloads: a job is a list of URLs downloaded on a bounded worker pool.
+# Each job is journaled to <directory>/<job_id>.json on every item state change so
+# unfinished jobs are picked up again after a restart.
+#
+# Every worker process sees every job: job status is published to the shared state,
+# and the worker running a job holds a lease on it there. A journaled job is only
+# resumed by the worker that takes its lease, and its lease expires when the worker
+# running it dies, so an orphaned job is picked up on a later rescan.
+
+logger = logging.getLogger(__name__)
+
+FINISHED_ITEM_STATES = ("done", "failed")
+
+JOB_KEY = "tiktok_jobs:job:{}"
+LEASE_KEY = "tiktok_jobs:lease:{}"
+
+class DownloadJobs:
+    def __init__(self, directory, state, resolve_many, download_url, download, workers=4, per_host=2,
+                 retries=2, backoff=2.0, retention=7 * 24 * 3600, lease_ttl=300, publish_interval=1.0):
+        """
+        Args:
+            state: shared state backend holding job status and resume leases
+            resolve_many (callable): resolve_many(urls) -> {url: video id or exception}
+            download_url (callable): download_url(video_id) -> upstream URL to fetch
+            download (callable): download(video_id, download_url, progress) -> stored video
+                metadata with "path" and "size"; progress(n) is called per chunk written
+            lease_ttl (float): how long a job stays claimed by a worker that stopped renewing it
+            publish_interval (float): at most how often download progress is published
+        """
+        self.directory = directory
+        self.state = state
+        self.resolve_many = resolve_many
+        self.download_url = download_url
+        self.download = download
+        self.per_host = per_host
+        self.retries = retries
+        self.backoff = backoff
+        self.retention = retention
+        self.lease_ttl = lease_ttl
+        self.publish_interval = publish_interval
+        self.jobs = {}  # jobs this worker runs or has loaded from the journal
+        self.published_at = {}  # job id -> when its status was last published
+        self.host_slots = defaultdict(lambda: threading.BoundedSemaphore(self.per_host))
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="tiktok-job")
+        self.lock = threading.RLock()
+        self.stopped = threading.Event()
+        os.makedirs(directory, exist_ok=True)
+        self.load_journal()
+        # Renew the leases on this worker's jobs and retry the jobs whose lease was still
+        # held by a worker that has since died
+        self.rescanner = threading.Thread(target=self.rescan, name="tiktok-job-rescan", daemon=True)
+        self.rescanner.start()
+
+    def journal_path(self, job_id):
+        return os.path.join(self.directory, f"{job_id}.json")
+
+    def claim(self, job_id):
+        """Take the lease on a job; False when another worker holds it"""
+        return self.state.incr(LEASE_KEY.format(job_id), ttl=self.lease_ttl) == 1
+
+    def publish(self, job):
+        # Caller holds the lock. Renews this worker's lease while the job runs.
+        self.published_at[job["id"]] = time.monotonic()
+        self.state.set(JOB_KEY.format(job["id"]), json.dumps(job), ttl=self.retention)
+        if job["finished_at"]:
+            self.state.delete(LEASE_KEY.format(job["id"]))
+        else:
+            self.state.set(LEASE_KEY.format(job["id"]), 1, ttl=self.lease_ttl)
+
+    def save(self, job):
+        # Caller holds the lock
+        temp_path = f"{self.journal_path(job['id'])}.{os.getpid()}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(job, f)
+        os.replace(temp_path, self.journal_path(job["id"]))
+        self.publish(job)
+
+    def renew_leases(self):
+        """Keep the leases on this worker's unfinished jobs, even while no progress is published"""
+        with self.lock:
+            for job_id, job in self.jobs.items():
+                if not job["finished_at"]:
+                    self.state.set(LEASE_KEY.format(job_id), 1, ttl=self.lease_ttl)
+
+    def rescan(self):
+        while not self.stopped.wait(self.lease_ttl / 2):
+            try:
+                self.renew_leases()
+                self.load_journal()
+            except Exception as e:
+                logger.error(f"Rescanning the job journal failed: {str(e)}")
+
+    def stop(self):
+        self.stopped.set()
+        self.executor.shutdown(wait=False)
+
+    def load_journal(self):
+        resumed = 0
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if not name.endswith(".json"):
+                # Left behind by a worker that died mid-write; other workers may be writing theirs
+                try:
+                    if name.endswith(".tmp") and time.time() - os.path.getmtime(path) > self.lease_ttl:
+                        os.remove(path)
+                except FileNotFoundError:
+                    pass
+                continue
+            job_id = name[:-len(".json")]
+            with self.lock:
+                if job_id in self.jobs:
+                    continue
+            try:
+                with open(path) as f:
+                    job = json.load(f)
+            except (OSError, ValueError):
+                logger.warning(f"Skipping unreadable job journal {name}")
+                continue
+            if job.get("finished_at"):
+                if time.time() - job["finished_at"] > self.retention:
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                    continue
+                with self.lock:
+                    self.jobs[job["id"]] = job
+                continue
+            # Unfinished: either running on another worker or orphaned by one that died
+            if not self.claim(job["id"]):
+                continue
+            for item in job["items"]:
+                if item["status"] not in FINISHED_ITEM_STATES:
+                    item["status"] = "queued"
+                    item["bytes"] = 0
+            with self.lock:
+                self.jobs[job["id"]] = job
+                self.publish(job)
+            resumed += 1
+            self.executor.submit(self.start_job, job["id"])
+        if resumed:
+            logger.info(f"Resumed {resumed} download jobs from journal")
+
+    def submit(self, urls):
+        """Create a job for urls and queue it; returns the job's status"""
+        job = {
+            "id": uuid.uuid4().hex,
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "items": [
+                {"url": url, "video_id": None, "status": "queued", "attempts": 0, "bytes": 0, "size": None, "error": None}
+                for url in urls
+            ]
+        }
+        with self.lock:
+            self.jobs[job["id"]] = job
+            self.save(job)
+        self.executor.submit(self.start_job, job["id"])
+        return self.status(job["id"])
+
+    def start_job(self, job_id):
+        with self.lock:
+            job = self.jobs[job_id]
+            job["started_at"] = job["started_at"] or time.time()
+            unresolved = [item["url"] for item in job["items"] if item["status"] == "queued" and not item["video_id"]]
+        # Short links are resolved together, concurrently, before any download starts
+        resolved = self.resolve_many(unresolved) if unresolved else {}
+        with self.lock:
+            for index, item in enumerate(job["items"]):
+                if item["status"] != "queued":
+                    continue
+                result = resolved.get(item["url"], item["video_id"])
+                if isinstance(result, Exception) or not result:
+                    item["status"] = "failed"
+                    item["error"] = str(result) if result else "Could not resolve URL"
+                    continue
+                item["video_id"] = result
+                self.executor.submit(self.run_item, job_id, index)
+            self.save(job)
+            self.finish_if_done(job)
+
+    def run_item(self, job_id, index):
+        with self.lock:
+            job = self.jobs[job_id]
+            item = job["items"][index]
+            item["status"] = "running"
+
+        def progress(n):
+            # Not journaled: bytes only matter while the job is live
+            with self.lock:
+                item["bytes"] += n
+                if time.monotonic() - self.published_at.get(job_id, 0) >= self.publish_interval:
+                    self.publish(job)
+
+        while True:
+            with self.lock:
+                item["attempts"] += 1
+                item["bytes"] = 0
+            try:
+                url = self.download_url(item["video_id"])
+                with self.host_slots[urlparse(url).hostname or ""]:
+                    stored = self.download(item["video_id"], url, progress)
+                with self.lock:
+                    item["status"] = "done"
+                    item["size"] = stored["size"]
+                    item["bytes"] = stored["size"]
+                    item["error"] = None
+                break
+            except Exception as e:
+                logger.warning(f"Job {job_id} item {index} attempt {item['attempts']} failed: {str(e)}")
+                with self.lock:
+                    item["error"] = str(e)
+                    if item["attempts"] > self.retries:
+                        item["status"] = "failed"
+                        break
+                time.sleep(self.backoff * (2 ** (item["attempts"] - 1)))
+
+        with self.lock:
+            self.save(job)
+            self.finish_if_done(job)
+
+    def finish_if_done(self, job):
+        # Caller holds the lock
+        if job["finished_at"] or any(item["status"] not in FINISHED_ITEM_STATES for item in job["items"]):
+            return
+        job["finished_at"] = time.time()
+        self.save(job)
+
+    def snapshot(self, job_id):
+        """A copy of the job, from this worker or from the shared state; None when unknown"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is not None:
+                return dict(job, items=[dict(item) for item in job["items"]])
+        # Running on another worker
+        raw = self.state.get(JOB_KEY.format(job_id))
+        return json.loads(raw) if raw is not None else None
+
+    def status(self, job_id):
+        """Progress summary and per-item results, or None for an unknown job"""
+        job = self.snapshot(job_id)
+        if job is None:
+            return None
+        items = job["items"]
+        started_at, finished_at = job["started_at"], job["finished_at"]
+        created_at = job["created_at"]
+
+        counts = defaultdict(int)
+        for item in items:
+            counts[item["status"]] += 1
+        total_bytes = sum(item["bytes"] for item in items)
+        elapsed = ((finished_at or time.time()) - started_at) if started_at else 0
+        if finished_at:
+            state = "failed" if counts["done"] == 0 else "completed_with_errors" if counts["failed"] else "completed"
+        else:
+            state = "running" if started_at else "queued"
+        return {
+            "job_id": job_id,
+            "status": state,
+            "created_at": created_at,
+            "finished_at": finished_at,
+            "total": len(items),
+            "counts": dict(counts),
+            "progress": round((counts["done"] + counts["failed"]) / len(items), 3) if items else 1.0,
+            "bytes": total_bytes,
+            "bytes_per_sec": round(total_bytes / elapsed) if elapsed > 0 else 0,
+            "items": items
+        }
+
+    def finished_items(self, job_id):
+        job = self.snapshot(job_id)
+        if job is None:
+            return None
+        return [item for item in job["items"] if item["status"] == "done"]
+
+    def stats(self):
+        with self.lock:
+            active = sum(1 for job in self.jobs.values() if not job["finished_at"])
+            return {"jobs": len(self.jobs), "active": active}
+
+# Accumulates what ZipFile writes so it can be yielded chunk by chunk
+class ZipStreamBuffer:
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+def stream_zip(files, chunk_size=1024 * 1024):
+    """
+    Yield a zip archive of (archive name, path) pairs without building it in memory or on disk.
+
+    Entries are stored uncompressed: videos are already compressed.
+    """
+    buffer = ZipStreamBuffer()
+    with zipfile.ZipFile(buffer, mode="w", compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for name, path in files:
+            try:
+                source = open(path, "rb")
+            except FileNotFoundError:
+                # Evicted since the file list was built
+                continue
+            info = zipfile.ZipInfo(name, date_time=time.localtime(os.fstat(source.fileno()).st_mtime)[:6])
+            with source, archive.open(info, mode="w", force_zip64=True) as dest:
+                for chunk in iter(lambda: source.read(chunk_size), b""):
+                    dest.write(chunk)
+                    data = buffer.drain()
+                    if data:
+                        yield data
+    # Closing the archive writes the central directory
+    yield buffer.drain()
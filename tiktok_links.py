@@ -0,0 +1,148 @@
+import re
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# TikTok link parsing shared by app.py and tiktok_downloader.py, plus a memoized
+# resolver for short links (vt.tiktok.com, vm.tiktok.com, tiktok.com/t/...) that
+# otherwise cost a redirect-following HEAD request every time.
+
+VIDEO_PATH_PATTERNS = [
+    re.compile(r'/video/(\d+)'),  # Standard format
+    re.compile(r'video/(\d+)'),   # Alternative format
+]
+VIDEO_QUERY_PATTERN = re.compile(r'[?&]v=(\d+)')  # Query parameter format
+VIDEO_DIRECT_PATTERN = re.compile(r'/(\d+)/?$')    # Direct ID format
+# Matched anywhere in the string: route paths can arrive with "https:/" collapsed
+SHORT_LINK_PATTERN = re.compile(r'\b((?:vt|vm)\.tiktok\.com/[\w-]+|(?:www\.)?tiktok\.com/t/[\w-]+)', re.IGNORECASE)
+
+def short_link(url):
+    """Return the canonical host/code of a short link (e.g. "vt.tiktok.com/ZShye2gFt"), or None"""
+    match = SHORT_LINK_PATTERN.search(url)
+    return match.group(1) if match else None
+
+def match_video_id(url):
+    """Return the video id in a full TikTok URL, or None"""
+    path = url.split('?')[0].split('#')[0]
+    for pattern in VIDEO_PATH_PATTERNS:
+        match = pattern.search(path)
+        if match:
+            return match.group(1)
+    match = VIDEO_QUERY_PATTERN.search(url) or VIDEO_DIRECT_PATTERN.search(path)
+    return match.group(1) if match else None
+
+class ShortLinkResolver:
+    def __init__(self, head, store=None, max_entries=10000, ttl=24 * 3600, store_ttl=30 * 24 * 3600,
+                 timeout=(3.05, 5), max_workers=8):
+        """
+        Args:
+            head (callable): head(url, timeout) -> final URL after following redirects
+            store: Optional shared_state backend that keeps resolutions across restarts
+        """
+        self.head = head
+        self.store = store
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.store_ttl = store_ttl
+        self.timeout = timeout
+        self.max_workers = max_workers
+        self.entries = OrderedDict()  # short url -> (video id, resolved at), least recently used first
+        self.hits = 0
+        self.store_hits = 0
+        self.misses = 0
+        self.failures = 0
+        self.lock = threading.Lock()
+
+    def remember(self, key, video_id):
+        with self.lock:
+            self.entries[key] = (video_id, time.time())
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def lookup(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and time.time() - entry[1] <= self.ttl:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.entries.pop(key, None)
+        if self.store is not None:
+            video_id = self.store.get(f"tiktok_link:{key}")
+            if video_id:
+                with self.lock:
+                    self.store_hits += 1
+                self.remember(key, video_id)
+                return video_id
+        return None
+
+    def resolve(self, url):
+        """Return the video id for any TikTok URL, following short links at most once per TTL"""
+        key = short_link(url)
+        if key is None:
+            video_id = match_video_id(url)
+            if not video_id:
+                raise ValueError("Invalid TikTok URL format")
+            return video_id
+
+        video_id = self.lookup(key)
+        if video_id:
+            return video_id
+
+        with self.lock:
+            self.misses += 1
+        try:
+            final_url = self.head(f"https://{key}/", self.timeout)
+            video_id = match_video_id(final_url)
+            if not video_id:
+                raise ValueError(f"Short link did not redirect to a video: {final_url}")
+        except Exception:
+            with self.lock:
+                self.failures += 1
+            raise
+        self.remember(key, video_id)
+        if self.store is not None:
+            self.store.set(f"tiktok_link:{key}", video_id, ttl=self.store_ttl)
+        return video_id
+
+    def resolve_many(self, urls):
+        """Resolve a list of URLs concurrently; returns {url: video id or the exception raised}"""
+        results = {}
+        pending = {}  # short link -> the URLs spelling it
+        for url in dict.fromkeys(url.strip() for url in urls if url and url.strip()):
+            key = short_link(url)
+            cached = self.lookup(key) if key else None
+            if cached:
+                results[url] = cached
+            elif key:
+                pending.setdefault(key, []).append(url)
+            else:
+                try:
+                    results[url] = self.resolve(url)
+                except ValueError as e:
+                    results[url] = e
+        if pending:
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(pending))) as executor:
+                futures = {key: executor.submit(self.resolve, key) for key in pending}
+                for key, future in futures.items():
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        result = e
+                    for url in pending[key]:
+                        results[url] = result
+        return results
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "store_hits": self.store_hits,
+                "misses": self.misses,
+                "failures": self.failures,
+                "persistent": self.store is not None
+            }
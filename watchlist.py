@@ -0,0 +1,297 @@
+import json
+import time
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import MetricsRegistry
+
+# Refresh-ahead for watched usernames: a background thread re-fetches each cached
+# part of a watched user's lookup (profile, stories, posts) shortly before it goes
+# stale, so interactive requests for those users are always served from a warm
+# cache. Each part is refreshed on its own schedule, at the user's interval or the
+# part's cache TTL, whichever is shorter. Refreshes only run on spare cookie
+# capacity and never compete with interactive lookups for a cookie.
+#
+# The watch list lives in the shared state so every worker sees the same one; a
+# short lease per refresh keeps several workers from refreshing the same user.
+
+logger = logging.getLogger(__name__)
+
+WATCHLIST_KEY = "watchlist:users"
+
+class RefreshScheduler:
+    def __init__(self, state, refresh, cache_ages, capacity, ttls=None, default_interval=120, min_interval=30,
+                 lead=10, max_users=100, workers=2, retry_backoff=30, max_retry_backoff=900,
+                 tick=1.0, lease_ttl=120, metrics=None):
+        """
+        Args:
+            state: shared state backend holding the watch list and refresh leases
+            refresh (callable): refresh(username, parts) re-fetches the given parts of the
+                user's lookup and serves the rest from cache; raises on failure
+            cache_ages (callable): cache_ages(username) -> {part: seconds since it was
+                fetched, or None when it is not cached} for every part the lookup needs
+            ttls (dict): cache TTL per part; a part is refreshed at least this often
+            lease_ttl (float): longest a refresh is expected to take; a worker that dies
+                mid-refresh blocks the user's refreshes for at most this long
+            capacity (callable): capacity() -> how many cookies could take a background
+                request right now (not quarantined, idle and with a pacing token)
+            metrics (MetricsRegistry): where refresh lag and skip counts are reported
+        """
+        self.state = state
+        self.refresh = refresh
+        self.cache_ages = cache_ages
+        self.capacity = capacity
+        self.ttls = ttls or {}
+        self.default_interval = default_interval
+        self.min_interval = min_interval
+        self.lead = lead
+        self.max_users = max_users
+        self.retry_backoff = retry_backoff
+        self.max_retry_backoff = max_retry_backoff
+        self.tick = tick
+        self.lease_ttl = lease_ttl
+        self.status = {}  # username key -> this worker's refresh history for it
+        self.in_progress = set()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="watch-refresh")
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+        metrics = metrics or MetricsRegistry()
+        self.lag_histogram = metrics.histogram(
+            "instagram_watch_refresh_lag_seconds", "How late a watched user's refresh started after it was due",
+            buckets=(0.5, 1, 2, 5, 10, 30, 60, 300, 900)
+        )
+        self.refresh_counter = metrics.counter(
+            "instagram_watch_refreshes_total", "Background refreshes of watched users", ("outcome",)
+        )
+        self.skip_counter = metrics.counter(
+            "instagram_watch_refreshes_skipped_total", "Due refreshes of watched users that could not start", ("reason",)
+        )
+
+    def load(self):
+        """The watch list: {username key: {"username", "interval", "added_at"}}"""
+        raw = self.state.get(WATCHLIST_KEY)
+        return json.loads(raw) if raw else {}
+
+    def update(self, change):
+        """
+        Apply change(watched) to the watch list and return its result. The write only
+        lands if no other worker wrote in between; otherwise change runs again on the
+        fresh list.
+        """
+        while True:
+            raw = self.state.get(WATCHLIST_KEY)
+            watched = json.loads(raw) if raw else {}
+            result = change(watched)
+            if self.state.compare_and_set(WATCHLIST_KEY, raw, json.dumps(watched)):
+                return result
+
+    def watch(self, username, interval=None):
+        """Add a user to the watch list (or change its interval); raises ValueError"""
+        interval = max(self.min_interval, int(interval or self.default_interval))
+        key = username.lower()
+
+        def add(watched):
+            if key not in watched and len(watched) >= self.max_users:
+                raise ValueError(f"At most {self.max_users} watched users")
+            entry = watched.get(key) or {"added_at": time.time()}
+            entry.update({"username": username, "interval": interval})
+            watched[key] = entry
+            return entry
+        return self.update(add)
+
+    def unwatch(self, username):
+        key = username.lower()
+        if not self.update(lambda watched: watched.pop(key, None) is not None):
+            return False
+        with self.lock:
+            self.status.pop(key, None)
+        return True
+
+    def part_due_times(self, entry, now):
+        """When each part of a user's lookup is due: a little before it outlives its period"""
+        due = {}
+        for part, age in self.cache_ages(entry["username"]).items():
+            if age is None:
+                due[part] = now
+                continue
+            period = min(entry["interval"], self.ttls.get(part, entry["interval"]))
+            due[part] = now - age + period - min(self.lead, period / 4)
+        return due
+
+    def due_at(self, entry, now):
+        """When a user's next refresh is due: when its first part is"""
+        due = self.part_due_times(entry, now)
+        return min(due.values()) if due else now
+
+    def get_status(self, key):
+        # Caller holds the lock
+        status = self.status.get(key)
+        if status is None:
+            status = self.status[key] = {
+                "next_due": None,
+                "refreshes": 0,
+                "failures": 0,
+                "consecutive_failures": 0,
+                "retry_at": 0,
+                "skipped": 0,
+                "skipping": False,
+                "last_refresh": None,
+                "last_parts": [],
+                "last_duration": None,
+                "last_lag": None,
+                "max_lag": 0.0,
+                "lag_total": 0.0,
+                "lag_count": 0,
+                "last_error": None
+            }
+        return status
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="watch-scheduler", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.executor.shutdown(wait=False)
+
+    def run(self):
+        while not self.stopped.wait(self.tick):
+            try:
+                self.schedule()
+            except Exception as e:
+                logger.error(f"Watch list scheduling failed: {e}")
+
+    def schedule(self):
+        """Start the refreshes that are due, as far as spare cookie capacity allows"""
+        now = time.time()
+        watched = self.load()
+        due_times = {key: self.due_at(entry, now) for key, entry in watched.items() if key not in self.in_progress}
+        due = []
+        with self.lock:
+            for key in set(self.status) - set(watched):
+                del self.status[key]
+            for key, due_at in due_times.items():
+                status = self.get_status(key)
+                status["next_due"] = due_at
+                if due_at > now:
+                    status["skipping"] = False
+                elif status["retry_at"] > now:
+                    self.skip(status, "retry_backoff")
+                else:
+                    due.append((due_at, key, watched[key]))
+        if not due:
+            return
+
+        # Most overdue first; whatever does not fit in the spare capacity waits for a later tick
+        due.sort(key=lambda item: item[0])
+        spare = self.capacity()
+        for due_at, key, entry in due:
+            if spare <= 0:
+                with self.lock:
+                    self.skip(self.get_status(key), "no_capacity")
+                continue
+            if not self.claim(key):
+                with self.lock:
+                    self.skip(self.get_status(key), "leased")
+                continue
+            spare -= 1
+            with self.lock:
+                self.in_progress.add(key)
+            self.executor.submit(self.run_refresh, key, entry, due_at)
+
+    def skip(self, status, reason):
+        # Caller holds the lock. A refresh that stays blocked over several ticks counts once.
+        if not status["skipping"]:
+            status["skipping"] = True
+            status["skipped"] += 1
+            self.skip_counter.inc(reason=reason)
+
+    def claim(self, key):
+        """Take the refresh lease for a user; False when another worker is refreshing it"""
+        return self.state.incr(f"watchlist:lease:{key}", ttl=self.lease_ttl) == 1
+
+    def run_refresh(self, key, entry, due_at):
+        started = time.time()
+        lag = max(0.0, started - due_at)
+        self.lag_histogram.observe(lag)
+        with self.lock:
+            status = self.get_status(key)
+            status["skipping"] = False
+            status["last_lag"] = round(lag, 3)
+            status["max_lag"] = max(status["max_lag"], round(lag, 3))
+            status["lag_total"] += lag
+            status["lag_count"] += 1
+        try:
+            now = time.time()
+            parts = sorted(part for part, at in self.part_due_times(entry, now).items() if at <= now)
+            if parts:
+                self.refresh(entry["username"], parts)
+        except Exception as e:
+            logger.warning(f"Background refresh of {entry['username']} failed: {e}")
+            self.refresh_counter.inc(outcome="failed")
+            with self.lock:
+                status["failures"] += 1
+                status["consecutive_failures"] += 1
+                status["last_error"] = str(e)
+                backoff = self.retry_backoff * (2 ** (status["consecutive_failures"] - 1))
+                status["retry_at"] = time.time() + min(backoff, self.max_retry_backoff)
+        else:
+            self.refresh_counter.inc(outcome="ok")
+            next_due = self.due_at(entry, time.time())
+            with self.lock:
+                status["next_due"] = next_due
+                status["refreshes"] += 1
+                status["consecutive_failures"] = 0
+                status["retry_at"] = 0
+                status["last_error"] = None
+                status["last_refresh"] = time.time()
+                status["last_parts"] = parts
+                status["last_duration"] = round(status["last_refresh"] - started, 2)
+        finally:
+            # Released as soon as the refresh ends; the lease only guards the refresh itself
+            self.state.delete(f"watchlist:lease:{key}")
+            with self.lock:
+                self.in_progress.discard(key)
+
+    def describe(self):
+        """Every watched user with this worker's refresh history for it"""
+        watched = self.load()
+        now = time.time()
+        users = []
+        with self.lock:
+            for key, entry in sorted(watched.items()):
+                status = dict(self.get_status(key))
+                users.append({
+                    "username": entry["username"],
+                    "interval": entry["interval"],
+                    "refreshing": key in self.in_progress,
+                    "next_due_in": round(status["next_due"] - now, 1) if status["next_due"] is not None else None,
+                    "refreshes": status["refreshes"],
+                    "failures": status["failures"],
+                    "skipped": status["skipped"],
+                    "last_refresh_age": round(now - status["last_refresh"], 1) if status["last_refresh"] else None,
+                    "last_parts": status["last_parts"],
+                    "last_duration": status["last_duration"],
+                    "last_lag": status["last_lag"],
+                    "avg_lag": round(status["lag_total"] / status["lag_count"], 3) if status["lag_count"] else None,
+                    "max_lag": status["max_lag"],
+                    "retry_in": max(0, round(status["retry_at"] - now, 1)),
+                    "last_error": status["last_error"]
+                })
+        return users
+
+    def stats(self):
+        users = self.describe()
+        lags = [user["max_lag"] for user in users]
+        return {
+            "running": self.thread is not None and self.thread.is_alive(),
+            "watched": len(users),
+            "in_progress": sum(user["refreshing"] for user in users),
+            "refreshes": sum(user["refreshes"] for user in users),
+            "failures": sum(user["failures"] for user in users),
+            "skipped": sum(user["skipped"] for user in users),
+            "max_lag": max(lags) if lags else None
+        }